@@ -35,6 +35,12 @@ class PoolCreate(BaseModel):
     last_service: str
 
 
+# GeoJSON Point, coordinates are [longitude, latitude]
+class GeoPoint(BaseModel):
+    type: Literal["Point"] = "Point"
+    coordinates: List[float]
+
+
 # Customer Model
 class Customer(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -45,10 +51,11 @@ class Customer(BaseModel):
     phone: str
     address: str
     status: Literal["active", "paused", "inactive"] = "active"
-    account_balance: float = 0.0
+    account_balance: float = 0.0  # maintained from invoices, see services/account_balances.py
     service_day: str  # Monday, Tuesday, etc.
     route_position: int = 1
     autopay: bool = False
+    location: Optional[GeoPoint] = None
     pools: List[Pool] = []
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -60,10 +67,10 @@ class CustomerCreate(BaseModel):
     phone: str
     address: str
     status: Literal["active", "paused", "inactive"] = "active"
-    account_balance: float = 0.0
     service_day: str
     route_position: int = 1
     autopay: bool = False
+    location: Optional[GeoPoint] = None
     pools: List[PoolCreate] = []
 
 
@@ -73,10 +80,10 @@ class CustomerUpdate(BaseModel):
     phone: Optional[str] = None
     address: Optional[str] = None
     status: Optional[Literal["active", "paused", "inactive"]] = None
-    account_balance: Optional[float] = None
     service_day: Optional[str] = None
     route_position: Optional[int] = None
     autopay: Optional[bool] = None
+    location: Optional[GeoPoint] = None
 
 
 # Chemical Reading Create Model
@@ -89,6 +96,22 @@ class ChemReadingCreate(BaseModel):
     cya: int
 
 
+# Bulk Chemical Reading Models (end-of-route sync)
+class ChemReadingBulkItem(BaseModel):
+    customer_id: str
+    pool_id: str
+    date: str
+    fc: float
+    ph: float
+    ta: int
+    ch: int
+    cya: int
+
+
+class ChemReadingBulkCreate(BaseModel):
+    readings: List[ChemReadingBulkItem]
+
+
 # Quote Models
 class QuoteItem(BaseModel):
     description: str
@@ -153,6 +176,8 @@ class Job(BaseModel):
     notes: Optional[str] = None
     completion_notes: Optional[str] = None
     completed_at: Optional[datetime] = None
+    recurrence_key: Optional[str] = None  # Set on generated routine jobs
+    invoice_id: Optional[str] = None  # Set once billed
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -194,6 +219,8 @@ class Invoice(BaseModel):
     customer_id: str
     customer_name: str
     job_id: Optional[str] = None
+    job_ids: List[str] = []  # All jobs billed, for billing run invoices
+    billing_run_id: Optional[str] = None
     quote_id: Optional[str] = None
     invoice_number: str
     status: Literal["draft", "sent", "paid", "overdue", "cancelled"] = "draft"
@@ -207,6 +234,7 @@ class Invoice(BaseModel):
     due_date: str
     paid_date: Optional[str] = None
     notes: Optional[str] = None
+    dunning_level: int = 0  # Overdue reminders sent so far
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -216,7 +244,7 @@ class InvoiceCreate(BaseModel):
     customer_name: str
     job_id: Optional[str] = None
     quote_id: Optional[str] = None
-    invoice_number: str
+    invoice_number: Optional[str] = None  # Allocated from the yearly sequence when omitted
     line_items: List[InvoiceLineItem]
     subtotal: float
     tax: float = 0.0
@@ -238,6 +266,24 @@ class InvoiceUpdate(BaseModel):
     notes: Optional[str] = None
 
 
+class Payment(BaseModel):
+    model_config = ConfigDict(extra="ignore")
+    
+    id: str = Field(default_factory=lambda: f"pay-{str(uuid.uuid4())[:8]}")
+    invoice_id: str
+    customer_id: str
+    amount: float  # Negative for refunds and downward adjustments
+    method: str = "manual"  # manual, portal, autopay, adjustment, opening_balance
+    reference: Optional[str] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+
+class BillingRunCreate(BaseModel):
+    period_start: str  # YYYY-MM-DD, inclusive
+    period_end: str  # YYYY-MM-DD, inclusive
+    run_id: Optional[str] = None  # Defaults to one run per period
+    send: bool = False  # Create invoices as sent instead of draft
+
 
 # Technician Models
 class Technician(BaseModel):
@@ -283,19 +329,31 @@ class Route(BaseModel):
     day: str  # Monday, Tuesday, Wednesday, etc.
     jobs: List[str] = []  # List of job IDs in order
     total_stops: int = 0
-    estimated_duration: int = 0  # In minutes
+    estimated_duration: int = 0  # In minutes, service plus travel
+    service_minutes: float = 0.0
+    travel_minutes: float = 0.0
     status: Literal["active", "inactive"] = "active"
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 
+class RouteStop(BaseModel):
+    job_id: str
+    job: Optional[Job] = None
+    customer: Optional[Customer] = None  # Without pools, see pools
+    pools: Optional[List[Pool]] = None  # Pools serviced by the job
+
+
+class RouteDetail(Route):
+    stops: Optional[List[RouteStop]] = None  # Only with ?expand=, in route order
+
+
 class RouteCreate(BaseModel):
     name: str
     technician_id: str
     technician_name: str
     day: str
     jobs: List[str] = []
-    estimated_duration: int = 0
 
 
 class RouteUpdate(BaseModel):
@@ -304,7 +362,6 @@ class RouteUpdate(BaseModel):
     technician_name: Optional[str] = None
     day: Optional[str] = None
     jobs: Optional[List[str]] = None
-    estimated_duration: Optional[int] = None
     status: Optional[Literal["active", "inactive"]] = None
 
 
@@ -312,6 +369,23 @@ class RouteJobReorder(BaseModel):
     jobs: List[str]  # New order of job IDs
 
 
+class RouteJobsBatch(BaseModel):
+    add: List[str] = []  # Appended in order, skipped if already on the route
+    remove: List[str] = []
+
+
+class RouteBuildRequest(BaseModel):
+    date: str  # YYYY-MM-DD, jobs scheduled on this date are routed
+    shift_minutes: int = 480
+    time_budget_ms: int = 3000
+    persist: bool = False
+
+
+class TravelMatrixRequest(BaseModel):
+    customer_ids: List[str]
+    mode: Literal["haversine", "road"] = "road"
+
+
 
 # Alert Models
 class Alert(BaseModel):
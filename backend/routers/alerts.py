@@ -1,7 +1,10 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from typing import List, Optional
 from datetime import datetime, timezone
 from models import Alert, AlertCreate, AlertUpdate
+from services.anomaly import run_anomaly_scan, DEFAULT_THRESHOLD
+from services.archiving import find_with_archive, get_rollup
+from services.counters import record_change, record_changes
 
 router = APIRouter(prefix="/alerts", tags=["alerts"])
 
@@ -13,14 +16,94 @@ def init_db(database):
     db = database
 
 
-@router.get("/", response_model=List[Alert])
-async def get_alerts(
+# Chemical ranges used to raise alerts from readings:
+# field -> (label, unit, recommended low, recommended high, critical low, critical high)
+CHEM_RANGES = {
+    "fc": ("Free Chlorine (FC)", "ppm", 1.0, 3.0, 0.5, 5.0),
+    "ph": ("pH", "", 7.2, 7.6, 6.8, 8.0),
+    "ta": ("Total Alkalinity", "ppm", 80, 120, 60, 180),
+    "ch": ("Calcium Hardness", "ppm", 200, 400, 150, 600),
+    "cya": ("Cyanuric Acid", "ppm", 30, 50, 0, 90),
+}
+
+
+def check_chem_reading(reading: dict) -> List[dict]:
+    """Return alert fields (severity, title, message) for each out-of-range value"""
+    findings = []
+    for field, (label, unit, low, high, critical_low, critical_high) in CHEM_RANGES.items():
+        value = reading.get(field)
+        if value is None or low <= value <= high:
+            continue
+        direction = "Low" if value < low else "High"
+        critical = value < critical_low or value > critical_high
+        suffix = f" {unit}" if unit else ""
+        findings.append({
+            "severity": "high" if critical else "medium",
+            "title": f"{direction} {label.split(' (')[0]}",
+            "message": (
+                f"{label} is {'critically ' if critical else ''}{direction.lower()} at {value}{suffix}. "
+                f"Recommended: {low}-{high}{suffix}."
+            ),
+        })
+    return findings
+
+
+async def evaluate_chem_readings(readings: List[dict]) -> int:
+    """Raise chemical alerts for a batch of readings in one pass.
+
+    Each reading dict carries customer_id, customer_name, pool_id, pool_name and
+    the chemical values. Only the latest reading per pool is evaluated, and an
+    alert is skipped when the same unresolved alert already exists for the pool.
+    Returns the number of alerts created.
+    """
+    latest = {}
+    for reading in readings:
+        key = (reading["customer_id"], reading["pool_id"])
+        if key not in latest or reading["date"] >= latest[key]["date"]:
+            latest[key] = reading
+
+    if not latest:
+        return 0
+
+    pool_ids = list({pool_id for _, pool_id in latest})
+    open_alerts = await db.alerts.find(
+        {"type": "chemical", "resolved": False, "pool_id": {"$in": pool_ids}},
+        {"_id": 0, "pool_id": 1, "title": 1}
+    ).to_list(None)
+    existing = {(a["pool_id"], a["title"]) for a in open_alerts}
+
+    docs = []
+    for reading in latest.values():
+        for finding in check_chem_reading(reading):
+            if (reading["pool_id"], finding["title"]) in existing:
+                continue
+            alert_obj = Alert(
+                type="chemical",
+                customer_id=reading["customer_id"],
+                customer_name=reading["customer_name"],
+                pool_id=reading["pool_id"],
+                pool_name=reading["pool_name"],
+                **finding
+            )
+            doc = alert_obj.model_dump()
+            doc['created_at'] = doc['created_at'].isoformat()
+            doc['updated_at'] = doc['updated_at'].isoformat()
+            docs.append(doc)
+
+    if docs:
+        await db.alerts.insert_many(docs)
+        await record_changes("alerts", [(None, doc) for doc in docs])
+    return len(docs)
+
+
+def build_alert_query(
     resolved: Optional[bool] = None,
     severity: Optional[str] = None,
     type: Optional[str] = None,
-    customer_id: Optional[str] = None
-):
-    """Get all alerts with optional filters"""
+    customer_id: Optional[str] = None,
+    ids: Optional[List[str]] = None
+) -> dict:
+    """Build the Mongo filter shared by the list and bulk alert endpoints"""
     query = {}
     
     if resolved is not None:
@@ -35,7 +118,27 @@ async def get_alerts(
     if customer_id:
         query["customer_id"] = customer_id
     
-    alerts = await db.alerts.find(query, {"_id": 0}).to_list(1000)
+    if ids:
+        query["id"] = {"$in": ids}
+    
+    return query
+
+
+@router.get("/", response_model=List[Alert])
+async def get_alerts(
+    resolved: Optional[bool] = None,
+    severity: Optional[str] = None,
+    type: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    include_archived: bool = False
+):
+    """Get all alerts with optional filters"""
+    query = build_alert_query(resolved, severity, type, customer_id)
+    
+    if include_archived:
+        alerts = await find_with_archive("alerts", query)
+    else:
+        alerts = await db.alerts.find(query, {"_id": 0}).to_list(1000)
     
     # Convert ISO string timestamps back to datetime objects
     for alert in alerts:
@@ -49,6 +152,64 @@ async def get_alerts(
     return alerts
 
 
+@router.post("/bulk-resolve")
+async def bulk_resolve_alerts(
+    resolved: Optional[bool] = None,
+    severity: Optional[str] = None,
+    type: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    ids: Optional[List[str]] = Query(None)
+):
+    """Resolve every unresolved alert matching the filters with one update_many"""
+    query = build_alert_query(resolved, severity, type, customer_id, ids)
+    if not query:
+        raise HTTPException(status_code=400, detail="At least one filter or id is required")
+    if resolved:
+        return {"message": "Alerts already resolved", "matched": 0, "resolved": 0}
+    query["resolved"] = False
+    
+    # Collect the affected customers for the summary counters
+    matched = await db.alerts.find(query, {"_id": 0, "customer_id": 1}).to_list(None)
+    
+    now = datetime.now(timezone.utc).isoformat()
+    result = await db.alerts.update_many(
+        query,
+        {"$set": {"resolved": True, "resolved_at": now, "updated_at": now}}
+    )
+    await record_changes("alerts", [
+        ({**alert, "resolved": False}, {**alert, "resolved": True}) for alert in matched
+    ])
+    
+    return {
+        "message": f"{result.modified_count} alerts resolved",
+        "matched": result.matched_count,
+        "resolved": result.modified_count
+    }
+
+
+@router.delete("/bulk")
+async def bulk_delete_alerts(
+    resolved: Optional[bool] = None,
+    severity: Optional[str] = None,
+    type: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    ids: Optional[List[str]] = Query(None)
+):
+    """Delete every alert matching the filters with one delete_many"""
+    query = build_alert_query(resolved, severity, type, customer_id, ids)
+    if not query:
+        raise HTTPException(status_code=400, detail="At least one filter or id is required")
+    
+    matched = await db.alerts.find(query, {"_id": 0, "customer_id": 1, "resolved": 1}).to_list(None)
+    result = await db.alerts.delete_many(query)
+    await record_changes("alerts", [(alert, None) for alert in matched])
+    
+    return {
+        "message": f"{result.deleted_count} alerts deleted",
+        "deleted": result.deleted_count
+    }
+
+
 @router.get("/{alert_id}", response_model=Alert)
 async def get_alert(alert_id: str):
     """Get a specific alert by ID"""
@@ -81,6 +242,7 @@ async def create_alert(alert: AlertCreate):
         doc['resolved_at'] = doc['resolved_at'].isoformat()
     
     await db.alerts.insert_one(doc)
+    await record_change("alerts", None, doc)
     return alert_obj
 
 
@@ -110,6 +272,7 @@ async def update_alert(alert_id: str, alert_update: AlertUpdate):
     
     # Get and return updated alert
     updated_alert = await db.alerts.find_one({"id": alert_id}, {"_id": 0})
+    await record_change("alerts", existing_alert, updated_alert)
     
     # Convert ISO string timestamps back to datetime objects
     if isinstance(updated_alert.get('created_at'), str):
@@ -125,11 +288,13 @@ async def update_alert(alert_id: str, alert_update: AlertUpdate):
 @router.delete("/{alert_id}")
 async def delete_alert(alert_id: str):
     """Delete an alert"""
-    result = await db.alerts.delete_one({"id": alert_id})
+    deleted = await db.alerts.find_one_and_delete({"id": alert_id}, projection={"_id": 0})
     
-    if result.deleted_count == 0:
+    if not deleted:
         raise HTTPException(status_code=404, detail="Alert not found")
     
+    await record_change("alerts", deleted, None)
+    
     return {"message": "Alert deleted successfully"}
 
 
@@ -154,6 +319,7 @@ async def resolve_alert(alert_id: str):
     
     # Get and return updated alert
     updated_alert = await db.alerts.find_one({"id": alert_id}, {"_id": 0})
+    await record_change("alerts", existing_alert, updated_alert)
     
     # Convert ISO string timestamps back to datetime objects
     if isinstance(updated_alert.get('created_at'), str):
@@ -185,6 +351,11 @@ async def get_alert_stats():
     time_alerts = await db.alerts.count_documents({"type": "time", "resolved": False})
     cost_alerts = await db.alerts.count_documents({"type": "cost", "resolved": False})
     
+    # Add back alerts moved to the archive so historical totals stay stable
+    archived = await get_rollup("alerts")
+    total_alerts += archived.get("total", 0)
+    resolved_alerts += archived.get("resolved", 0)
+    
     return {
         "total": total_alerts,
         "unresolved": unresolved_alerts,
@@ -202,3 +373,9 @@ async def get_alert_stats():
             "cost": cost_alerts
         }
     }
+
+
+@router.post("/anomaly-scan")
+async def scan_for_anomalies(threshold: float = DEFAULT_THRESHOLD, full: bool = False):
+    """Score pools with new readings and raise leak/flow alerts (run nightly)"""
+    return await run_anomaly_scan(threshold=threshold, full=full)
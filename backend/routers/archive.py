@@ -0,0 +1,48 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from services.archiving import (
+    run_archive, get_rollup, ARCHIVE_BATCH_SIZE,
+    ALERTS_ARCHIVE_AFTER_DAYS, JOBS_ARCHIVE_AFTER_DAYS
+)
+from services.locks import LockHeld
+
+router = APIRouter(prefix="/archive", tags=["archive"])
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+@router.post("/run")
+async def run_archiving(
+    alerts_days: Optional[int] = None,
+    jobs_days: Optional[int] = None,
+    batch_size: int = ARCHIVE_BATCH_SIZE
+):
+    """Move old resolved alerts and completed jobs into the archive collections"""
+    try:
+        return await run_archive(alerts_days=alerts_days, jobs_days=jobs_days, batch_size=batch_size)
+    except LockHeld:
+        raise HTTPException(status_code=409, detail="An archive run is already in progress")
+
+
+@router.get("/stats")
+async def get_archive_stats():
+    """Get archive sizes, configured ages and archived report totals"""
+    return {
+        "alerts": {
+            "archived": await db.alerts_archive.count_documents({}),
+            "older_than_days": ALERTS_ARCHIVE_AFTER_DAYS,
+            "rollup": await get_rollup("alerts")
+        },
+        "jobs": {
+            "archived": await db.jobs_archive.count_documents({}),
+            "older_than_days": JOBS_ARCHIVE_AFTER_DAYS,
+            "rollup": await get_rollup("jobs")
+        }
+    }
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, HTTPException, status
+from typing import Optional
+
+from services.autopay import start_run, get_run
+
+router = APIRouter(prefix="/autopay", tags=["autopay"])
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+@router.post("/runs", status_code=status.HTTP_202_ACCEPTED)
+async def create_autopay_run(run_id: Optional[str] = None):
+    """Charge the open invoices of every autopay customer.
+
+    The run continues in the background; poll GET /autopay/runs/{run_id} for
+    progress. The run id defaults to one per day, so posting again the same
+    day resumes an interrupted run instead of charging twice.
+    """
+    return await start_run(run_id)
+
+
+@router.get("/runs")
+async def get_autopay_runs():
+    """Get autopay runs, newest first"""
+    return await db.autopay_runs.find({}, {"_id": 0}).sort("started_at", -1).to_list(100)
+
+
+@router.get("/runs/{run_id}")
+async def get_autopay_run(run_id: str):
+    """Get an autopay run's status and charge counts"""
+    run = await get_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Autopay run not found")
+    return run
+
+
+@router.get("/runs/{run_id}/charges")
+async def get_autopay_charges(run_id: str, status: Optional[str] = None):
+    """Get the charges of an autopay run, optionally by outcome"""
+    query = {"run_id": run_id}
+    if status:
+        query["status"] = status
+    return await db.autopay_charges.find(query, {"_id": 0}).to_list(1000)
@@ -0,0 +1,60 @@
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import StreamingResponse
+from datetime import date
+
+from models import BillingRunCreate
+from services.billing import start_run, get_run
+from services.pdfs import billing_run_zip
+
+router = APIRouter(prefix="/billing", tags=["billing"])
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+@router.post("/runs", status_code=status.HTTP_202_ACCEPTED)
+async def create_billing_run(request: BillingRunCreate):
+    """Invoice every completed, unbilled job in a period, one invoice per customer.
+
+    The run continues in the background; poll GET /billing/runs/{run_id} for
+    progress. Posting the same run again resumes it if it stopped and is a
+    no-op once it has completed.
+    """
+    try:
+        start = date.fromisoformat(request.period_start)
+        end = date.fromisoformat(request.period_end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="period_start and period_end must be YYYY-MM-DD")
+    if end < start:
+        raise HTTPException(status_code=400, detail="period_end is before period_start")
+    return await start_run(request.period_start, request.period_end, run_id=request.run_id, send=request.send)
+
+
+@router.get("/runs")
+async def get_billing_runs():
+    """Get billing runs, newest first"""
+    return await db.billing_runs.find({}, {"_id": 0}).sort("started_at", -1).to_list(100)
+
+
+@router.get("/runs/{run_id}")
+async def get_billing_run(run_id: str):
+    """Get a billing run's status and progress"""
+    run = await get_run(run_id)
+    if not run:
+        raise HTTPException(status_code=404, detail="Billing run not found")
+    return run
+
+
+@router.get("/runs/{run_id}/invoices.zip")
+async def download_billing_run_invoices(run_id: str):
+    """Download every invoice of a billing run as PDFs in one zip, streamed as they render"""
+    if not await get_run(run_id):
+        raise HTTPException(status_code=404, detail="Billing run not found")
+    return StreamingResponse(billing_run_zip(run_id), media_type="application/zip", headers={
+        "Content-Disposition": f'attachment; filename="{run_id}-invoices.zip"'
+    })
@@ -1,8 +1,15 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Optional
 from datetime import datetime, timezone
+from pymongo import UpdateOne
 
-from models import Customer, CustomerCreate, CustomerUpdate, Pool, PoolCreate, ChemReading, ChemReadingCreate
+from models import (
+    Customer, CustomerCreate, CustomerUpdate, Pool, PoolCreate,
+    ChemReading, ChemReadingCreate, ChemReadingBulkCreate
+)
+from routers.alerts import evaluate_chem_readings
+from services.account_balances import reconcile_balances
+from services.geocoding import geocode_address
 
 router = APIRouter(prefix="/customers", tags=["customers"])
 
@@ -30,6 +37,12 @@ async def get_customers():
     return customers
 
 
+@router.post("/reconcile-balances")
+async def reconcile_account_balances(customer_id: Optional[List[str]] = Query(None), dry_run: bool = False):
+    """Recompute account balances from invoices and the payments ledger and report drift"""
+    return await reconcile_balances(customer_id, fix=not dry_run)
+
+
 @router.get("/{customer_id}", response_model=Customer)
 async def get_customer(customer_id: str):
     """Get a specific customer by ID"""
@@ -59,6 +72,8 @@ async def create_customer(customer_input: CustomerCreate):
         pools.append(pool.model_dump())
     
     customer_dict['pools'] = pools
+    if not customer_dict.get('location'):
+        customer_dict['location'] = await geocode_address(customer_dict['address'])
     customer = Customer(**customer_dict)
     
     # Convert to dict and serialize datetime to ISO string for MongoDB
@@ -82,6 +97,10 @@ async def update_customer(customer_id: str, customer_update: CustomerUpdate):
     update_data = customer_update.model_dump(exclude_unset=True)
     update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
     
+    # Re-geocode when the address changes without explicit coordinates
+    if update_data.get('address') and update_data['address'] != existing_customer.get('address') and 'location' not in update_data:
+        update_data['location'] = await geocode_address(update_data['address'])
+    
     await db.customers.update_one(
         {"id": customer_id},
         {"$set": update_data}
@@ -107,6 +126,8 @@ async def delete_customer(customer_id: str):
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Customer not found")
     
+    await db.customer_summaries.delete_one({"customer_id": customer_id})
+    
     return {"message": "Customer deleted successfully"}
 
 
@@ -200,3 +221,72 @@ async def get_chem_readings(customer_id: str, pool_id: str):
             return pool.get('chem_readings', [])
     
     raise HTTPException(status_code=404, detail="Pool not found")
+
+
+@router.post("/readings/bulk")
+async def add_chem_readings_bulk(payload: ChemReadingBulkCreate):
+    """Ingest a day's chemical readings across many customers and pools.
+
+    All referenced customers are loaded in one query, readings are validated
+    against them in a single pass, and every valid reading is applied with one
+    bulk_write. Alert evaluation runs once for the whole batch.
+    """
+    customer_ids = list({item.customer_id for item in payload.readings})
+    customers = await db.customers.find(
+        {"id": {"$in": customer_ids}},
+        {"_id": 0, "id": 1, "name": 1, "pools.id": 1, "pools.name": 1, "pools.last_service": 1}
+    ).to_list(None)
+    pools_by_customer = {
+        c["id"]: {p["id"]: p for p in c.get("pools", [])} for c in customers
+    }
+    names = {c["id"]: c.get("name", "") for c in customers}
+
+    # Validate and group readings per pool
+    rejected = []
+    grouped = {}
+    for index, item in enumerate(payload.readings):
+        pools = pools_by_customer.get(item.customer_id)
+        if pools is None:
+            rejected.append({"index": index, "customer_id": item.customer_id, "pool_id": item.pool_id, "reason": "Customer not found"})
+            continue
+        if item.pool_id not in pools:
+            rejected.append({"index": index, "customer_id": item.customer_id, "pool_id": item.pool_id, "reason": "Pool not found"})
+            continue
+        grouped.setdefault((item.customer_id, item.pool_id), []).append(item)
+
+    now = datetime.now(timezone.utc).isoformat()
+    operations = []
+    evaluated = []
+    for (customer_id, pool_id), items in grouped.items():
+        items.sort(key=lambda r: r.date)
+        readings = [ChemReading(**item.model_dump(exclude={"customer_id", "pool_id"})).model_dump() for item in items]
+        pool = pools_by_customer[customer_id][pool_id]
+        last_service = max(items[-1].date, pool.get("last_service") or "")
+        operations.append(UpdateOne(
+            {"id": customer_id, "pools.id": pool_id},
+            {
+                "$push": {"pools.$.chem_readings": {"$each": readings}},
+                "$set": {"pools.$.last_service": last_service, "updated_at": now}
+            }
+        ))
+        for reading in readings:
+            evaluated.append({
+                **reading,
+                "customer_id": customer_id,
+                "customer_name": names[customer_id],
+                "pool_id": pool_id,
+                "pool_name": pool.get("name", "")
+            })
+
+    if operations:
+        await db.customers.bulk_write(operations, ordered=False)
+
+    alerts_created = await evaluate_chem_readings(evaluated)
+
+    return {
+        "applied": len(evaluated),
+        "pools_updated": len(operations),
+        "customers_updated": len({customer_id for customer_id, _ in grouped}),
+        "alerts_created": alerts_created,
+        "rejected": rejected
+    }
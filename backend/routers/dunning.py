@@ -0,0 +1,40 @@
+from fastapi import APIRouter, HTTPException
+from datetime import date as date_type
+from typing import Optional
+
+from services.dunning import run_dunning
+from services.locks import LockHeld
+
+router = APIRouter(prefix="/dunning", tags=["dunning"])
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+@router.post("/run")
+async def run_dunning_now(date: Optional[str] = None):
+    """Mark past-due invoices overdue and send due reminders now instead of waiting for the daily run"""
+    try:
+        today = date_type.fromisoformat(date) if date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
+    try:
+        return await run_dunning(today)
+    except LockHeld:
+        raise HTTPException(status_code=409, detail="A dunning run is already in progress")
+
+
+@router.get("/notices")
+async def get_notices(status: Optional[str] = None, customer_id: Optional[str] = None):
+    """Get queued and sent reminder notices, newest first"""
+    query = {}
+    if status:
+        query["status"] = status
+    if customer_id:
+        query["customer_id"] = customer_id
+    return await db.dunning_notices.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
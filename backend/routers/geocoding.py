@@ -0,0 +1,42 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+
+from services.geocoding import load_dataset, geocode_address, geocode_customers, normalize_address
+
+router = APIRouter(prefix="/geocoding", tags=["geocoding"])
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+@router.post("/dataset/load")
+async def load_geocoding_dataset(source: Optional[str] = None):
+    """Load the offline address dataset configured by GEOCODE_DATASET_PATH"""
+    try:
+        return await load_dataset(source)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+@router.get("/lookup")
+async def lookup_address(address: str):
+    """Geocode a single address against the local lookup table"""
+    location = await geocode_address(address)
+    if not location:
+        raise HTTPException(status_code=404, detail="Address not found in geocoding table")
+    return {
+        "address": address,
+        "normalized": normalize_address(address),
+        "location": location
+    }
+
+
+@router.post("/customers")
+async def geocode_all_customers(only_missing: bool = True, batch_size: int = 500):
+    """Batch geocode customer addresses and store their locations"""
+    return await geocode_customers(only_missing=only_missing, batch_size=batch_size)
@@ -1,8 +1,15 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from typing import List, Optional
 from datetime import datetime, timezone
+from pymongo.errors import DuplicateKeyError
 
 from models import Invoice, InvoiceCreate, InvoiceUpdate
+from services.counters import record_change
+from services.invoice_numbers import allocate_number, claim_number
+from services.invoice_search import SearchError, explain_search, search_invoices
+from services.locks import LockHeld
+from services.pdfs import evict as evict_pdfs, invoice_pdf, pdf_response
+from services.payments import PaymentError, get_payments, reconcile_invoices, record_payment, settle_stages
 
 router = APIRouter(prefix="/invoices", tags=["invoices"])
 
@@ -24,6 +31,65 @@ async def get_all_invoices(status: Optional[str] = None):
     return invoices
 
 
+def search_filters(
+    number_prefix: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    status: Optional[str] = None,
+    issue_from: Optional[str] = None,
+    issue_to: Optional[str] = None,
+    due_from: Optional[str] = None,
+    due_to: Optional[str] = None,
+    sort: str = "issue_date",
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    cursor: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=200)
+) -> dict:
+    return {
+        "number_prefix": number_prefix,
+        "customer_id": customer_id,
+        "status": status,
+        "issue_from": issue_from,
+        "issue_to": issue_to,
+        "due_from": due_from,
+        "due_to": due_to,
+        "sort": sort,
+        "descending": order == "desc",
+        "cursor": cursor,
+        "limit": limit
+    }
+
+
+@router.get("/search")
+async def search(filters: dict = Depends(search_filters)):
+    """Search invoices by number prefix, customer, status and issue/due date ranges.
+
+    Sorted by issue_date, due_date or total (by number for a number prefix).
+    Pass next_cursor back as cursor to get the following page.
+    """
+    try:
+        return await search_invoices(**filters)
+    except SearchError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+@router.get("/search/explain")
+async def explain(filters: dict = Depends(search_filters)):
+    """Query plan of a search: the index used and whether it sorts in memory"""
+    try:
+        return await explain_search(**filters)
+    except SearchError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+
+
+@router.post("/reconcile")
+async def reconcile_payments(invoice_id: Optional[List[str]] = Query(None)):
+    """Rebuild invoice paid amounts and balances from the payments ledger"""
+    try:
+        return await reconcile_invoices(invoice_id)
+    except LockHeld:
+        raise HTTPException(status_code=409, detail="A reconcile is already in progress")
+
+
 @router.get("/{invoice_id}", response_model=Invoice)
 async def get_invoice(invoice_id: str):
     """Get a specific invoice by ID"""
@@ -33,6 +99,15 @@ async def get_invoice(invoice_id: str):
     return invoice
 
 
+@router.get("/{invoice_id}/pdf")
+async def get_invoice_pdf(invoice_id: str):
+    """Get an invoice as a PDF"""
+    invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return pdf_response(await invoice_pdf(invoice), invoice["invoice_number"])
+
+
 @router.post("/", response_model=Invoice)
 async def create_invoice(invoice: InvoiceCreate):
     """Create a new invoice"""
@@ -42,8 +117,18 @@ async def create_invoice(invoice: InvoiceCreate):
     invoice_dict["balance_due"] = invoice_dict["total"]
     invoice_dict["paid_amount"] = 0.0
     
+    if not invoice_dict.get("invoice_number"):
+        invoice_dict["invoice_number"] = await allocate_number(int(invoice_dict["issue_date"][:4]))
+    else:
+        await claim_number(invoice_dict["invoice_number"])
+    
     new_invoice = Invoice(**invoice_dict)
-    await db.invoices.insert_one(new_invoice.model_dump())
+    doc = new_invoice.model_dump()
+    try:
+        await db.invoices.insert_one(doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=409, detail=f"Invoice number {doc['invoice_number']} already exists")
+    await record_change("invoices", None, doc)
     return new_invoice
 
 
@@ -57,28 +142,43 @@ async def update_invoice(invoice_id: str, invoice_update: InvoiceUpdate):
     update_data = invoice_update.model_dump(exclude_unset=True)
     update_data["updated_at"] = datetime.now(timezone.utc)
     
-    # Recalculate balance due if paid_amount changes
-    if "paid_amount" in update_data:
-        total = update_data.get("total", existing_invoice["total"])
-        update_data["balance_due"] = total - update_data["paid_amount"]
-        
-        # Update status based on payment
-        if update_data["balance_due"] <= 0:
-            update_data["status"] = "paid"
-            update_data["paid_date"] = datetime.now(timezone.utc).isoformat()
+    # Paid amount and balance are ledger totals; an edited paid amount is booked as an adjustment
+    paid_amount = update_data.pop("paid_amount", None)
+    update_data.pop("balance_due", None)
     
-    await db.invoices.update_one({"id": invoice_id}, {"$set": update_data})
+    if "total" in update_data:
+        # Balance follows the new total against the current ledger total in the same write
+        await db.invoices.update_one({"id": invoice_id}, [
+            {"$set": {k: {"$literal": v} for k, v in update_data.items()}},
+            *settle_stages(update_data["updated_at"])
+        ])
+    else:
+        await db.invoices.update_one({"id": invoice_id}, {"$set": update_data})
     
     updated_invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
+    await record_change("invoices", existing_invoice, updated_invoice)
+    
+    if paid_amount is not None and paid_amount != updated_invoice.get("paid_amount", 0.0):
+        try:
+            result = await record_payment(
+                invoice_id, paid_amount - updated_invoice.get("paid_amount", 0.0), method="adjustment"
+            )
+        except PaymentError as error:
+            raise HTTPException(status_code=400, detail=str(error))
+        if not result:
+            raise HTTPException(status_code=404, detail="Invoice not found")
+        updated_invoice = result["invoice"]
     return Invoice(**updated_invoice)
 
 
 @router.delete("/{invoice_id}")
 async def delete_invoice(invoice_id: str):
     """Delete an invoice"""
-    result = await db.invoices.delete_one({"id": invoice_id})
-    if result.deleted_count == 0:
+    deleted = await db.invoices.find_one_and_delete({"id": invoice_id}, projection={"_id": 0})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Invoice not found")
+    await record_change("invoices", deleted, None)
+    await evict_pdfs("invoices", invoice_id)
     return {"message": "Invoice deleted successfully"}
 
 
@@ -95,39 +195,34 @@ async def send_invoice(invoice_id: str):
     )
     
     updated_invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
+    await record_change("invoices", invoice, updated_invoice)
     return {"message": "Invoice sent", "invoice": updated_invoice}
 
 
 @router.post("/{invoice_id}/pay")
-async def pay_invoice(invoice_id: str, amount: float):
+async def pay_invoice(invoice_id: str, amount: float, method: str = "manual", reference: Optional[str] = None):
     """Record a payment for an invoice"""
-    invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
-    if not invoice:
+    if amount <= 0:
+        raise HTTPException(status_code=400, detail="Payment amount must be positive")
+    try:
+        result = await record_payment(invoice_id, amount, method=method, reference=reference)
+    except PaymentError as error:
+        raise HTTPException(status_code=400, detail=str(error))
+    if not result:
         raise HTTPException(status_code=404, detail="Invoice not found")
-    
-    current_paid = invoice.get("paid_amount", 0.0)
-    new_paid_amount = current_paid + amount
-    total = invoice["total"]
-    balance_due = total - new_paid_amount
-    
-    update_data = {
-        "paid_amount": new_paid_amount,
-        "balance_due": balance_due,
-        "updated_at": datetime.now(timezone.utc)
-    }
-    
-    if balance_due <= 0:
-        update_data["status"] = "paid"
-        update_data["paid_date"] = datetime.now(timezone.utc).isoformat()
-    
-    await db.invoices.update_one({"id": invoice_id}, {"$set": update_data})
-    
-    updated_invoice = await db.invoices.find_one({"id": invoice_id}, {"_id": 0})
-    return {"message": f"Payment of ${amount} recorded", "invoice": updated_invoice}
+    return {"message": f"Payment of ${amount} recorded", **result}
+
+
+@router.get("/{invoice_id}/payments")
+async def get_invoice_payments(invoice_id: str):
+    """Get the ledger entries of an invoice, oldest first"""
+    return await get_payments(invoice_id)
 
 
 @router.get("/by-customer/{customer_id}")
 async def get_invoices_by_customer(customer_id: str):
-    """Get all invoices for a specific customer"""
-    invoices = await db.invoices.find({"customer_id": customer_id}, {"_id": 0}).to_list(1000)
+    """Get all invoices for a specific customer, newest first"""
+    invoices = await db.invoices.find({"customer_id": customer_id}, {"_id": 0}).sort(
+        [("issue_date", -1), ("id", -1)]
+    ).to_list(1000)
     return invoices
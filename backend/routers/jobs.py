@@ -1,8 +1,14 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from typing import List, Optional
-from datetime import datetime, timezone
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timezone
 
 from models import Job, JobCreate, JobUpdate
+from services.counters import record_change
+from services.archiving import find_with_archive
+from services.recurrence import generate_routine_jobs
+from services.locks import LockHeld
+from services.scheduling import booking, find_conflicts, list_conflicts
 
 router = APIRouter(prefix="/jobs", tags=["jobs"])
 
@@ -15,15 +21,64 @@ def init_db(database):
 
 
 @router.get("/", response_model=List[Job])
-async def get_all_jobs(status: Optional[str] = None):
+async def get_all_jobs(status: Optional[str] = None, include_archived: bool = False):
     """Get all jobs, optionally filtered by status"""
     query = {}
     if status:
         query["status"] = status
+    if include_archived:
+        return await find_with_archive("jobs", query)
     jobs = await db.jobs.find(query, {"_id": 0}).to_list(1000)
     return jobs
 
 
+@router.post("/generate-routine")
+async def generate_routine(
+    weeks: int = Query(4, ge=1, le=52),
+    start_date: Optional[str] = Query(None, description="YYYY-MM-DD, defaults to today")
+):
+    """Create weekly routine service jobs for active customers on their service day.
+
+    Safe to re-run: jobs that already exist for a customer and date are skipped.
+    """
+    try:
+        start = date.fromisoformat(start_date) if start_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_date must be YYYY-MM-DD")
+    return await generate_routine_jobs(weeks=weeks, start=start)
+
+
+@router.get("/conflicts")
+async def get_conflicts(date: Optional[str] = None, technician: Optional[str] = None):
+    """Get overlapping bookings of active jobs per technician and day"""
+    conflicts = await list_conflicts(scheduled_date=date, technician=technician)
+    return {"count": len(conflicts), "conflicts": conflicts}
+
+
+def conflict_error(job: dict, conflicts: List[dict]) -> HTTPException:
+    booked = ", ".join(f"{c['id']} at {c['scheduled_time']}" for c in conflicts)
+    return HTTPException(
+        status_code=409,
+        detail=f"{job['technician']} is already booked on {job['scheduled_date']}: {booked}"
+    )
+
+
+@asynccontextmanager
+async def booking_slot(job: dict, unchecked: bool):
+    """Serialize checked bookings of the same technician and day"""
+    if unchecked:
+        yield
+        return
+    try:
+        async with booking(job):
+            yield
+    except LockHeld:
+        raise HTTPException(
+            status_code=409,
+            detail=f"Another booking for {job['technician']} on {job['scheduled_date']} is in progress, retry shortly"
+        )
+
+
 @router.get("/{job_id}", response_model=Job)
 async def get_job(job_id: str):
     """Get a specific job by ID"""
@@ -34,17 +89,24 @@ async def get_job(job_id: str):
 
 
 @router.post("/", response_model=Job)
-async def create_job(job: JobCreate):
-    """Create a new job"""
+async def create_job(job: JobCreate, allow_conflicts: bool = False):
+    """Create a new job, rejecting double bookings unless allow_conflicts is set"""
     job_dict = job.model_dump()
     new_job = Job(**job_dict)
-    await db.jobs.insert_one(new_job.model_dump())
+    doc = new_job.model_dump()
+    async with booking_slot(doc, allow_conflicts):
+        if not allow_conflicts:
+            conflicts = await find_conflicts(doc)
+            if conflicts:
+                raise conflict_error(doc, conflicts)
+        await db.jobs.insert_one(doc)
+    await record_change("jobs", None, doc)
     return new_job
 
 
 @router.put("/{job_id}", response_model=Job)
-async def update_job(job_id: str, job_update: JobUpdate):
-    """Update a job"""
+async def update_job(job_id: str, job_update: JobUpdate, allow_conflicts: bool = False):
+    """Update a job, rejecting double bookings unless allow_conflicts is set"""
     existing_job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
     if not existing_job:
         raise HTTPException(status_code=404, detail="Job not found")
@@ -56,18 +118,28 @@ async def update_job(job_id: str, job_update: JobUpdate):
     if update_data.get("status") == "completed":
         update_data["completed_at"] = datetime.now(timezone.utc)
     
-    await db.jobs.update_one({"id": job_id}, {"$set": update_data})
+    # Only re-check when the booking itself moves or becomes active again
+    rescheduled = {"technician", "scheduled_date", "scheduled_time", "status"} & update_data.keys()
+    merged = {**existing_job, **update_data}
+    async with booking_slot(merged, allow_conflicts or not rescheduled):
+        if rescheduled and not allow_conflicts:
+            conflicts = await find_conflicts(merged, exclude_id=job_id)
+            if conflicts:
+                raise conflict_error(merged, conflicts)
+        await db.jobs.update_one({"id": job_id}, {"$set": update_data})
     
     updated_job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    await record_change("jobs", existing_job, updated_job)
     return Job(**updated_job)
 
 
 @router.delete("/{job_id}")
 async def delete_job(job_id: str):
     """Delete a job"""
-    result = await db.jobs.delete_one({"id": job_id})
-    if result.deleted_count == 0:
+    deleted = await db.jobs.find_one_and_delete({"id": job_id}, projection={"_id": 0})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Job not found")
+    await record_change("jobs", deleted, None)
     return {"message": "Job deleted successfully"}
 
 
@@ -84,6 +156,7 @@ async def start_job(job_id: str):
     )
     
     updated_job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    await record_change("jobs", job, updated_job)
     return {"message": "Job started", "job": updated_job}
 
 
@@ -106,6 +179,7 @@ async def complete_job(job_id: str, completion_notes: Optional[str] = None):
     await db.jobs.update_one({"id": job_id}, {"$set": update_data})
     
     updated_job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    await record_change("jobs", job, updated_job)
     return {"message": "Job completed", "job": updated_job}
 
 
@@ -0,0 +1,33 @@
+from fastapi import APIRouter
+
+from models import TravelMatrixRequest
+from services.travel_matrix import get_matrix, cache
+
+router = APIRouter(prefix="/matrix", tags=["matrix"])
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+@router.post("/")
+async def get_travel_matrix(request: TravelMatrixRequest):
+    """Get distance (km) and travel time (minutes) matrices between customers"""
+    matrix = await get_matrix(request.customer_ids, request.mode)
+    return {
+        "customer_ids": matrix["customer_ids"],
+        "missing": matrix["missing"],
+        "mode": matrix["mode"],
+        "distances_km": matrix["distances_km"].round(3).tolist(),
+        "durations_min": matrix["durations_min"].round(1).tolist()
+    }
+
+
+@router.get("/cache")
+async def get_matrix_cache_stats():
+    """Get travel matrix cache usage"""
+    return cache.stats()
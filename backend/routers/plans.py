@@ -0,0 +1,39 @@
+from fastapi import APIRouter, HTTPException
+from datetime import date, timedelta
+from typing import Optional
+
+from services.daily_plans import get_plan, local_today, precompute_plans
+
+router = APIRouter(prefix="/plans", tags=["plans"])
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+def parse_date(value: Optional[str], days_ahead: int) -> date:
+    if not value:
+        return local_today() + timedelta(days=days_ahead)
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
+
+
+@router.post("/precompute")
+async def precompute(date: Optional[str] = None):
+    """Build and store every technician's plan for a day (tomorrow by default)"""
+    return await precompute_plans(parse_date(date, 1))
+
+
+@router.get("/{technician_id}")
+async def get_technician_plan(technician_id: str, date: Optional[str] = None, refresh: bool = False):
+    """Get a technician's precomputed plan for a day (today by default)"""
+    plan = await get_plan(technician_id, parse_date(date, 0), refresh=refresh)
+    if not plan:
+        raise HTTPException(status_code=404, detail="Plan not found")
+    return plan
@@ -1,7 +1,10 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Query
 from typing import List
 
 from routers.auth import get_current_customer
+from services.counters import get_summary
+from services.pdfs import invoice_pdf, pdf_response
+from services.statements import get_statement
 
 router = APIRouter(prefix="/portal", tags=["portal"])
 
@@ -14,6 +17,21 @@ def init_db(database):
     db = database
 
 
+async def fetch_page(collection, customer_id: str, skip: int, limit: int) -> List[dict]:
+    """Fetch one page of a customer's documents, newest first"""
+    return await collection.find(
+        {"customer_id": customer_id}, {"_id": 0}
+    ).sort("created_at", -1).skip(skip).limit(limit).to_list(limit)
+
+
+@router.get("/summary")
+async def get_customer_summary(current_customer: dict = Depends(get_current_customer)):
+    """Get alert, job, quote and invoice counters for authenticated customer"""
+    summary = await get_summary(current_customer.get("id"))
+    summary["customer_name"] = current_customer.get("name")
+    return summary
+
+
 @router.get("/pools")
 async def get_customer_pools(current_customer: dict = Depends(get_current_customer)):
     """Get all pools for authenticated customer"""
@@ -28,27 +46,29 @@ async def get_customer_pools(current_customer: dict = Depends(get_current_custom
 
 
 @router.get("/invoices")
-async def get_customer_invoices(current_customer: dict = Depends(get_current_customer)):
-    """Get all invoices for authenticated customer"""
+async def get_customer_invoices(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_customer: dict = Depends(get_current_customer)
+):
+    """Get a page of invoices for authenticated customer"""
     
     customer_id = current_customer.get("id")
-    invoices = await db.invoices.find({"customer_id": customer_id}).to_list(100)
-    
-    # Calculate totals
-    total_invoiced = sum(inv.get("total", 0) for inv in invoices)
-    total_paid = sum(inv.get("paid_amount", 0) for inv in invoices)
-    total_outstanding = sum(inv.get("balance_due", 0) for inv in invoices)
+    counters = (await get_summary(customer_id)).get("invoices", {})
+    invoices = await fetch_page(db.invoices, customer_id, skip, limit)
     
     return {
         "customer_id": customer_id,
         "customer_name": current_customer.get("name"),
         "invoices": invoices,
         "summary": {
-            "total_invoiced": round(total_invoiced, 2),
-            "total_paid": round(total_paid, 2),
-            "total_outstanding": round(total_outstanding, 2),
-            "invoice_count": len(invoices)
-        }
+            "total_invoiced": round(counters.get("total_invoiced", 0), 2),
+            "total_paid": round(counters.get("total_paid", 0), 2),
+            "total_outstanding": round(counters.get("total_outstanding", 0), 2),
+            "invoice_count": counters.get("count", 0)
+        },
+        "skip": skip,
+        "limit": limit
     }
 
 
@@ -71,53 +91,92 @@ async def get_invoice_detail(
     return invoice
 
 
+@router.get("/invoices/{invoice_id}/pdf")
+async def get_invoice_pdf(
+    invoice_id: str,
+    current_customer: dict = Depends(get_current_customer)
+):
+    """Get one of the customer's invoices as a PDF"""
+    invoice = await db.invoices.find_one(
+        {"id": invoice_id, "customer_id": current_customer.get("id")}, {"_id": 0}
+    )
+    if not invoice:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return pdf_response(await invoice_pdf(invoice), invoice["invoice_number"])
+
+
+@router.get("/statements")
+async def get_customer_statements(current_customer: dict = Depends(get_current_customer)):
+    """List the customer's monthly statements, newest first"""
+    return await db.statements.find(
+        {"customer_id": current_customer.get("id")},
+        {"_id": 0, "month": 1, "opening_balance": 1, "total_invoiced": 1, "total_paid": 1, "closing_balance": 1}
+    ).sort("month", -1).to_list(120)
+
+
+@router.get("/statements/{month}")
+async def get_customer_statement(
+    month: str,
+    current_customer: dict = Depends(get_current_customer)
+):
+    """Get the customer's statement for a month"""
+    statement = await get_statement(current_customer.get("id"), month)
+    if not statement:
+        raise HTTPException(status_code=404, detail="Statement not found")
+    return statement
+
+
 @router.get("/jobs")
-async def get_customer_jobs(current_customer: dict = Depends(get_current_customer)):
-    """Get all jobs for authenticated customer"""
+async def get_customer_jobs(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_customer: dict = Depends(get_current_customer)
+):
+    """Get a page of jobs for authenticated customer"""
     
     customer_id = current_customer.get("id")
-    jobs = await db.jobs.find({"customer_id": customer_id}).to_list(100)
-    
-    # Separate by status
-    scheduled = [j for j in jobs if j.get("status") == "scheduled"]
-    in_progress = [j for j in jobs if j.get("status") == "in-progress"]
-    completed = [j for j in jobs if j.get("status") == "completed"]
+    counters = (await get_summary(customer_id)).get("jobs", {})
+    jobs = await fetch_page(db.jobs, customer_id, skip, limit)
     
     return {
         "customer_id": customer_id,
         "customer_name": current_customer.get("name"),
         "jobs": jobs,
         "summary": {
-            "total_jobs": len(jobs),
-            "scheduled": len(scheduled),
-            "in_progress": len(in_progress),
-            "completed": len(completed)
-        }
+            "total_jobs": counters.get("total", 0),
+            "scheduled": counters.get("scheduled", 0),
+            "in_progress": counters.get("in-progress", 0),
+            "completed": counters.get("completed", 0)
+        },
+        "skip": skip,
+        "limit": limit
     }
 
 
 @router.get("/quotes")
-async def get_customer_quotes(current_customer: dict = Depends(get_current_customer)):
-    """Get all quotes for authenticated customer"""
+async def get_customer_quotes(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_customer: dict = Depends(get_current_customer)
+):
+    """Get a page of quotes for authenticated customer"""
     
     customer_id = current_customer.get("id")
-    quotes = await db.quotes.find({"customer_id": customer_id}).to_list(100)
-    
-    # Separate by status
-    pending = [q for q in quotes if q.get("status") == "pending"]
-    approved = [q for q in quotes if q.get("status") == "approved"]
-    declined = [q for q in quotes if q.get("status") == "declined"]
+    counters = (await get_summary(customer_id)).get("quotes", {})
+    quotes = await fetch_page(db.quotes, customer_id, skip, limit)
     
     return {
         "customer_id": customer_id,
         "customer_name": current_customer.get("name"),
         "quotes": quotes,
         "summary": {
-            "total_quotes": len(quotes),
-            "pending": len(pending),
-            "approved": len(approved),
-            "declined": len(declined)
-        }
+            "total_quotes": counters.get("total", 0),
+            "pending": counters.get("pending", 0),
+            "approved": counters.get("approved", 0),
+            "declined": counters.get("declined", 0)
+        },
+        "skip": skip,
+        "limit": limit
     }
 
 
@@ -153,23 +212,26 @@ async def get_service_history(current_customer: dict = Depends(get_current_custo
 
 
 @router.get("/alerts")
-async def get_customer_alerts(current_customer: dict = Depends(get_current_customer)):
-    """Get alerts related to customer's pools"""
+async def get_customer_alerts(
+    skip: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=100),
+    current_customer: dict = Depends(get_current_customer)
+):
+    """Get a page of alerts related to customer's pools"""
     
     customer_id = current_customer.get("id")
-    alerts = await db.alerts.find({"customer_id": customer_id}).to_list(100)
-    
-    # Separate by resolved status
-    unresolved = [a for a in alerts if not a.get("resolved", False)]
-    resolved = [a for a in alerts if a.get("resolved", False)]
+    counters = (await get_summary(customer_id)).get("alerts", {})
+    alerts = await fetch_page(db.alerts, customer_id, skip, limit)
     
     return {
         "customer_id": customer_id,
         "customer_name": current_customer.get("name"),
         "alerts": alerts,
         "summary": {
-            "total_alerts": len(alerts),
-            "unresolved": len(unresolved),
-            "resolved": len(resolved)
-        }
+            "total_alerts": counters.get("total", 0),
+            "unresolved": counters.get("unresolved", 0),
+            "resolved": counters.get("resolved", 0)
+        },
+        "skip": skip,
+        "limit": limit
     }
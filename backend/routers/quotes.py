@@ -3,6 +3,8 @@ from typing import List
 from datetime import datetime, timezone
 
 from models import Quote, QuoteCreate, QuoteUpdate
+from services.counters import record_change
+from services.pdfs import evict as evict_pdfs, pdf_response, quote_pdf
 
 router = APIRouter(prefix="/quotes", tags=["quotes"])
 
@@ -30,12 +32,23 @@ async def get_quote(quote_id: str):
     return quote
 
 
+@router.get("/{quote_id}/pdf")
+async def get_quote_pdf(quote_id: str):
+    """Get a quote as a PDF"""
+    quote = await db.quotes.find_one({"id": quote_id}, {"_id": 0})
+    if not quote:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    return pdf_response(await quote_pdf(quote), quote["id"])
+
+
 @router.post("/", response_model=Quote)
 async def create_quote(quote: QuoteCreate):
     """Create a new quote"""
     quote_dict = quote.model_dump()
     new_quote = Quote(**quote_dict)
-    await db.quotes.insert_one(new_quote.model_dump())
+    doc = new_quote.model_dump()
+    await db.quotes.insert_one(doc)
+    await record_change("quotes", None, doc)
     return new_quote
 
 
@@ -52,15 +65,18 @@ async def update_quote(quote_id: str, quote_update: QuoteUpdate):
     await db.quotes.update_one({"id": quote_id}, {"$set": update_data})
     
     updated_quote = await db.quotes.find_one({"id": quote_id}, {"_id": 0})
+    await record_change("quotes", existing_quote, updated_quote)
     return Quote(**updated_quote)
 
 
 @router.delete("/{quote_id}")
 async def delete_quote(quote_id: str):
     """Delete a quote"""
-    result = await db.quotes.delete_one({"id": quote_id})
-    if result.deleted_count == 0:
+    deleted = await db.quotes.find_one_and_delete({"id": quote_id}, projection={"_id": 0})
+    if not deleted:
         raise HTTPException(status_code=404, detail="Quote not found")
+    await record_change("quotes", deleted, None)
+    await evict_pdfs("quotes", quote_id)
     return {"message": "Quote deleted successfully"}
 
 
@@ -77,6 +93,7 @@ async def approve_quote(quote_id: str):
     )
     
     updated_quote = await db.quotes.find_one({"id": quote_id}, {"_id": 0})
+    await record_change("quotes", quote, updated_quote)
     return {"message": "Quote approved", "quote": updated_quote}
 
 
@@ -93,4 +110,5 @@ async def decline_quote(quote_id: str):
     )
     
     updated_quote = await db.quotes.find_one({"id": quote_id}, {"_id": 0})
+    await record_change("quotes", quote, updated_quote)
     return {"message": "Quote declined", "quote": updated_quote}
@@ -2,6 +2,8 @@ from fastapi import APIRouter, HTTPException
 from typing import Optional
 from datetime import datetime, timedelta
 
+from services.archiving import get_rollup
+
 router = APIRouter(prefix="/reports", tags=["reports"])
 
 # MongoDB will be accessed from server.py
@@ -85,22 +87,28 @@ async def get_revenue_report(
 async def get_jobs_performance():
     """Get job completion statistics"""
     
-    # Get all jobs
-    jobs = await db.jobs.find({}).to_list(1000)
-    
-    # Calculate stats
-    total_jobs = len(jobs)
-    completed_jobs = len([j for j in jobs if j.get("status") == "completed"])
-    in_progress_jobs = len([j for j in jobs if j.get("status") == "in-progress"])
-    scheduled_jobs = len([j for j in jobs if j.get("status") == "scheduled"])
-    
-    # Calculate completion rate
-    completion_rate = (completed_jobs / total_jobs * 100) if total_jobs > 0 else 0
+    # Count live jobs by service type and status in the database
+    counts = await db.jobs.aggregate([
+        {"$group": {
+            "_id": {"service_type": "$service_type", "status": "$status"},
+            "count": {"$sum": 1}
+        }}
+    ]).to_list(None)
     
-    # Jobs by service type
+    # Start from the pre-aggregated totals of archived jobs
+    archived = await get_rollup("jobs")
     service_types = {}
-    for job in jobs:
-        service_type = job.get("service_type", "Other")
+    for service_type, archived_counts in archived.get("by_service_type", {}).items():
+        service_types[service_type] = {
+            "type": service_type,
+            "total": archived_counts.get("total", 0),
+            "completed": archived_counts.get("completed", 0),
+            "in_progress": archived_counts.get("in-progress", 0),
+            "scheduled": archived_counts.get("scheduled", 0)
+        }
+    
+    for row in counts:
+        service_type = row["_id"].get("service_type") or "Other"
         if service_type not in service_types:
             service_types[service_type] = {
                 "type": service_type,
@@ -109,14 +117,23 @@ async def get_jobs_performance():
                 "in_progress": 0,
                 "scheduled": 0
             }
-        service_types[service_type]["total"] += 1
-        status = job.get("status", "")
+        service_types[service_type]["total"] += row["count"]
+        status = row["_id"].get("status", "")
         if status == "completed":
-            service_types[service_type]["completed"] += 1
+            service_types[service_type]["completed"] += row["count"]
         elif status == "in-progress":
-            service_types[service_type]["in_progress"] += 1
+            service_types[service_type]["in_progress"] += row["count"]
         elif status == "scheduled":
-            service_types[service_type]["scheduled"] += 1
+            service_types[service_type]["scheduled"] += row["count"]
+    
+    # Calculate stats
+    total_jobs = archived.get("total", 0) + sum(row["count"] for row in counts)
+    completed_jobs = sum(t["completed"] for t in service_types.values())
+    in_progress_jobs = sum(t["in_progress"] for t in service_types.values())
+    scheduled_jobs = sum(t["scheduled"] for t in service_types.values())
+    
+    # Calculate completion rate
+    completion_rate = (completed_jobs / total_jobs * 100) if total_jobs > 0 else 0
     
     return {
         "summary": {
@@ -274,6 +291,11 @@ async def get_dashboard_statistics():
     active_customers = await db.customers.count_documents({"status": "active"})
     jobs = await db.jobs.count_documents({})
     completed_jobs = await db.jobs.count_documents({"status": "completed"})
+    
+    # Include archived jobs from their pre-aggregated totals
+    archived_jobs = await get_rollup("jobs")
+    jobs += archived_jobs.get("total", 0)
+    completed_jobs += archived_jobs.get("by_status", {}).get("completed", 0)
     alerts = await db.alerts.count_documents({"resolved": False})
     
     # Get revenue
@@ -1,8 +1,19 @@
 from fastapi import APIRouter, HTTPException, status, Query
 from typing import List, Optional
 from datetime import datetime, timezone
+from pymongo import UpdateOne, UpdateMany
+import asyncio
+import uuid
 
-from models import Route, RouteCreate, RouteUpdate, RouteJobReorder
+from models import (
+    Route, RouteCreate, RouteUpdate, RouteJobReorder, RouteBuildRequest, RouteDetail, RouteJobsBatch
+)
+from services.route_builder import build_routes
+from services.route_optimizer import optimize_order, path_length
+from services.daily_plans import invalidate as invalidate_plans
+from services.route_membership import update_membership
+from services.service_time import estimate_route, estimate_travel, estimate_fields, load_stops
+from services.travel_matrix import customer_locations, matrix_for_points, minutes
 
 router = APIRouter(prefix="/routes", tags=["routes"])
 
@@ -15,6 +26,42 @@ def init_db(database):
     db = database
 
 
+EXPANDABLE = ("jobs", "customers", "pools")
+
+
+async def expand_stops(job_ids: List[str], expand: set) -> List[dict]:
+    """Resolve a route's jobs, customers and pools with one batched query per collection"""
+    jobs = await db.jobs.find({"id": {"$in": job_ids}}, {"_id": 0}).to_list(None)
+    job_by_id = {job["id"]: job for job in jobs}
+    
+    customer_by_id = {}
+    if "customers" in expand or "pools" in expand:
+        projection = {"_id": 0} if "pools" in expand else {"_id": 0, "pools": 0}
+        customers = await db.customers.find(
+            {"id": {"$in": list({job["customer_id"] for job in jobs})}}, projection
+        ).to_list(None)
+        customer_by_id = {c["id"]: c for c in customers}
+    
+    stops = []
+    for job_id in job_ids:
+        job = job_by_id.get(job_id)
+        stop = {"job_id": job_id}
+        if "jobs" in expand:
+            stop["job"] = job
+        customer = customer_by_id.get(job["customer_id"]) if job else None
+        if "pools" in expand:
+            pools = (customer or {}).get("pools", [])
+            # A job without pool ids services every pool of the customer
+            if job and job.get("pools"):
+                wanted = set(job["pools"])
+                pools = [pool for pool in pools if pool.get("id") in wanted]
+            stop["pools"] = pools
+        if "customers" in expand and customer:
+            stop["customer"] = {k: v for k, v in customer.items() if k != "pools"}
+        stops.append(stop)
+    return stops
+
+
 @router.get("/", response_model=List[Route])
 async def get_all_routes(day: Optional[str] = Query(None, description="Filter by day")):
     """Get all routes, optionally filtered by day"""
@@ -64,9 +111,140 @@ async def get_routes_by_technician(technician_id: str):
     return routes
 
 
-@router.get("/{route_id}", response_model=Route)
-async def get_route(route_id: str):
-    """Get a specific route by ID"""
+@router.post("/build")
+async def build_daily_routes(request: RouteBuildRequest):
+    """Split a day's scheduled jobs across the technicians working that day.
+
+    Jobs are balanced on service plus travel time under the shift length and
+    ordered per technician. With persist=true the date's jobs on that weekday's
+    routes are replaced by the plans (technicians without a plan lose theirs),
+    jobs of other dates stay where they are, and the jobs are reassigned.
+    """
+    try:
+        day = datetime.strptime(request.date, "%Y-%m-%d").strftime("%A")
+    except ValueError:
+        raise HTTPException(status_code=400, detail="date must be YYYY-MM-DD")
+    
+    technicians = await db.technicians.find(
+        {"status": "active", "assigned_days": day}, {"_id": 0, "id": 1, "name": 1}
+    ).sort("name", 1).to_list(None)
+    if not technicians:
+        raise HTTPException(status_code=400, detail=f"No active technicians work on {day}")
+    
+    jobs = await db.jobs.find(
+        {"scheduled_date": request.date, "status": "scheduled"},
+        {"_id": 0, "id": 1}
+    ).to_list(None)
+    stops = await load_stops([job["id"] for job in jobs])
+    located = [job for job in jobs if job["id"] in stops and stops[job["id"]]["location"]]
+    unlocated = [job for job in jobs if job["id"] in stops and not stops[job["id"]]["location"]]
+    
+    points = [stops[job["id"]]["location"] for job in located]
+    service = [stops[job["id"]]["service_minutes"] for job in located]
+    travel = minutes(matrix_for_points(points, "road")).tolist()
+    
+    # Solve off the event loop, it is CPU bound
+    routes, unassigned = await asyncio.get_running_loop().run_in_executor(
+        None, build_routes, points, service, travel, len(technicians),
+        request.shift_minutes, request.time_budget_ms / 1000
+    )
+    
+    plans = []
+    for technician, route in zip(technicians, routes):
+        travel_minutes = path_length(travel, route)
+        plans.append({
+            "technician_id": technician["id"],
+            "technician_name": technician["name"],
+            "jobs": [located[i]["id"] for i in route],
+            "service_minutes": sum(service[i] for i in route),
+            "travel_minutes": travel_minutes
+        })
+    unassigned_jobs = [located[i]["id"] for i in unassigned]
+    
+    # Jobs without coordinates go to the lightest routes with room left
+    for job in unlocated:
+        plan = min(plans, key=lambda p: p["service_minutes"] + p["travel_minutes"])
+        job_minutes = stops[job["id"]]["service_minutes"]
+        if plan["service_minutes"] + plan["travel_minutes"] + job_minutes <= request.shift_minutes:
+            plan["jobs"].append(job["id"])
+            plan["service_minutes"] += job_minutes
+        else:
+            unassigned_jobs.append(job["id"])
+    
+    for plan in plans:
+        plan["total_stops"] = len(plan["jobs"])
+        plan.update(estimate_fields(plan["service_minutes"], plan["travel_minutes"]))
+    
+    if request.persist:
+        now = datetime.now(timezone.utc).isoformat()
+        # Every planned technician needs a route for the weekday
+        await db.routes.bulk_write([
+            UpdateOne(
+                {"technician_id": plan["technician_id"], "day": day},
+                {
+                    "$set": {"technician_name": plan["technician_name"]},
+                    "$setOnInsert": {
+                        "id": f"route-{str(uuid.uuid4())[:8]}",
+                        "name": f"{day} Route - {plan['technician_name']}",
+                        "status": "active",
+                        "jobs": [],
+                        "total_stops": 0,
+                        **estimate_fields(0.0, 0.0),
+                        "created_at": now,
+                        "updated_at": now
+                    }
+                },
+                upsert=True
+            )
+            for plan in plans
+        ], ordered=False)
+        # Swap the date's jobs on every route of the weekday; other dates' jobs are kept
+        date_jobs = [job["id"] for job in jobs]
+        planned = {plan["technician_id"]: plan["jobs"] for plan in plans}
+        day_routes = await db.routes.find(
+            {"day": day}, {"_id": 0, "id": 1, "technician_id": 1}
+        ).sort("created_at", 1).to_list(None)
+        for route in day_routes:
+            # A technician with several routes that day gets the plan on the first
+            add = planned.pop(route.get("technician_id"), [])
+            await update_membership(route["id"], add, date_jobs, now)
+        job_updates = [
+            UpdateMany(
+                {"id": {"$in": plan["jobs"]}},
+                {"$set": {"technician": plan["technician_name"], "updated_at": datetime.now(timezone.utc)}}
+            )
+            for plan in plans if plan["jobs"]
+        ]
+        if job_updates:
+            await db.jobs.bulk_write(job_updates, ordered=False)
+    
+    return {
+        "date": request.date,
+        "day": day,
+        "routes": plans,
+        "unassigned_jobs": unassigned_jobs,
+        "persisted": request.persist
+    }
+
+
+@router.get("/{route_id}", response_model=RouteDetail)
+async def get_route(
+    route_id: str,
+    expand: Optional[str] = Query(None, description="Comma-separated: jobs, customers, pools")
+):
+    """Get a specific route by ID.
+
+    With expand the route's stops are returned in route order with their jobs,
+    customers and/or pools resolved, so a route page needs a single request.
+    """
+    fields = {part.strip() for part in expand.split(",") if part.strip()} if expand else set()
+    unknown = fields - set(EXPANDABLE)
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cannot expand {', '.join(sorted(unknown))}; expected any of {', '.join(EXPANDABLE)}"
+        )
+    
     route = await db.routes.find_one({"id": route_id}, {"_id": 0})
     if not route:
         raise HTTPException(
@@ -80,13 +258,16 @@ async def get_route(route_id: str):
     if isinstance(route.get('updated_at'), str):
         route['updated_at'] = datetime.fromisoformat(route['updated_at'])
     
-    return Route(**route)
+    if fields:
+        route["stops"] = await expand_stops(route.get("jobs", []), fields)
+    
+    return RouteDetail(**route)
 
 
 @router.post("/", response_model=Route, status_code=status.HTTP_201_CREATED)
 async def create_route(route_data: RouteCreate):
     """Create a new route"""
-    route = Route(**route_data.model_dump())
+    route = Route(**route_data.model_dump(), **await estimate_route(route_data.jobs))
     route.total_stops = len(route.jobs)
     
     # Convert to dict and serialize datetime to ISO string for MongoDB
@@ -96,6 +277,7 @@ async def create_route(route_data: RouteCreate):
     
     # Insert into database
     await db.routes.insert_one(doc)
+    await invalidate_plans("routes", [doc])
     
     return route
 
@@ -115,9 +297,10 @@ async def update_route(route_id: str, route_data: RouteUpdate):
     update_data = {k: v for k, v in route_data.model_dump().items() if v is not None}
     update_data["updated_at"] = datetime.now(timezone.utc).isoformat()
     
-    # Update total_stops if jobs were updated
+    # Update total_stops and the duration estimate if jobs were updated
     if "jobs" in update_data:
         update_data["total_stops"] = len(update_data["jobs"])
+        update_data.update(await estimate_route(update_data["jobs"]))
     
     # Update in database
     await db.routes.update_one(
@@ -127,6 +310,7 @@ async def update_route(route_id: str, route_data: RouteUpdate):
     
     # Fetch and return updated route
     updated = await db.routes.find_one({"id": route_id}, {"_id": 0})
+    await invalidate_plans("routes", [existing, updated])
     
     # Convert ISO string timestamps
     if isinstance(updated.get('created_at'), str):
@@ -140,91 +324,60 @@ async def update_route(route_id: str, route_data: RouteUpdate):
 @router.delete("/{route_id}", status_code=status.HTTP_204_NO_CONTENT)
 async def delete_route(route_id: str):
     """Delete a route"""
-    result = await db.routes.delete_one({"id": route_id})
+    deleted = await db.routes.find_one_and_delete({"id": route_id}, projection={"_id": 0})
     
-    if result.deleted_count == 0:
+    if deleted is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Route with id {route_id} not found"
         )
+    await invalidate_plans("routes", [deleted])
     
     return None
 
 
-@router.post("/{route_id}/add-job", response_model=Route)
-async def add_job_to_route(route_id: str, job_id: str):
-    """Add a job to a route"""
-    # Check if route exists
-    existing = await db.routes.find_one({"id": route_id}, {"_id": 0})
-    if not existing:
+async def change_membership(route_id: str, add: List[str], remove: List[str]) -> Route:
+    route = await update_membership(route_id, add, remove, datetime.now(timezone.utc).isoformat())
+    if route is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail=f"Route with id {route_id} not found"
         )
     
     # Convert ISO string timestamps
-    if isinstance(existing.get('created_at'), str):
-        existing['created_at'] = datetime.fromisoformat(existing['created_at'])
-    if isinstance(existing.get('updated_at'), str):
-        existing['updated_at'] = datetime.fromisoformat(existing['updated_at'])
-    
-    route = Route(**existing)
-    
-    # Add job if not already in route
-    if job_id not in route.jobs:
-        route.jobs.append(job_id)
-        route.total_stops = len(route.jobs)
-        route.updated_at = datetime.now(timezone.utc)
-        
-        # Update in database
-        await db.routes.update_one(
-            {"id": route_id},
-            {"$set": {
-                "jobs": route.jobs, 
-                "total_stops": route.total_stops, 
-                "updated_at": route.updated_at.isoformat()
-            }}
-        )
+    if isinstance(route.get('created_at'), str):
+        route['created_at'] = datetime.fromisoformat(route['created_at'])
+    if isinstance(route.get('updated_at'), str):
+        route['updated_at'] = datetime.fromisoformat(route['updated_at'])
     
-    return route
+    return Route(**route)
+
+
+@router.post("/{route_id}/add-job", response_model=Route)
+async def add_job_to_route(route_id: str, job_id: str):
+    """Add a job to a route"""
+    return await change_membership(route_id, add=[job_id], remove=[])
 
 
 @router.delete("/{route_id}/remove-job/{job_id}", response_model=Route)
 async def remove_job_from_route(route_id: str, job_id: str):
     """Remove a job from a route"""
-    # Check if route exists
-    existing = await db.routes.find_one({"id": route_id}, {"_id": 0})
-    if not existing:
+    return await change_membership(route_id, add=[], remove=[job_id])
+
+
+@router.post("/{route_id}/jobs/batch", response_model=Route)
+async def batch_update_route_jobs(route_id: str, batch: RouteJobsBatch):
+    """Add and remove many jobs in one atomic update.
+
+    Removals are applied first, then new jobs are appended in the given order;
+    jobs already on the route keep their position.
+    """
+    if not batch.add and not batch.remove:
         raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND,
-            detail=f"Route with id {route_id} not found"
-        )
-    
-    # Convert ISO string timestamps
-    if isinstance(existing.get('created_at'), str):
-        existing['created_at'] = datetime.fromisoformat(existing['created_at'])
-    if isinstance(existing.get('updated_at'), str):
-        existing['updated_at'] = datetime.fromisoformat(existing['updated_at'])
-    
-    route = Route(**existing)
-    
-    # Remove job if it exists in route
-    if job_id in route.jobs:
-        route.jobs.remove(job_id)
-        route.total_stops = len(route.jobs)
-        route.updated_at = datetime.now(timezone.utc)
-        
-        # Update in database
-        await db.routes.update_one(
-            {"id": route_id},
-            {"$set": {
-                "jobs": route.jobs, 
-                "total_stops": route.total_stops, 
-                "updated_at": route.updated_at.isoformat()
-            }}
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Nothing to add or remove"
         )
-    
-    return route
+    return await change_membership(route_id, add=batch.add, remove=batch.remove)
 
 
 @router.put("/{route_id}/reorder", response_model=Route)
@@ -245,10 +398,20 @@ async def reorder_route_jobs(route_id: str, reorder_data: RouteJobReorder):
         "updated_at": datetime.now(timezone.utc).isoformat()
     }
     
+    # A pure reorder only changes travel time; a different job set needs a full estimate
+    if sorted(reorder_data.jobs) == sorted(existing.get("jobs", [])):
+        update_data.update(estimate_fields(
+            existing.get("service_minutes", 0.0),
+            await estimate_travel(reorder_data.jobs)
+        ))
+    else:
+        update_data.update(await estimate_route(reorder_data.jobs))
+    
     await db.routes.update_one(
         {"id": route_id},
         {"$set": update_data}
     )
+    await invalidate_plans("routes", [existing])
     
     # Fetch and return updated route
     updated = await db.routes.find_one({"id": route_id}, {"_id": 0})
@@ -260,3 +423,70 @@ async def reorder_route_jobs(route_id: str, reorder_data: RouteJobReorder):
         updated['updated_at'] = datetime.fromisoformat(updated['updated_at'])
     
     return Route(**updated)
+
+
+@router.post("/{route_id}/optimize")
+async def optimize_route(
+    route_id: str,
+    persist: bool = False,
+    time_budget_ms: int = Query(500, ge=10, le=10000)
+):
+    """Compute a near-optimal stop order from customer coordinates.
+
+    With persist=false the new order is only returned as a preview. Jobs whose
+    customer has no location keep their relative order at the end of the route.
+    """
+    route = await db.routes.find_one({"id": route_id}, {"_id": 0})
+    if not route:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Route with id {route_id} not found"
+        )
+    
+    job_ids = route.get("jobs", [])
+    jobs = await db.jobs.find({"id": {"$in": job_ids}}, {"_id": 0, "id": 1, "customer_id": 1}).to_list(None)
+    customer_by_job = {job["id"]: job["customer_id"] for job in jobs}
+    coordinates = await customer_locations(list(customer_by_job.values()))
+    
+    located = [job_id for job_id in job_ids if customer_by_job.get(job_id) in coordinates]
+    unlocated = [job_id for job_id in job_ids if customer_by_job.get(job_id) not in coordinates]
+    
+    # Solve off the event loop, it is CPU bound
+    points = [coordinates[customer_by_job[job_id]] for job_id in located]
+    dist = matrix_for_points(points, "road").tolist()
+    order = await asyncio.get_running_loop().run_in_executor(
+        None, optimize_order, dist, time_budget_ms / 1000
+    )
+    optimized = [located[i] for i in order] + unlocated
+    
+    before = path_length(dist, list(range(len(located))))
+    after = path_length(dist, order)
+    
+    if persist and optimized != job_ids:
+        # Only while the route still has the jobs that were optimized
+        result = await db.routes.update_one(
+            {"id": route_id, "jobs": job_ids},
+            {"$set": {
+                "jobs": optimized,
+                "total_stops": len(optimized),
+                **estimate_fields(route.get("service_minutes", 0.0), await estimate_travel(optimized)),
+                "updated_at": datetime.now(timezone.utc).isoformat()
+            }}
+        )
+        if result.matched_count == 0:
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail="Route jobs changed while optimizing; run the optimization again"
+            )
+        await invalidate_plans("routes", [route])
+    
+    return {
+        "route_id": route_id,
+        "original_order": job_ids,
+        "optimized_order": optimized,
+        "before_distance_km": round(before, 2),
+        "after_distance_km": round(after, 2),
+        "saved_km": round(before - after, 2),
+        "unlocated_jobs": unlocated,
+        "persisted": persist
+    }
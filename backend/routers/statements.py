@@ -0,0 +1,52 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from services.statements import get_statement, month_bounds, statements_csv, statements_ndjson, store_statements
+
+router = APIRouter(prefix="/statements", tags=["statements"])
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+def check_month(month: str):
+    try:
+        month_bounds(month)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="month must be YYYY-MM")
+
+
+@router.get("/{month}")
+async def export_statements(month: str, format: str = Query("ndjson", pattern="^(ndjson|csv)$")):
+    """Stream every customer's statement for a month.
+
+    NDJSON gives one full statement per line; CSV gives one summary row per
+    customer.
+    """
+    check_month(month)
+    if format == "csv":
+        return StreamingResponse(statements_csv(month), media_type="text/csv", headers={
+            "Content-Disposition": f'attachment; filename="statements-{month}.csv"'
+        })
+    return StreamingResponse(statements_ndjson(month), media_type="application/x-ndjson")
+
+
+@router.post("/{month}/generate")
+async def generate_statements(month: str):
+    """Store the month's statements so customers can read them in the portal"""
+    check_month(month)
+    return await store_statements(month)
+
+
+@router.get("/{month}/customers/{customer_id}")
+async def get_customer_statement(month: str, customer_id: str):
+    """Get a customer's stored statement for a month"""
+    statement = await get_statement(customer_id, month)
+    if not statement:
+        raise HTTPException(status_code=404, detail="Statement not found")
+    return statement
@@ -7,6 +7,8 @@ import os
 from dotenv import load_dotenv
 from pathlib import Path
 
+from services import account_balances
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -23,7 +25,6 @@ mock_customers = [
         "phone": "(555) 123-4567",
         "address": "1234 Oak Street, Austin, TX 78701",
         "status": "active",
-        "account_balance": 0.0,
         "service_day": "Monday",
         "route_position": 1,
         "autopay": True,
@@ -51,7 +52,6 @@ mock_customers = [
         "phone": "(555) 234-5678",
         "address": "5678 Pine Avenue, Austin, TX 78702",
         "status": "active",
-        "account_balance": -125.50,
         "service_day": "Monday",
         "route_position": 2,
         "autopay": False,
@@ -90,7 +90,6 @@ mock_customers = [
         "phone": "(555) 345-6789",
         "address": "9012 Elm Drive, Austin, TX 78703",
         "status": "active",
-        "account_balance": 75.00,
         "service_day": "Tuesday",
         "route_position": 1,
         "autopay": True,
@@ -116,7 +115,6 @@ mock_customers = [
         "phone": "(555) 456-7890",
         "address": "3456 Maple Court, Austin, TX 78704",
         "status": "active",
-        "account_balance": 0.0,
         "service_day": "Wednesday",
         "route_position": 1,
         "autopay": True,
@@ -142,7 +140,6 @@ mock_customers = [
         "phone": "(555) 567-8901",
         "address": "7890 Cedar Lane, Austin, TX 78705",
         "status": "paused",
-        "account_balance": 0.0,
         "service_day": "Thursday",
         "route_position": 1,
         "autopay": False,
@@ -184,6 +181,11 @@ async def seed_database():
     result = await db.customers.insert_many(mock_customers)
     print(f"✅ Inserted {len(result.inserted_ids)} customers")
     
+    # Balances follow from the customers' invoices, never from seed values
+    account_balances.init_db(db)
+    balances = await account_balances.reconcile_balances([c["id"] for c in mock_customers])
+    print(f"✅ Derived account balances for {balances['checked']} customers")
+    
     # Verify insertion
     count = await db.customers.count_documents({})
     print(f"✅ Total customers in database: {count}")
@@ -4,6 +4,8 @@ from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
 from pathlib import Path
 
+from services.account_balances import balance_contribution
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -345,4 +347,12 @@ print(f"✅ Seeded {len(quotes_data)} quotes")
 print(f"✅ Seeded {len(jobs_data)} jobs")
 print(f"✅ Seeded {len(invoices_data)} invoices")
 
+# Account balances follow from the invoices just seeded
+balances = {customer["id"]: 0.0 for customer in customers}
+for invoice in invoices_data:
+    balances[invoice["customer_id"]] += balance_contribution(invoice)
+for customer_id, balance in balances.items():
+    db.customers.update_one({"id": customer_id}, {"$set": {"account_balance": round(balance, 2)}})
+print(f"✅ Derived account balances for {len(balances)} customers")
+
 client.close()
@@ -3,6 +3,7 @@ from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import asyncio
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
@@ -11,7 +12,8 @@ import uuid
 from datetime import datetime, timezone
 
 # Import routers
-from routers import customers, quotes, jobs, invoices, technicians, routes, alerts, reports, auth, portal
+from routers import customers, quotes, jobs, invoices, technicians, routes, alerts, reports, auth, portal, archive, geocoding, matrix, plans, billing, dunning, autopay, statements
+from services import anomaly, archiving, counters, geocoding as geocoding_service, travel_matrix, service_time, recurrence, route_membership, scheduling, daily_plans, payments, billing as billing_service, invoice_numbers, dunning as dunning_service, autopay as autopay_service, account_balances, pdfs, invoice_search, statements as statements_service, idempotency, locks
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -79,6 +81,35 @@ alerts.init_db(db)
 reports.init_db(db)
 auth.init_db(db)
 portal.init_db(db)
+archive.init_db(db)
+geocoding.init_db(db)
+matrix.init_db(db)
+plans.init_db(db)
+billing.init_db(db)
+dunning.init_db(db)
+autopay.init_db(db)
+statements.init_db(db)
+anomaly.init_db(db)
+archiving.init_db(db)
+counters.init_db(db)
+geocoding_service.init_db(db)
+travel_matrix.init_db(db)
+service_time.init_db(db)
+recurrence.init_db(db)
+route_membership.init_db(db)
+scheduling.init_db(db)
+daily_plans.init_db(db)
+payments.init_db(db)
+billing_service.init_db(db)
+invoice_numbers.init_db(db)
+dunning_service.init_db(db)
+autopay_service.init_db(db)
+account_balances.init_db(db)
+pdfs.init_db(db)
+invoice_search.init_db(db)
+statements_service.init_db(db)
+idempotency.init_db(db)
+locks.init_db(db)
 
 # Include additional routers in api_router
 api_router.include_router(customers.router)
@@ -91,10 +122,21 @@ api_router.include_router(alerts.router)
 api_router.include_router(reports.router)
 api_router.include_router(auth.router)
 api_router.include_router(portal.router)
+api_router.include_router(archive.router)
+api_router.include_router(geocoding.router)
+api_router.include_router(matrix.router)
+api_router.include_router(plans.router)
+api_router.include_router(billing.router)
+api_router.include_router(dunning.router)
+api_router.include_router(autopay.router)
+api_router.include_router(statements.router)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Added before CORS so replayed and rejected responses still get CORS headers
+app.add_middleware(idempotency.IdempotencyMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -110,6 +152,37 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def create_indexes():
+    await counters.ensure_indexes()
+    await geocoding_service.ensure_indexes()
+    await recurrence.ensure_indexes()
+    await scheduling.ensure_indexes()
+    await daily_plans.ensure_indexes()
+    await payments.ensure_indexes()
+    await billing_service.ensure_indexes()
+    await invoice_numbers.ensure_indexes()
+    await dunning_service.ensure_indexes()
+    await autopay_service.ensure_indexes()
+    await invoice_search.ensure_indexes()
+    await statements_service.ensure_indexes()
+    await idempotency.ensure_indexes()
+    await locks.ensure_indexes()
+    await account_balances.ensure_indexes()
+
+@app.on_event("startup")
+async def start_background_jobs():
+    pdfs.start()
+    app.state.nightly_plans = asyncio.create_task(daily_plans.run_nightly())
+    app.state.dunning = asyncio.create_task(dunning_service.run_daily())
+    await service_time.backfill_estimates()
+    await account_balances.reconcile_once()
+    await billing_service.resume_interrupted_runs()
+    await autopay_service.resume_interrupted_runs()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    app.state.nightly_plans.cancel()
+    app.state.dunning.cancel()
+    pdfs.shutdown()
     client.close()
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""Customer account balances.
+
+``Customer.account_balance`` is the negated sum of ``balance_due`` over the
+customer's issued invoices (anything but draft or cancelled): negative while
+money is owed, positive for a credit from overpayment. Every invoice write
+already reports its before/after state to the summary counters, which pass
+invoice changes on here to move the balance with ``$inc``, so reading it stays
+a point read of the customer document.
+
+``reconcile_balances`` recomputes balances in customer batches from the
+invoices and the payments ledger and reports (and by default corrects) drift.
+The ``$inc`` is a second write after the invoice's, so a crash in between
+leaves drift for it to repair. ``reconcile_once`` runs it a single time after
+deploy, so the increments build on derived balances rather than the
+free-form values customers were created with before.
+"""
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+
+from pymongo import UpdateOne
+
+from services.locks import LockHeld, lease
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+logger = logging.getLogger(__name__)
+
+RECONCILE_BATCH_SIZE = 500
+# Marker in ``migrations`` of the reconcile run once on startup
+INITIAL_RECONCILE = "account-balances-initial-reconcile"
+
+# Invoices that don't count towards what the customer owes
+UNBILLED_STATUSES = ["draft", "cancelled"]
+
+
+async def ensure_indexes():
+    await db.migrations.create_index("id", unique=True)
+
+
+def balance_contribution(invoice: Optional[dict]) -> float:
+    """Amount one invoice adds to its customer's account balance"""
+    if not invoice or invoice.get("status") in UNBILLED_STATUSES:
+        return 0.0
+    return -(invoice.get("balance_due") or 0.0)
+
+
+async def apply_invoice_changes(changes: Iterable[Tuple[Optional[dict], Optional[dict]]]):
+    """Move account balances by the effect of created, updated or deleted invoices"""
+    deltas: Dict[str, float] = {}
+    for before, after in changes:
+        doc = after or before
+        if not doc:
+            continue
+        delta = balance_contribution(after) - balance_contribution(before)
+        deltas[doc["customer_id"]] = deltas.get(doc["customer_id"], 0.0) + delta
+    operations = [
+        UpdateOne({"id": customer_id}, {"$inc": {"account_balance": round(delta, 2)}})
+        for customer_id, delta in deltas.items() if round(delta, 2)
+    ]
+    if operations:
+        await db.customers.bulk_write(operations, ordered=False)
+
+
+async def _expected_balances(customer_ids: List[str]) -> Tuple[Dict[str, float], List[str]]:
+    """Balances of a batch of customers from their invoices and the ledger.
+
+    Also returns the invoices whose stored balance_due disagrees with the
+    ledger; POST /invoices/reconcile repairs those.
+    """
+    ledger = {
+        row["_id"]: row["paid"]
+        async for row in db.payments.aggregate([
+            {"$match": {"customer_id": {"$in": customer_ids}}},
+            {"$group": {"_id": "$invoice_id", "paid": {"$sum": "$amount"}}}
+        ])
+    }
+    balances = {customer_id: 0.0 for customer_id in customer_ids}
+    invoice_drift = []
+    async for invoice in db.invoices.find(
+        {"customer_id": {"$in": customer_ids}, "status": {"$nin": UNBILLED_STATUSES}},
+        {"_id": 0, "id": 1, "customer_id": 1, "total": 1, "paid_amount": 1, "balance_due": 1}
+    ):
+        # Invoices paid before the ledger existed have no entries yet
+        paid = ledger.get(invoice["id"], invoice.get("paid_amount") or 0.0)
+        balance_due = round((invoice.get("total") or 0.0) - paid, 2)
+        if abs((invoice.get("balance_due") or 0.0) - balance_due) > 0.005:
+            invoice_drift.append(invoice["id"])
+        balances[invoice["customer_id"]] -= balance_due
+    return {customer_id: round(balance, 2) for customer_id, balance in balances.items()}, invoice_drift
+
+
+async def reconcile_balances(customer_ids: Optional[List[str]] = None, fix: bool = True) -> dict:
+    """Recompute account balances and report the customers that drifted.
+
+    Corrections only apply if the stored balance has not moved since it was
+    read, so a customer paying during the run is left for the next one.
+    """
+    query = {"id": {"$in": customer_ids}} if customer_ids else {}
+    checked = 0
+    corrected = 0
+    drifted = []
+    invoice_drift = []
+    now = datetime.now(timezone.utc).isoformat()
+
+    async def process(batch: List[dict]):
+        nonlocal corrected
+        expected, mismatched = await _expected_balances([c["id"] for c in batch])
+        invoice_drift.extend(mismatched)
+        operations = []
+        for customer in batch:
+            stored = customer.get("account_balance") or 0.0
+            balance = expected[customer["id"]]
+            if abs(stored - balance) > 0.005:
+                drifted.append({"customer_id": customer["id"], "stored": stored, "expected": balance})
+                operations.append(UpdateOne(
+                    {"id": customer["id"], "account_balance": customer.get("account_balance")},
+                    {"$set": {"account_balance": balance, "updated_at": now}}
+                ))
+        if fix and operations:
+            result = await db.customers.bulk_write(operations, ordered=False)
+            corrected += result.modified_count
+
+    batch: List[dict] = []
+    async for customer in db.customers.find(query, {"_id": 0, "id": 1, "account_balance": 1}):
+        checked += 1
+        batch.append(customer)
+        if len(batch) >= RECONCILE_BATCH_SIZE:
+            await process(batch)
+            batch = []
+    if batch:
+        await process(batch)
+
+    return {
+        "checked": checked,
+        "drifted": len(drifted),
+        "corrected": corrected,
+        "drift": drifted,
+        "invoices_out_of_sync": invoice_drift
+    }
+
+
+async def reconcile_once():
+    """Reconcile every balance the first time the service starts after deploy"""
+    if await db.migrations.find_one({"id": INITIAL_RECONCILE}):
+        return
+    try:
+        async with lease(INITIAL_RECONCILE, ttl=3600):
+            if await db.migrations.find_one({"id": INITIAL_RECONCILE}):
+                return
+            result = await reconcile_balances()
+            await db.migrations.insert_one({
+                "id": INITIAL_RECONCILE,
+                "corrected": result["corrected"],
+                "completed_at": datetime.now(timezone.utc).isoformat()
+            })
+    except LockHeld:
+        # Another worker is running it
+        return
+    logger.info("Initial account balance reconcile corrected %s customers", result["corrected"])
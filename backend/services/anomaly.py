@@ -0,0 +1,248 @@
+"""Batch anomaly scoring over pool chemical reading history.
+
+Leak alerts come from a simultaneous drop in calcium hardness and cyanuric
+acid (both only fall when water is replaced). Flow alerts come from a sustained
+drop in free chlorine, which points at poor circulation or filtration.
+
+Series for all pools are packed into NaN-padded matrices so the z-score and
+changepoint statistics are computed for the whole fleet with NumPy at once.
+"""
+from datetime import datetime, timezone
+from typing import Dict, List
+import uuid
+
+import numpy as np
+from pymongo import UpdateOne
+
+from models import Alert
+from services.counters import record_changes
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+METRICS = ["fc", "ch", "cya"]
+
+# Minimum spread per metric so a flat history does not turn noise into huge scores
+MIN_SCALE = {"fc": 0.5, "ch": 10.0, "cya": 5.0}
+
+# Number of most recent readings per pool taken into account
+WINDOW = 26
+
+# Readings needed before a pool is scored at all
+MIN_READINGS = 4
+
+DEFAULT_THRESHOLD = 3.0
+
+
+def build_matrix(series: List[List[dict]], metric: str, window: int = WINDOW) -> np.ndarray:
+    """Pack per-pool readings into a right-aligned (pools x window) matrix padded with NaN"""
+    matrix = np.full((len(series), window), np.nan)
+    for row, readings in enumerate(series):
+        values = [r.get(metric) for r in readings[-window:]]
+        if values:
+            matrix[row, window - len(values):] = np.array(values, dtype=float)
+    return matrix
+
+
+def zscore_last_change(matrix: np.ndarray, min_scale: float) -> np.ndarray:
+    """Z-score of each pool's latest change against its earlier changes"""
+    diffs = np.diff(matrix, axis=1)
+    history = diffs[:, :-1]
+    last = diffs[:, -1]
+    counts = np.sum(~np.isnan(history), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.nanmean(np.where(counts[:, None] > 0, history, 0.0), axis=1)
+        std = np.nanstd(np.where(counts[:, None] > 0, history, 0.0), axis=1)
+    scale = np.maximum(std, min_scale)
+    z = (last - mean) / scale
+    z[counts < MIN_READINGS - 2] = np.nan
+    return z
+
+
+def changepoint(matrix: np.ndarray, min_scale: float):
+    """Best mean-shift split per pool.
+
+    Returns (t, split) where t is the signed shift statistic (after minus
+    before) and split is the column index of the first reading after the shift.
+    """
+    valid = ~np.isnan(matrix)
+    values = np.where(valid, matrix, 0.0)
+    sums = np.cumsum(values, axis=1)
+    counts = np.cumsum(valid, axis=1)
+    total_sum = sums[:, -1:]
+    total_count = counts[:, -1:]
+
+    n_before = counts[:, :-1]
+    n_after = total_count - n_before
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean_before = sums[:, :-1] / n_before
+        mean_after = (total_sum - sums[:, :-1]) / n_after
+        std = np.nanstd(np.where(valid, matrix, np.nan), axis=1, keepdims=True)
+        scale = np.maximum(np.nan_to_num(std), min_scale)
+        t = (mean_after - mean_before) / (scale * np.sqrt(1.0 / n_before + 1.0 / n_after))
+    t[(n_before < 2) | (n_after < 1)] = np.nan
+
+    best_t = np.full(matrix.shape[0], np.nan)
+    best_split = np.full(matrix.shape[0], -1)
+    scored = ~np.all(np.isnan(t), axis=1)
+    if scored.any():
+        idx = np.nanargmax(np.abs(t[scored]), axis=1)
+        best_t[scored] = t[scored][np.arange(idx.size), idx]
+        best_split[scored] = idx + 1
+    return best_t, best_split
+
+
+def score_pools(series: List[List[dict]], new_counts: List[int], window: int = WINDOW) -> Dict[str, np.ndarray]:
+    """Compute leak and flow scores for every pool.
+
+    new_counts holds the number of readings per pool not seen by a previous
+    run; a changepoint only counts when it falls within those readings.
+    """
+    lengths = np.array([min(len(s), window) for s in series])
+    new = np.minimum(np.array(new_counts), lengths)
+    first_new_col = window - new
+
+    z = {}
+    shift = {}
+    for metric in METRICS:
+        matrix = build_matrix(series, metric, window)
+        z[metric] = zscore_last_change(matrix, MIN_SCALE[metric])
+        t, split = changepoint(matrix, MIN_SCALE[metric])
+        t[split < first_new_col] = np.nan
+        shift[metric] = t
+
+    # Positive when the metric fell, taking the stronger of the two signals
+    drop = {metric: np.fmax(-z[metric], -shift[metric]) for metric in METRICS}
+    # Leak needs both hardness and stabilizer to drop together
+    leak = np.minimum(drop["ch"], drop["cya"])
+    flow = drop["fc"].copy()
+
+    too_short = lengths < MIN_READINGS
+    leak[too_short] = np.nan
+    flow[too_short] = np.nan
+    return {"leak": np.nan_to_num(leak, nan=0.0), "flow": np.nan_to_num(flow, nan=0.0)}
+
+
+def _leak_message(readings: List[dict]) -> str:
+    previous, latest = readings[-2], readings[-1]
+    return (
+        f"Calcium Hardness dropped from {previous['ch']} to {latest['ch']} ppm and "
+        f"Cyanuric Acid from {previous['cya']} to {latest['cya']} ppm. "
+        f"Possible water loss from a leak."
+    )
+
+
+def _flow_message(readings: List[dict]) -> str:
+    previous, latest = readings[-2], readings[-1]
+    return (
+        f"Free Chlorine fell from {previous['fc']} to {latest['fc']} ppm, well outside its usual pattern. "
+        f"Check pump, filter and circulation."
+    )
+
+
+async def run_anomaly_scan(threshold: float = DEFAULT_THRESHOLD, full: bool = False) -> dict:
+    """Score pools with new readings since the last run and raise leak/flow alerts.
+
+    Only customers updated since the previous run are loaded, and within them
+    only pools whose reading count grew are scored. Pass full=True to rescore
+    the whole fleet.
+    """
+    started_at = datetime.now(timezone.utc)
+    last_run = await db.anomaly_runs.find_one({}, {"_id": 0}, sort=[("started_at", -1)])
+
+    query = {"status": "active"}
+    if last_run and not full:
+        query["updated_at"] = {"$gte": last_run["started_at"]}
+
+    customers = await db.customers.find(
+        query, {"_id": 0, "id": 1, "name": 1, "pools.id": 1, "pools.name": 1, "pools.chem_readings": 1}
+    ).to_list(None)
+
+    pools = []
+    for customer in customers:
+        for pool in customer.get("pools", []):
+            pools.append((customer, pool))
+
+    states = await db.anomaly_state.find(
+        {"pool_id": {"$in": [pool["id"] for _, pool in pools]}}, {"_id": 0}
+    ).to_list(None)
+    scored_counts = {s["pool_id"]: s.get("scored_readings", 0) for s in states}
+
+    candidates = []
+    for customer, pool in pools:
+        readings = sorted(pool.get("chem_readings", []), key=lambda r: r.get("date", ""))
+        new_count = len(readings) - (0 if full else scored_counts.get(pool["id"], 0))
+        if new_count > 0:
+            candidates.append((customer, pool, readings, new_count))
+
+    alerts_created = 0
+    if candidates:
+        scores = score_pools([c[2] for c in candidates], [c[3] for c in candidates])
+
+        open_alerts = await db.alerts.find(
+            {
+                "type": {"$in": ["leak", "flow"]},
+                "resolved": False,
+                "pool_id": {"$in": [c[1]["id"] for c in candidates]}
+            },
+            {"_id": 0, "pool_id": 1, "type": 1}
+        ).to_list(None)
+        existing = {(a["pool_id"], a["type"]) for a in open_alerts}
+
+        docs = []
+        for row, (customer, pool, readings, _) in enumerate(candidates):
+            for alert_type, title, message in (
+                ("leak", "Potential Water Leak", _leak_message),
+                ("flow", "Circulation Problem Suspected", _flow_message),
+            ):
+                score = float(scores[alert_type][row])
+                if score < threshold or (pool["id"], alert_type) in existing:
+                    continue
+                alert_obj = Alert(
+                    type=alert_type,
+                    severity="high" if score >= 2 * threshold else "medium",
+                    title=title,
+                    message=f"{message(readings)} (anomaly score {score:.1f})",
+                    customer_id=customer["id"],
+                    customer_name=customer.get("name", ""),
+                    pool_id=pool["id"],
+                    pool_name=pool.get("name")
+                )
+                doc = alert_obj.model_dump()
+                doc['created_at'] = doc['created_at'].isoformat()
+                doc['updated_at'] = doc['updated_at'].isoformat()
+                docs.append(doc)
+
+        if docs:
+            await db.alerts.insert_many(docs)
+            await record_changes("alerts", [(None, doc) for doc in docs])
+        alerts_created = len(docs)
+
+        now = datetime.now(timezone.utc).isoformat()
+        await db.anomaly_state.bulk_write([
+            UpdateOne(
+                {"pool_id": pool["id"]},
+                {"$set": {"pool_id": pool["id"], "scored_readings": len(readings), "updated_at": now}},
+                upsert=True
+            )
+            for _, pool, readings, _ in candidates
+        ], ordered=False)
+
+    run = {
+        "id": f"anomaly-run-{str(uuid.uuid4())[:8]}",
+        "started_at": started_at.isoformat(),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "threshold": threshold,
+        "full": full,
+        "customers_loaded": len(customers),
+        "pools_scored": len(candidates),
+        "alerts_created": alerts_created
+    }
+    await db.anomaly_runs.insert_one(dict(run))
+    return run
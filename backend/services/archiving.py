@@ -0,0 +1,172 @@
+"""Archive tier for resolved alerts and completed jobs.
+
+Old documents are moved in batches from the hot collections into
+``alerts_archive`` / ``jobs_archive``. Before a batch leaves the hot
+collection its contribution to the report totals is folded into a
+``report_rollups`` document, so reports can add archived totals back without
+scanning the archive.
+
+A run holds a lease per collection, so two runs can't copy and roll up the
+same batch.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+import os
+
+from pymongo import ReplaceOne
+
+from services.locks import lease
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+ALERTS_ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_ALERTS_AFTER_DAYS", "90"))
+JOBS_ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_JOBS_AFTER_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+
+
+def _key(value) -> str:
+    """Make a value safe to use as a field name in a rollup document"""
+    return str(value or "Other").replace(".", "_").replace("$", "_")
+
+
+def alert_rollup(alert: dict) -> Dict[str, int]:
+    return {
+        "total": 1,
+        "resolved": 1 if alert.get("resolved") else 0,
+        f"by_type.{_key(alert.get('type'))}": 1,
+        f"by_severity.{_key(alert.get('severity'))}": 1,
+    }
+
+
+def job_rollup(job: dict) -> Dict[str, int]:
+    status = _key(job.get("status"))
+    service_type = _key(job.get("service_type"))
+    return {
+        "total": 1,
+        f"by_status.{status}": 1,
+        f"by_service_type.{service_type}.total": 1,
+        f"by_service_type.{service_type}.{status}": 1,
+    }
+
+
+ARCHIVES = {
+    "alerts": {
+        "archive": "alerts_archive",
+        "rollup": alert_rollup,
+        # Alerts store timestamps as ISO strings
+        "query": lambda cutoff: {"resolved": True, "resolved_at": {"$lt": cutoff.isoformat()}},
+        "days": ALERTS_ARCHIVE_AFTER_DAYS,
+    },
+    "jobs": {
+        "archive": "jobs_archive",
+        "rollup": job_rollup,
+        # Jobs store timestamps as native datetimes
+        "query": lambda cutoff: {"status": "completed", "completed_at": {"$lt": cutoff}},
+        "days": JOBS_ARCHIVE_AFTER_DAYS,
+    },
+}
+
+
+async def _apply_rollup(name: str, docs: List[dict], rollup: Callable[[dict], Dict[str, int]]):
+    """Fold archived documents into the rollup and mark them as counted"""
+    if not docs:
+        return
+    increments: Dict[str, int] = {}
+    for doc in docs:
+        for field, amount in rollup(doc).items():
+            increments[field] = increments.get(field, 0) + amount
+    await db.report_rollups.update_one(
+        {"id": name},
+        {"$inc": increments, "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    await db[ARCHIVES[name]["archive"]].update_many(
+        {"_id": {"$in": [doc["_id"] for doc in docs]}},
+        {"$set": {"rolled_up": True}}
+    )
+
+
+async def _recover_pending(name: str) -> int:
+    """Finish batches interrupted between the hot delete and the rollup update"""
+    config = ARCHIVES[name]
+    pending = await db[config["archive"]].find({"rolled_up": False}).to_list(None)
+    if not pending:
+        return 0
+    still_hot = await db[name].find(
+        {"_id": {"$in": [doc["_id"] for doc in pending]}}, {"_id": 1}
+    ).to_list(None)
+    hot_ids = {doc["_id"] for doc in still_hot}
+    # Documents still in the hot collection are picked up again by the next batch
+    moved = [doc for doc in pending if doc["_id"] not in hot_ids]
+    await _apply_rollup(name, moved, config["rollup"])
+    return len(moved)
+
+
+async def archive_collection(name: str, older_than_days: Optional[int] = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> dict:
+    """Move documents older than the cutoff from a hot collection into its archive"""
+    config = ARCHIVES[name]
+    days = config["days"] if older_than_days is None else older_than_days
+    cutoff = datetime.now(timezone.utc) - timedelta(days=days)
+    query = config["query"](cutoff)
+    archive = db[config["archive"]]
+
+    async with lease(f"archive-{name}") as lock:
+        recovered = await _recover_pending(name)
+        archived = 0
+        batches = 0
+        while True:
+            await lock.renew()
+            docs = await db[name].find(query).limit(batch_size).to_list(batch_size)
+            if not docs:
+                break
+            archived_at = datetime.now(timezone.utc).isoformat()
+            # Upsert by _id so a rerun after a crash does not duplicate documents
+            await archive.bulk_write([
+                ReplaceOne({"_id": doc["_id"]}, {**doc, "archived_at": archived_at, "rolled_up": False}, upsert=True)
+                for doc in docs
+            ], ordered=False)
+            await db[name].delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+            await _apply_rollup(name, docs, config["rollup"])
+            archived += len(docs)
+            batches += 1
+
+    return {
+        "collection": name,
+        "archive": config["archive"],
+        "older_than_days": days,
+        "archived": archived,
+        "batches": batches,
+        "recovered": recovered
+    }
+
+
+async def run_archive(alerts_days: Optional[int] = None, jobs_days: Optional[int] = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> dict:
+    """Archive resolved alerts and completed jobs"""
+    return {
+        "alerts": await archive_collection("alerts", alerts_days, batch_size),
+        "jobs": await archive_collection("jobs", jobs_days, batch_size),
+    }
+
+
+async def get_rollup(name: str) -> dict:
+    """Pre-aggregated totals of everything archived from a collection"""
+    rollup = await db.report_rollups.find_one({"id": name}, {"_id": 0})
+    return rollup or {}
+
+
+async def find_with_archive(name: str, query: dict, length: int = 1000) -> List[dict]:
+    """Search the hot collection and then its archive, up to length documents"""
+    docs = await db[name].find(query, {"_id": 0}).to_list(length)
+    if len(docs) < length:
+        archived = await db[ARCHIVES[name]["archive"]].find(
+            query, {"_id": 0, "archived_at": 0, "rolled_up": 0}
+        ).to_list(length - len(docs))
+        docs.extend(archived)
+    return docs
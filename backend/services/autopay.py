@@ -0,0 +1,364 @@
+"""Autopay charging of open invoices.
+
+An autopay run charges the balance of every sent or overdue invoice whose
+customer has autopay on. Invoices are streamed by customer batches through
+indexed queries into a bounded queue consumed by a fixed number of workers,
+so only AUTOPAY_CONCURRENCY charges (and their database writes) are in flight
+at once however many invoices there are. Transient gateway errors are retried
+with exponential backoff; successful charges are applied through the payments
+ledger.
+
+Every charge is recorded as pending before the gateway is called, with an
+idempotency key derived from the invoice, its ledger entry count and the
+balance charged, not from the run. Until a payment lands on the invoice the
+key stays the same, so a charge left pending by a crash is driven again with
+its key at the start of the next run: the gateway returns the original charge
+instead of taking a new one, and applying it is idempotent on the charge id.
+
+Each run executes under its own lease, so of the workers resuming runs on
+startup only one works on a run, and pending rows of another run are only
+resolved while holding that run's lease: a run still going elsewhere is left
+alone.
+
+The gateway is pluggable: anything with an async ``charge`` method works,
+configured with AUTOPAY_GATEWAY ("package.module:Class") or ``set_gateway``.
+The default is a local fake.
+"""
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+import asyncio
+import importlib
+import logging
+import os
+import random
+import time
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+from services.locks import LockHeld, lease
+from services.payments import PaymentError, record_payment
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+logger = logging.getLogger(__name__)
+
+AUTOPAY_CONCURRENCY = int(os.environ.get("AUTOPAY_CONCURRENCY", "20"))
+AUTOPAY_MAX_ATTEMPTS = int(os.environ.get("AUTOPAY_MAX_ATTEMPTS", "4"))
+AUTOPAY_BACKOFF_SECONDS = float(os.environ.get("AUTOPAY_BACKOFF_SECONDS", "0.5"))
+CUSTOMER_BATCH_SIZE = 500
+AUTOPAY_LEASE_SECONDS = 300
+
+OPEN_STATUSES = ["sent", "overdue"]
+
+
+class GatewayError(Exception):
+    """Transient gateway failure, the charge may be retried"""
+
+
+class ChargeDeclined(Exception):
+    """The charge was refused, retrying will not help"""
+
+
+class FakeGateway:
+    """Local stand-in for a card processor.
+
+    Approves every charge after a short simulated delay; failure_rate and
+    decline_rate inject transient errors and declines for testing.
+    """
+
+    def __init__(self, latency: float = 0.05, failure_rate: float = 0.0, decline_rate: float = 0.0):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.decline_rate = decline_rate
+        self._charges: Dict[str, dict] = {}
+
+    async def charge(self, customer_id: str, amount: float, idempotency_key: str) -> dict:
+        await asyncio.sleep(self.latency)
+        # A retried request with the same key returns the original charge
+        if idempotency_key in self._charges:
+            return self._charges[idempotency_key]
+        if random.random() < self.failure_rate:
+            raise GatewayError("Gateway timeout")
+        if random.random() < self.decline_rate:
+            raise ChargeDeclined("Card declined")
+        charge = {"id": f"ch-{str(uuid.uuid4())[:12]}", "amount": amount, "customer_id": customer_id}
+        self._charges[idempotency_key] = charge
+        return charge
+
+
+def load_gateway():
+    """Gateway named by AUTOPAY_GATEWAY ("package.module:Class"), or the fake"""
+    path = os.environ.get("AUTOPAY_GATEWAY")
+    if not path:
+        return FakeGateway()
+    module, _, name = path.partition(":")
+    return getattr(importlib.import_module(module), name)()
+
+
+gateway = load_gateway()
+
+# Runs in progress in this process
+_tasks: Dict[str, "asyncio.Task"] = {}
+
+
+def set_gateway(new_gateway):
+    """Replace the payment gateway; it needs an async charge(customer_id, amount, idempotency_key)"""
+    global gateway
+    gateway = new_gateway
+
+
+async def ensure_indexes():
+    await db.customers.create_index("autopay")
+    await db.invoices.create_index([("customer_id", 1), ("status", 1)])
+    await db.autopay_charges.create_index([("run_id", 1), ("invoice_id", 1)], unique=True)
+    await db.autopay_charges.create_index("status")
+
+
+async def _open_invoices():
+    """Open invoices of autopay customers, one indexed query per batch of customers"""
+    batch: List[str] = []
+
+    async def invoices_for(customer_ids: List[str]):
+        return await db.invoices.find(
+            {"customer_id": {"$in": customer_ids}, "status": {"$in": OPEN_STATUSES}, "balance_due": {"$gt": 0}},
+            {"_id": 0, "id": 1, "customer_id": 1, "invoice_number": 1}
+        ).to_list(None)
+
+    async for customer in db.customers.find({"autopay": True, "status": "active"}, {"_id": 0, "id": 1}):
+        batch.append(customer["id"])
+        if len(batch) >= CUSTOMER_BATCH_SIZE:
+            for invoice in await invoices_for(batch):
+                yield invoice
+            batch = []
+    if batch:
+        for invoice in await invoices_for(batch):
+            yield invoice
+
+
+async def _charge_with_retry(customer_id: str, amount: float, key: str) -> tuple:
+    """Charge, retrying transient errors with exponential backoff and jitter"""
+    for attempt in range(1, AUTOPAY_MAX_ATTEMPTS + 1):
+        try:
+            return await gateway.charge(customer_id, amount, key), attempt
+        except GatewayError:
+            if attempt == AUTOPAY_MAX_ATTEMPTS:
+                raise
+            delay = AUTOPAY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+            await asyncio.sleep(delay * (0.5 + random.random()))
+
+
+async def _chargeable(invoice_id: str) -> Optional[dict]:
+    """Amount and gateway key for an invoice's current balance, None if nothing is owed"""
+    current = await db.invoices.find_one({"id": invoice_id}, {"_id": 0, "status": 1, "balance_due": 1})
+    if not current or current["status"] not in OPEN_STATUSES or (current.get("balance_due") or 0) <= 0:
+        return None
+    amount = round(current["balance_due"], 2)
+    entries = await db.payments.count_documents({"invoice_id": invoice_id})
+    return {"amount": amount, "idempotency_key": f"autopay-{invoice_id}-{entries}-{amount:.2f}"}
+
+
+async def _charge_and_apply(row: dict) -> str:
+    """Charge a pending row with its key and apply the charge, returns the outcome"""
+    row_filter = {"run_id": row["run_id"], "invoice_id": row["invoice_id"]}
+    try:
+        charge, attempts = await _charge_with_retry(row["customer_id"], row["amount"], row["idempotency_key"])
+    except (ChargeDeclined, GatewayError) as error:
+        outcome = "declined" if isinstance(error, ChargeDeclined) else "failed"
+        await db.autopay_charges.update_one(row_filter, {"$set": {"status": outcome, "error": str(error)}})
+        return outcome
+    await db.autopay_charges.update_one(row_filter, {"$set": {"charge_id": charge["id"], "attempts": attempts}})
+
+    try:
+        result = await record_payment(row["invoice_id"], row["amount"], method="autopay", reference=charge["id"])
+        error = None if result else "Invoice no longer exists"
+    except PaymentError as payment_error:
+        error = str(payment_error)
+    if error:
+        # Charged but not applicable (cancelled or deleted meanwhile); left for a manual refund
+        await db.autopay_charges.update_one(row_filter, {"$set": {"status": "unapplied", "error": error}})
+        return "unapplied"
+    await db.autopay_charges.update_one(row_filter, {"$set": {"status": "succeeded"}})
+    return "succeeded"
+
+
+async def _resolve(row: dict) -> str:
+    """Finish a row left pending by an interrupted run"""
+    row_filter = {"run_id": row["run_id"], "invoice_id": row["invoice_id"]}
+    if row.get("charge_id") and await db.payments.find_one(
+        {"invoice_id": row["invoice_id"], "reference": row["charge_id"]}, {"_id": 1}
+    ):
+        await db.autopay_charges.update_one(row_filter, {"$set": {"status": "succeeded"}})
+        return "succeeded"
+    current = await _chargeable(row["invoice_id"])
+    if current and current["idempotency_key"] == row.get("idempotency_key"):
+        # Nothing has landed on the invoice since: charging again with the key is safe
+        return await _charge_and_apply(row)
+    # The invoice moved on without this charge; whether the gateway took it needs a look
+    await db.autopay_charges.update_one(row_filter, {"$set": {
+        "status": "review", "error": "Invoice changed while the charge was pending"
+    }})
+    return "review"
+
+
+async def _process(run_id: str, invoice: dict) -> str:
+    """Charge one invoice and apply the result, returns the outcome"""
+    # The balance may have moved since the invoice was listed
+    current = await _chargeable(invoice["id"])
+    if current is None:
+        return "skipped"
+
+    row = {
+        "run_id": run_id,
+        "invoice_id": invoice["id"],
+        "customer_id": invoice["customer_id"],
+        **current,
+        "status": "pending",
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    try:
+        await db.autopay_charges.insert_one(row)
+    except DuplicateKeyError:
+        # Already handled by this run before it was resumed
+        existing = await db.autopay_charges.find_one({"run_id": run_id, "invoice_id": invoice["id"]}, {"_id": 0})
+        if existing and existing["status"] == "pending":
+            return await _resolve(existing)
+        return "skipped"
+    row.pop("_id", None)
+    return await _charge_and_apply(row)
+
+
+def run_lease(run_id: str) -> str:
+    return f"autopay-run-{run_id}"
+
+
+async def _resolve_rows(run_id: str, counts: Dict[str, int]):
+    async for row in db.autopay_charges.find({"status": "pending", "run_id": run_id}, {"_id": 0}):
+        try:
+            outcome = await _resolve(row)
+        except Exception:
+            logger.exception("Resolving autopay charge for invoice %s failed", row["invoice_id"])
+            continue
+        counts[outcome] = counts.get(outcome, 0) + 1
+
+
+async def _resolve_pending(run_id: str, counts: Dict[str, int]):
+    """Finish rows left pending by this run or by runs no longer running anywhere"""
+    await _resolve_rows(run_id, counts)
+    for other in await db.autopay_charges.distinct("run_id", {"status": "pending", "run_id": {"$ne": run_id}}):
+        try:
+            async with lease(run_lease(other), ttl=AUTOPAY_LEASE_SECONDS):
+                await _resolve_rows(other, counts)
+        except LockHeld:
+            # Still running in another worker, which resolves its own rows
+            continue
+
+
+async def _execute(run_id: str, lock):
+    queue: asyncio.Queue = asyncio.Queue(maxsize=AUTOPAY_CONCURRENCY * 2)
+    counts: Dict[str, int] = {}
+    await _resolve_pending(run_id, counts)
+    await lock.renew()
+
+    async def worker():
+        while True:
+            invoice = await queue.get()
+            if invoice is None:
+                return
+            try:
+                outcome = await _process(run_id, invoice)
+            except Exception:
+                logger.exception("Autopay for invoice %s failed", invoice["id"])
+                outcome = "failed"
+            counts[outcome] = counts.get(outcome, 0) + 1
+
+    workers = [asyncio.create_task(worker()) for _ in range(AUTOPAY_CONCURRENCY)]
+    renewed = time.monotonic()
+    try:
+        async for invoice in _open_invoices():
+            await queue.put(invoice)
+            # The queue is short, so renewing as it fills keeps the lease while charges run
+            if time.monotonic() - renewed > AUTOPAY_LEASE_SECONDS / 3:
+                await lock.renew()
+                renewed = time.monotonic()
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        for task in workers:
+            task.cancel()
+
+    charged = 0.0
+    async for row in db.autopay_charges.aggregate([
+        {"$match": {"run_id": run_id, "status": "succeeded"}},
+        {"$group": {"_id": None, "total": {"$sum": "$amount"}}}
+    ]):
+        charged = round(row["total"], 2)
+    await db.autopay_runs.update_one({"id": run_id}, {"$set": {
+        "status": "completed",
+        "results": counts,
+        "total_charged": charged,
+        "completed_at": datetime.now(timezone.utc).isoformat()
+    }})
+
+
+async def _run(run_id: str):
+    try:
+        async with lease(run_lease(run_id), ttl=AUTOPAY_LEASE_SECONDS) as lock:
+            await _execute(run_id, lock)
+    except LockHeld:
+        # Another worker is running it
+        logger.info("Autopay run %s is being run by another worker", run_id)
+    except Exception as error:
+        logger.exception("Autopay run %s failed", run_id)
+        await db.autopay_runs.update_one({"id": run_id}, {"$set": {"status": "failed", "error": str(error)}})
+    finally:
+        _tasks.pop(run_id, None)
+
+
+async def start_run(run_id: Optional[str] = None) -> dict:
+    """Start (or resume) an autopay run in the background and return its state"""
+    run_id = run_id or f"autopay-{datetime.now(timezone.utc).date().isoformat()}"
+    now = datetime.now(timezone.utc).isoformat()
+    await db.autopay_runs.update_one(
+        {"id": run_id},
+        {"$setOnInsert": {"id": run_id, "status": "running", "started_at": now}},
+        upsert=True
+    )
+    run = await db.autopay_runs.find_one({"id": run_id}, {"_id": 0})
+    if run["status"] != "completed" and run_id not in _tasks:
+        if run["status"] == "failed":
+            await db.autopay_runs.update_one({"id": run_id}, {"$set": {"status": "running"}, "$unset": {"error": ""}})
+            run["status"] = "running"
+            run.pop("error", None)
+        _tasks[run_id] = asyncio.create_task(_run(run_id))
+    return run
+
+
+async def get_run(run_id: str) -> Optional[dict]:
+    """Run state with live counts of charges by outcome"""
+    run = await db.autopay_runs.find_one({"id": run_id}, {"_id": 0})
+    if run is None:
+        return None
+    run["charges"] = {
+        row["_id"]: row["count"]
+        async for row in db.autopay_charges.aggregate([
+            {"$match": {"run_id": run_id}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}}
+        ])
+    }
+    return run
+
+
+async def resume_interrupted_runs():
+    """Restart runs left running by a previous process"""
+    async for run in db.autopay_runs.find({"status": "running"}, {"_id": 0, "id": 1}):
+        if run["id"] not in _tasks:
+            _tasks[run["id"]] = asyncio.create_task(_run(run["id"]))
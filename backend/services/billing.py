@@ -0,0 +1,326 @@
+"""Batch billing runs.
+
+A run invoices every completed job in a period that has not been billed yet,
+one invoice per customer, priced from the service price table (or the
+approved quote the job came from). Jobs are streamed in customer order and
+written in batches with ``bulk_write``; after each batch the run document
+records the last customer done, so a run that stops part way is resumed by
+starting it again with the same run id.
+
+Invoices are upserted on (billing_run_id, customer_id) and jobs point at
+their invoice once billed, so repeating a run or a batch never bills a job
+twice. Jobs completed since an earlier attempt invoiced their customer are
+added to that invoice while it is still a draft or unpaid.
+
+A run executes under a per-run lease: every worker resumes interrupted runs
+on startup, and only the one holding the lease works on a run. The lease is
+renewed after each batch.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import os
+
+from pymongo import UpdateMany, UpdateOne
+
+from models import Invoice, InvoiceLineItem
+from services.counters import record_changes
+from services.invoice_numbers import allocate_numbers
+from services.locks import LockHeld, lease
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+logger = logging.getLogger(__name__)
+
+TAX_RATE = float(os.environ.get("BILLING_TAX_RATE", "0.08"))
+PAYMENT_TERMS_DAYS = int(os.environ.get("BILLING_PAYMENT_TERMS_DAYS", "30"))
+BILLING_BATCH_CUSTOMERS = int(os.environ.get("BILLING_BATCH_CUSTOMERS", "200"))
+BILLING_LEASE_SECONDS = 300
+
+# Line item description and unit price per job service type
+SERVICE_PRICES = {
+    "Routine Service": ("Weekly Pool Maintenance", 125.00),
+    "Repair": ("Pool Repair Service", 150.00),
+    "One-time Service": ("One-time Pool Service", 175.00),
+}
+DEFAULT_PRICE = ("Pool Service", 125.00)
+
+# Invoices more jobs can still be added to
+EXTENDABLE_STATUSES = ["draft", "sent"]
+
+# Runs in progress in this process
+_tasks: Dict[str, "asyncio.Task"] = {}
+
+
+async def ensure_indexes():
+    await db.invoices.create_index(
+        [("billing_run_id", 1), ("customer_id", 1)], unique=True,
+        partialFilterExpression={"billing_run_id": {"$type": "string"}}
+    )
+    await db.jobs.create_index([("status", 1), ("invoice_id", 1), ("customer_id", 1), ("scheduled_date", 1)])
+
+
+def default_run_id(period_start: str, period_end: str) -> str:
+    return f"billing-{period_start}-{period_end}"
+
+
+def price_job(job: dict, quote: Optional[dict]) -> List[dict]:
+    """Line items for one job, from its quote when it has one"""
+    if quote and quote.get("items"):
+        return [
+            InvoiceLineItem(
+                description=item["description"],
+                quantity=item.get("quantity", 1),
+                unit_price=item["unit_price"],
+                total=item["total"]
+            ).model_dump()
+            for item in quote["items"]
+        ]
+    description, unit_price = SERVICE_PRICES.get(job.get("service_type"), DEFAULT_PRICE)
+    return [InvoiceLineItem(
+        description=f"{description} - {job['scheduled_date']}",
+        unit_price=unit_price,
+        total=unit_price
+    ).model_dump()]
+
+
+def _line_items(jobs: List[dict], quotes: Dict[str, dict]) -> List[dict]:
+    return [item for job in jobs for item in price_job(job, quotes.get(job.get("quote_id")))]
+
+
+def build_invoice(run: dict, customer_id: str, jobs: List[dict], quotes: Dict[str, dict], invoice_number: str) -> dict:
+    line_items = _line_items(jobs, quotes)
+    subtotal = round(sum(item["total"] for item in line_items), 2)
+    tax = round(subtotal * TAX_RATE, 2)
+    issue_date = date.fromisoformat(run["started_at"][:10])
+    return Invoice(
+        customer_id=customer_id,
+        customer_name=jobs[0]["customer_name"],
+        job_id=jobs[0]["id"] if len(jobs) == 1 else None,
+        job_ids=[job["id"] for job in jobs],
+        billing_run_id=run["id"],
+        invoice_number=invoice_number,
+        status="sent" if run.get("send") else "draft",
+        line_items=line_items,
+        subtotal=subtotal,
+        tax=tax,
+        total=round(subtotal + tax, 2),
+        balance_due=round(subtotal + tax, 2),
+        issue_date=issue_date.isoformat(),
+        due_date=(issue_date + timedelta(days=PAYMENT_TERMS_DAYS)).isoformat(),
+        notes=f"Services {run['period_start']} to {run['period_end']}"
+    ).model_dump()
+
+
+async def _extend_invoices(run: dict, jobs_by_customer: Dict[str, List[dict]], quotes: Dict[str, dict]) -> dict:
+    """Add jobs not on them yet to invoices an earlier attempt of the run created"""
+    totals = {"jobs_invoiced": 0, "total_billed": 0.0}
+    now = datetime.now(timezone.utc)
+    changes = []
+    async for invoice in db.invoices.find(
+        {"billing_run_id": run["id"], "customer_id": {"$in": list(jobs_by_customer)}}, {"_id": 0}
+    ):
+        jobs = [j for j in jobs_by_customer[invoice["customer_id"]] if j["id"] not in invoice["job_ids"]]
+        if not jobs or invoice.get("status") not in EXTENDABLE_STATUSES:
+            continue
+        line_items = invoice["line_items"] + _line_items(jobs, quotes)
+        subtotal = round(sum(item["total"] for item in line_items), 2)
+        tax = round(subtotal * TAX_RATE, 2)
+        total = round(subtotal + tax, 2)
+        update = {
+            "line_items": line_items,
+            "job_ids": invoice["job_ids"] + [job["id"] for job in jobs],
+            "job_id": None,
+            "subtotal": subtotal,
+            "tax": tax,
+            "total": total,
+            "balance_due": round(total - (invoice.get("paid_amount") or 0.0), 2),
+            "updated_at": now
+        }
+        # Only while nobody changed its jobs or status since it was read
+        result = await db.invoices.update_one(
+            {"id": invoice["id"], "job_ids": invoice["job_ids"], "status": invoice["status"]}, {"$set": update}
+        )
+        if result.modified_count:
+            changes.append((invoice, {**invoice, **update}))
+            totals["jobs_invoiced"] += len(jobs)
+            totals["total_billed"] = round(totals["total_billed"] + total - (invoice.get("total") or 0.0), 2)
+    await record_changes("invoices", changes)
+    return totals
+
+
+async def _bill_batch(run: dict, jobs_by_customer: Dict[str, List[dict]]) -> dict:
+    """Upsert one invoice per customer and mark the billed jobs"""
+    # Jobs billed one at a time through create_invoice only carry the link on the invoice
+    job_ids = [j["id"] for jobs in jobs_by_customer.values() for j in jobs]
+    billed = await db.invoices.find(
+        {"job_id": {"$in": job_ids}, "billing_run_id": None}, {"_id": 0, "id": 1, "job_id": 1}
+    ).to_list(None)
+    if billed:
+        await db.jobs.bulk_write([
+            UpdateOne({"id": invoice["job_id"]}, {"$set": {"invoice_id": invoice["id"]}})
+            for invoice in billed
+        ], ordered=False)
+        already = {invoice["job_id"] for invoice in billed}
+        jobs_by_customer = {
+            customer_id: [j for j in jobs if j["id"] not in already]
+            for customer_id, jobs in jobs_by_customer.items()
+        }
+        jobs_by_customer = {customer_id: jobs for customer_id, jobs in jobs_by_customer.items() if jobs}
+        if not jobs_by_customer:
+            return {"invoices_created": 0, "jobs_invoiced": 0, "total_billed": 0.0}
+
+    quote_ids = list({j["quote_id"] for jobs in jobs_by_customer.values() for j in jobs if j.get("quote_id")})
+    quotes = {}
+    if quote_ids:
+        found = await db.quotes.find({"id": {"$in": quote_ids}}, {"_id": 0, "id": 1, "items": 1}).to_list(None)
+        quotes = {q["id"]: q for q in found}
+
+    # Numbers are reserved as one block, only for customers not invoiced by an earlier attempt
+    existing = await db.invoices.distinct(
+        "customer_id", {"billing_run_id": run["id"], "customer_id": {"$in": list(jobs_by_customer)}}
+    )
+    pending = [customer_id for customer_id in jobs_by_customer if customer_id not in set(existing)]
+    numbers = await allocate_numbers(int(run["started_at"][:4]), len(pending))
+    invoices = [
+        build_invoice(run, customer_id, jobs_by_customer[customer_id], quotes, number)
+        for customer_id, number in zip(pending, numbers)
+    ]
+    created = []
+    if invoices:
+        result = await db.invoices.bulk_write([
+            UpdateOne(
+                {"billing_run_id": run["id"], "customer_id": invoice["customer_id"]},
+                {"$setOnInsert": invoice},
+                upsert=True
+            )
+            for invoice in invoices
+        ], ordered=False)
+        created = [invoices[index] for index in result.upserted_ids]
+        await record_changes("invoices", [(None, invoice) for invoice in created])
+    extended = {"jobs_invoiced": 0, "total_billed": 0.0}
+    if existing:
+        extended = await _extend_invoices(run, {c: jobs_by_customer[c] for c in existing}, quotes)
+
+    # A rerun of a batch finds the invoices already there; mark exactly the jobs they bill
+    stored = await db.invoices.find(
+        {"billing_run_id": run["id"], "customer_id": {"$in": list(jobs_by_customer)}},
+        {"_id": 0, "id": 1, "job_ids": 1}
+    ).to_list(None)
+    now = datetime.now(timezone.utc)
+    await db.jobs.bulk_write([
+        UpdateMany(
+            {"id": {"$in": invoice["job_ids"]}, "invoice_id": None},
+            {"$set": {"invoice_id": invoice["id"], "updated_at": now}}
+        )
+        for invoice in stored
+    ], ordered=False)
+
+    return {
+        "invoices_created": len(created),
+        "jobs_invoiced": sum(len(invoice["job_ids"]) for invoice in created) + extended["jobs_invoiced"],
+        "total_billed": round(sum(invoice["total"] for invoice in created) + extended["total_billed"], 2)
+    }
+
+
+async def _execute(run_id: str, lock):
+    run = await db.billing_runs.find_one({"id": run_id}, {"_id": 0})
+    query = {
+        "status": "completed",
+        "invoice_id": None,
+        "scheduled_date": {"$gte": run["period_start"], "$lte": run["period_end"]}
+    }
+    if run.get("last_customer_id"):
+        query["customer_id"] = {"$gt": run["last_customer_id"]}
+    cursor = db.jobs.find(
+        query,
+        {"_id": 0, "id": 1, "customer_id": 1, "customer_name": 1, "service_type": 1, "scheduled_date": 1, "quote_id": 1}
+    ).sort([("customer_id", 1), ("scheduled_date", 1)])
+
+    async def flush(batch: Dict[str, List[dict]]):
+        totals = await _bill_batch(run, batch)
+        await db.billing_runs.update_one({"id": run_id}, {
+            "$inc": {"customers_processed": len(batch), **totals},
+            "$set": {"last_customer_id": max(batch), "updated_at": datetime.now(timezone.utc).isoformat()}
+        })
+        await lock.renew()
+
+    batch: Dict[str, List[dict]] = {}
+    async for job in cursor:
+        # Flush only on a customer boundary so no customer is split across batches
+        if job["customer_id"] not in batch and len(batch) >= BILLING_BATCH_CUSTOMERS:
+            await flush(batch)
+            batch = {}
+        batch.setdefault(job["customer_id"], []).append(job)
+    if batch:
+        await flush(batch)
+
+    await db.billing_runs.update_one({"id": run_id}, {"$set": {
+        "status": "completed",
+        "completed_at": datetime.now(timezone.utc).isoformat()
+    }})
+
+
+async def _run(run_id: str):
+    try:
+        async with lease(f"billing-run-{run_id}", ttl=BILLING_LEASE_SECONDS) as lock:
+            await _execute(run_id, lock)
+    except LockHeld:
+        # Another worker is running it
+        logger.info("Billing run %s is being run by another worker", run_id)
+    except Exception as error:
+        logger.exception("Billing run %s failed", run_id)
+        await db.billing_runs.update_one({"id": run_id}, {"$set": {"status": "failed", "error": str(error)}})
+    finally:
+        _tasks.pop(run_id, None)
+
+
+async def start_run(period_start: str, period_end: str, run_id: Optional[str] = None, send: bool = False) -> dict:
+    """Start (or resume) a billing run in the background and return its state"""
+    run_id = run_id or default_run_id(period_start, period_end)
+    now = datetime.now(timezone.utc).isoformat()
+    await db.billing_runs.update_one(
+        {"id": run_id},
+        {"$setOnInsert": {
+            "id": run_id,
+            "period_start": period_start,
+            "period_end": period_end,
+            "send": send,
+            "status": "running",
+            "customers_processed": 0,
+            "invoices_created": 0,
+            "jobs_invoiced": 0,
+            "total_billed": 0.0,
+            "last_customer_id": None,
+            "started_at": now,
+            "updated_at": now
+        }},
+        upsert=True
+    )
+    run = await db.billing_runs.find_one({"id": run_id}, {"_id": 0})
+    if run["status"] != "completed" and run_id not in _tasks:
+        if run["status"] == "failed":
+            await db.billing_runs.update_one({"id": run_id}, {"$set": {"status": "running"}, "$unset": {"error": ""}})
+            run["status"] = "running"
+            run.pop("error", None)
+        _tasks[run_id] = asyncio.create_task(_run(run_id))
+    return run
+
+
+async def get_run(run_id: str) -> Optional[dict]:
+    return await db.billing_runs.find_one({"id": run_id}, {"_id": 0})
+
+
+async def resume_interrupted_runs():
+    """Restart runs left running by a previous process"""
+    async for run in db.billing_runs.find({"status": "running"}, {"_id": 0, "id": 1}):
+        if run["id"] not in _tasks:
+            _tasks[run["id"]] = asyncio.create_task(_run(run["id"]))
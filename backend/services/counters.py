@@ -0,0 +1,144 @@
+"""Denormalized per-customer summary counters.
+
+One ``customer_summaries`` document per customer holds alert, job, quote and
+invoice counts by status plus invoice money totals. Write paths report the
+before/after state of the document they changed and the difference is applied
+with ``$inc``, so portal summaries are a single point read. Invoice changes
+also move the customer's account balance (see ``account_balances``), and job
+and alert changes drop the daily plans they appear in (see ``daily_plans``).
+
+Increments are never upserted: a customer without a summary document gets
+one rebuilt from the source collections on first read, which already
+includes every earlier write.
+"""
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from pymongo import UpdateOne
+
+from services.account_balances import apply_invoice_changes
+from services.daily_plans import invalidate as invalidate_plans
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+async def ensure_indexes():
+    """Indexes for summary point reads and the paginated portal lists"""
+    await db.customer_summaries.create_index("customer_id", unique=True)
+    for kind in FIELDS:
+        await db[kind].create_index([("customer_id", 1), ("created_at", -1)])
+
+
+def alert_fields(alert: dict) -> Dict[str, float]:
+    return {
+        "alerts.total": 1,
+        "alerts.resolved" if alert.get("resolved") else "alerts.unresolved": 1,
+    }
+
+
+def job_fields(job: dict) -> Dict[str, float]:
+    return {"jobs.total": 1, f"jobs.{job.get('status', 'scheduled')}": 1}
+
+
+def quote_fields(quote: dict) -> Dict[str, float]:
+    return {"quotes.total": 1, f"quotes.{quote.get('status', 'pending')}": 1}
+
+
+def invoice_fields(invoice: dict) -> Dict[str, float]:
+    return {
+        "invoices.count": 1,
+        "invoices.total_invoiced": invoice.get("total", 0) or 0,
+        "invoices.total_paid": invoice.get("paid_amount", 0) or 0,
+        "invoices.total_outstanding": invoice.get("balance_due", 0) or 0,
+    }
+
+
+FIELDS: Dict[str, Callable[[dict], Dict[str, float]]] = {
+    "alerts": alert_fields,
+    "jobs": job_fields,
+    "quotes": quote_fields,
+    "invoices": invoice_fields,
+}
+
+
+def counter_delta(kind: str, before: Optional[dict], after: Optional[dict]) -> Dict[str, float]:
+    """Counter increments that turn the state of before into the state of after"""
+    fields = FIELDS[kind]
+    delta: Dict[str, float] = {}
+    if after:
+        for field, value in fields(after).items():
+            delta[field] = delta.get(field, 0) + value
+    if before:
+        for field, value in fields(before).items():
+            delta[field] = delta.get(field, 0) - value
+    return {field: value for field, value in delta.items() if value}
+
+
+def _update(customer_id: str, increments: Dict[str, float]) -> UpdateOne:
+    return UpdateOne(
+        {"customer_id": customer_id},
+        {
+            "$inc": increments,
+            "$set": {"updated_at": datetime.now(timezone.utc).isoformat()}
+        }
+    )
+
+
+async def record_change(kind: str, before: Optional[dict], after: Optional[dict]):
+    """Apply the counter change for one created, updated or deleted document"""
+    await record_changes(kind, [(before, after)])
+
+
+async def record_changes(kind: str, changes: Iterable[Tuple[Optional[dict], Optional[dict]]]):
+    """Apply counter changes for many documents with one bulk_write"""
+    changes = list(changes)
+    by_customer: Dict[str, Dict[str, float]] = {}
+    for before, after in changes:
+        doc = after or before
+        if not doc:
+            continue
+        increments = by_customer.setdefault(doc["customer_id"], {})
+        for field, value in counter_delta(kind, before, after).items():
+            increments[field] = increments.get(field, 0) + value
+    operations = [
+        _update(customer_id, increments)
+        for customer_id, increments in by_customer.items() if increments
+    ]
+    if operations:
+        await db.customer_summaries.bulk_write(operations, ordered=False)
+    if kind == "invoices":
+        await apply_invoice_changes(changes)
+    elif kind in ("jobs", "alerts"):
+        await invalidate_plans(kind, [doc for change in changes for doc in change])
+
+
+async def rebuild_summary(customer_id: str) -> dict:
+    """Recompute a customer's counters from the source collections"""
+    summary = {"customer_id": customer_id}
+    for kind in FIELDS:
+        section: Dict[str, float] = {}
+        # Archived alerts and jobs still count towards the customer's history
+        for name in (kind, f"{kind}_archive"):
+            async for doc in db[name].find({"customer_id": customer_id}, {"_id": 0}):
+                for field, value in FIELDS[kind](doc).items():
+                    key = field.split(".", 1)[1]
+                    section[key] = section.get(key, 0) + value
+        summary[kind] = section
+    summary["updated_at"] = datetime.now(timezone.utc).isoformat()
+    await db.customer_summaries.replace_one({"customer_id": customer_id}, summary, upsert=True)
+    summary.pop("_id", None)
+    return summary
+
+
+async def get_summary(customer_id: str) -> dict:
+    """Point read of a customer's counters, built on first access"""
+    summary = await db.customer_summaries.find_one({"customer_id": customer_id}, {"_id": 0})
+    if summary is None:
+        summary = await rebuild_summary(customer_id)
+    return summary
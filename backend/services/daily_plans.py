@@ -0,0 +1,232 @@
+"""Precomputed next-day technician plans.
+
+Each night a plan is built for every active technician working the next day:
+their stops in route order with the customer, the serviced pools with their
+latest chemical reading, and the customer's open alerts. The plan is stored
+as one ``daily_plans`` document per technician and date, so opening the app
+in the morning is a single indexed point read instead of route, job, customer
+and alert lookups per technician.
+
+Job, alert and route writes drop the stored plans they make stale
+(``invalidate``); the next read rebuilds them. "Today", "tomorrow" and the
+nightly run time are in LOCAL_TIMEZONE. The nightly build takes a lease, so
+only one worker runs it.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+from zoneinfo import ZoneInfo
+import asyncio
+import logging
+import os
+
+from pymongo import UpdateOne
+
+from services.locks import LockHeld, lease
+from services.scheduling import ACTIVE_STATUSES, parse_time
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+logger = logging.getLogger(__name__)
+
+# Timezone the technicians work in, e.g. America/Chicago
+LOCAL_TIMEZONE = ZoneInfo(os.environ.get("LOCAL_TIMEZONE", "UTC"))
+# Local time of day the next day's plans are built, HH:MM
+PLAN_PRECOMPUTE_AT = os.environ.get("PLAN_PRECOMPUTE_AT", "02:00")
+PLAN_PRECOMPUTE_LEASE = "nightly-plans"
+
+# Builds in flight per date, so a burst of misses triggers a single build
+_building: Dict[str, "asyncio.Task"] = {}
+
+CUSTOMER_FIELDS = {"_id": 0, "id": 1, "name": 1, "phone": 1, "address": 1, "location": 1, "pools": 1}
+
+
+async def ensure_indexes():
+    await db.daily_plans.create_index([("technician_id", 1), ("date", 1)], unique=True)
+    # Invalidation lookups
+    await db.daily_plans.create_index([("technician_name", 1), ("date", 1)])
+    await db.daily_plans.create_index("stops.customer.id")
+
+
+def local_today() -> date:
+    return datetime.now(LOCAL_TIMEZONE).date()
+
+
+def _pool_summary(pool: dict) -> dict:
+    readings = pool.get("chem_readings") or []
+    return {
+        "id": pool.get("id"),
+        "name": pool.get("name"),
+        "type": pool.get("type"),
+        "gallons": pool.get("gallons"),
+        "equipment": pool.get("equipment", []),
+        "last_service": pool.get("last_service"),
+        "latest_reading": readings[-1] if readings else None
+    }
+
+
+async def build_plans(plan_date: date) -> List[dict]:
+    """Plans for every active technician working on plan_date, with batched queries"""
+    day = plan_date.strftime("%A")
+    scheduled_date = plan_date.isoformat()
+    technicians = await db.technicians.find(
+        {"status": "active", "assigned_days": day}, {"_id": 0, "id": 1, "name": 1}
+    ).to_list(None)
+    if not technicians:
+        return []
+    names = [t["name"] for t in technicians]
+
+    routes = await db.routes.find(
+        {"technician_id": {"$in": [t["id"] for t in technicians]}, "day": day, "status": "active"},
+        {"_id": 0, "id": 1, "technician_id": 1, "jobs": 1}
+    ).to_list(None)
+    jobs = await db.jobs.find(
+        {"technician": {"$in": names}, "scheduled_date": scheduled_date, "status": {"$in": ACTIVE_STATUSES}},
+        {"_id": 0}
+    ).to_list(None)
+    customers = await db.customers.find(
+        {"id": {"$in": list({job["customer_id"] for job in jobs})}}, CUSTOMER_FIELDS
+    ).to_list(None)
+    alerts = await db.alerts.find(
+        {"customer_id": {"$in": [c["id"] for c in customers]}, "resolved": False},
+        {"_id": 0, "id": 1, "customer_id": 1, "pool_id": 1, "type": 1, "severity": 1, "title": 1, "message": 1}
+    ).to_list(None)
+
+    customer_by_id = {c["id"]: c for c in customers}
+    alerts_by_customer: Dict[str, List[dict]] = {}
+    for alert in alerts:
+        alerts_by_customer.setdefault(alert["customer_id"], []).append(alert)
+    route_by_technician = {route["technician_id"]: route for route in routes}
+    jobs_by_technician: Dict[str, List[dict]] = {}
+    for job in jobs:
+        jobs_by_technician.setdefault(job["technician"], []).append(job)
+
+    generated_at = datetime.now(timezone.utc).isoformat()
+    plans = []
+    for technician in technicians:
+        route = route_by_technician.get(technician["id"])
+        day_jobs = jobs_by_technician.get(technician["name"], [])
+        # Route order first, then jobs that are not on the route by time
+        position = {job_id: k for k, job_id in enumerate(route.get("jobs", []) if route else [])}
+        day_jobs.sort(key=lambda j: (
+            position.get(j["id"], len(position)),
+            parse_time(j.get("scheduled_time")) or 0
+        ))
+
+        stops = []
+        for job in day_jobs:
+            customer = customer_by_id.get(job["customer_id"], {})
+            pools = customer.get("pools", [])
+            if job.get("pools"):
+                wanted = set(job["pools"])
+                pools = [pool for pool in pools if pool.get("id") in wanted]
+            stops.append({
+                "job_id": job["id"],
+                "status": job["status"],
+                "service_type": job["service_type"],
+                "scheduled_time": job["scheduled_time"],
+                "notes": job.get("notes"),
+                "customer": {k: v for k, v in customer.items() if k != "pools"} or None,
+                "pools": [_pool_summary(pool) for pool in pools],
+                "open_alerts": alerts_by_customer.get(job["customer_id"], [])
+            })
+
+        plans.append({
+            "technician_id": technician["id"],
+            "technician_name": technician["name"],
+            "date": scheduled_date,
+            "day": day,
+            "route_id": route["id"] if route else None,
+            "total_stops": len(stops),
+            "stops": stops,
+            "generated_at": generated_at
+        })
+    return plans
+
+
+async def precompute_plans(plan_date: Optional[date] = None) -> dict:
+    """Build and store plans for plan_date (tomorrow by default)"""
+    plan_date = plan_date or local_today() + timedelta(days=1)
+    plans = await build_plans(plan_date)
+    if plans:
+        await db.daily_plans.bulk_write([
+            UpdateOne(
+                {"technician_id": plan["technician_id"], "date": plan["date"]},
+                {"$set": plan},
+                upsert=True
+            )
+            for plan in plans
+        ], ordered=False)
+    return {
+        "date": plan_date.isoformat(),
+        "technicians": len(plans),
+        "stops": sum(plan["total_stops"] for plan in plans)
+    }
+
+
+async def get_plan(technician_id: str, plan_date: date, refresh: bool = False) -> Optional[dict]:
+    """Stored plan for a technician and date, built for all technicians on a miss"""
+    query = {"technician_id": technician_id, "date": plan_date.isoformat()}
+    if not refresh:
+        plan = await db.daily_plans.find_one(query, {"_id": 0})
+        if plan is not None:
+            return plan
+    key = plan_date.isoformat()
+    if key not in _building:
+        _building[key] = asyncio.ensure_future(precompute_plans(plan_date))
+        _building[key].add_done_callback(lambda _: _building.pop(key, None))
+    await asyncio.shield(_building[key])
+    return await db.daily_plans.find_one(query, {"_id": 0})
+
+
+async def invalidate(kind: str, docs: Iterable[Optional[dict]]):
+    """Drop the stored plans that written jobs, alerts or routes appear in"""
+    docs = [doc for doc in docs if doc]
+    today = local_today().isoformat()
+    if kind == "jobs":
+        slots = {(doc.get("technician"), doc.get("scheduled_date")) for doc in docs}
+        stale = [{"technician_name": name, "date": day} for name, day in slots if name and day]
+    elif kind == "alerts":
+        customer_ids = list({doc["customer_id"] for doc in docs if doc.get("customer_id")})
+        stale = [{"stops.customer.id": {"$in": customer_ids}, "date": {"$gte": today}}] if customer_ids else []
+    elif kind == "routes":
+        slots = {(doc.get("technician_id"), doc.get("day")) for doc in docs}
+        stale = [
+            {"technician_id": technician_id, "day": day, "date": {"$gte": today}}
+            for technician_id, day in slots if technician_id
+        ]
+    else:
+        return
+    if stale:
+        await db.daily_plans.delete_many({"$or": stale})
+
+
+def seconds_until(at: str, now: datetime) -> float:
+    """Seconds from now until the next HH:MM in now's timezone"""
+    hour, minute = (int(part) for part in at.split(":"))
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += timedelta(days=1)
+    # Subtract in UTC: across a DST change the wall-clock difference is an hour off
+    return (target.astimezone(timezone.utc) - now.astimezone(timezone.utc)).total_seconds()
+
+
+async def run_nightly():
+    """Background loop precomputing tomorrow's plans once a day"""
+    while True:
+        await asyncio.sleep(seconds_until(PLAN_PRECOMPUTE_AT, datetime.now(LOCAL_TIMEZONE)))
+        try:
+            async with lease(PLAN_PRECOMPUTE_LEASE, ttl=600):
+                result = await precompute_plans()
+            logger.info("Precomputed %s plans for %s", result["technicians"], result["date"])
+        except LockHeld:
+            # Another worker is running it
+            continue
+        except Exception:
+            logger.exception("Nightly plan precompute failed")
@@ -0,0 +1,240 @@
+"""Overdue invoice sweeping and dunning reminders.
+
+Once a day ``sent`` invoices past their due date are flipped to ``overdue``
+with a single ``update_many`` on the (status, due_date) index. Overdue
+invoices then get reminders at the configured days past due; the invoices
+reaching a reminder level on the same day are combined into one notice per
+customer. Notices are queued in ``dunning_notices`` and delivered through the
+configured notifier, so a failed delivery is retried on the next run.
+
+Invoice levels advance before the notice is written, and the same update tags
+the invoices with the notice's id; the notice is then built from the tagged
+invoices. A run that dies in between leaves tagged invoices without a notice,
+which the next run queues, so no level is ever reminded twice or skipped.
+Runs take a lease, so only one worker sweeps at a time.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import importlib
+import logging
+import os
+
+from pymongo import UpdateMany
+from pymongo.errors import DuplicateKeyError
+
+from services.daily_plans import seconds_until
+from services.locks import LockHeld, lease
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+logger = logging.getLogger(__name__)
+
+# Days past due at which the first, second, ... reminder goes out
+DUNNING_INTERVALS_DAYS = [int(d) for d in os.environ.get("DUNNING_INTERVALS_DAYS", "3,14,30").split(",") if d.strip()]
+# UTC time of day the sweep runs, HH:MM
+DUNNING_RUN_AT = os.environ.get("DUNNING_RUN_AT", "06:00")
+DUNNING_MAX_ATTEMPTS = int(os.environ.get("DUNNING_MAX_ATTEMPTS", "5"))
+DUNNING_LEASE = "dunning-run"
+
+
+class LogNotifier:
+    """Local stub that writes reminders to the log instead of sending them"""
+
+    async def send(self, notice: dict):
+        logger.info(
+            "Dunning reminder to %s <%s>: %s invoice(s), %.2f due",
+            notice["customer_name"], notice.get("email"), len(notice["invoices"]), notice["total_due"]
+        )
+
+
+def load_notifier():
+    """Notifier named by DUNNING_NOTIFIER ("package.module:Class"), or the log stub"""
+    path = os.environ.get("DUNNING_NOTIFIER")
+    if not path:
+        return LogNotifier()
+    module, _, name = path.partition(":")
+    try:
+        return getattr(importlib.import_module(module), name)()
+    except Exception:
+        # A bad setting logs reminders instead of keeping the app from starting
+        logger.exception("Could not load DUNNING_NOTIFIER %s, logging reminders instead", path)
+        return LogNotifier()
+
+
+notifier = load_notifier()
+
+
+def set_notifier(new_notifier):
+    """Replace the notifier; it needs an async send(notice) method"""
+    global notifier
+    notifier = new_notifier
+
+
+async def ensure_indexes():
+    await db.invoices.create_index([("status", 1), ("due_date", 1)])
+    await db.dunning_notices.create_index([("customer_id", 1), ("run_date", 1)], unique=True)
+    await db.dunning_notices.create_index("status")
+    await db.dunning_notices.create_index(
+        "id", unique=True, partialFilterExpression={"id": {"$type": "string"}}
+    )
+    await db.invoices.create_index("dunning_notice_id", sparse=True)
+
+
+async def sweep_overdue(today: date) -> int:
+    """Flip sent invoices past their due date to overdue"""
+    result = await db.invoices.update_many(
+        {"status": "sent", "due_date": {"$lt": today.isoformat()}},
+        {"$set": {"status": "overdue", "updated_at": datetime.now(timezone.utc)}}
+    )
+    return result.modified_count
+
+
+def notice_id(customer_id: str, run_date: str) -> str:
+    return f"{run_date}:{customer_id}"
+
+
+def _level_query(level: int):
+    """Filter on dunning_level for invoices at a level, 0 matching never reminded"""
+    return {"$in": [0, None]} if level == 0 else level
+
+
+async def queue_reminders(today: date) -> int:
+    """Queue one notice per customer for invoices that reached their next reminder level"""
+    due: Dict[str, List[Tuple[str, int]]] = {}
+    for level, days in enumerate(DUNNING_INTERVALS_DAYS):
+        cutoff = (today - timedelta(days=days)).isoformat()
+        async for invoice in db.invoices.find(
+            {"status": "overdue", "due_date": {"$lte": cutoff}, "dunning_level": _level_query(level)},
+            {"_id": 0, "id": 1, "customer_id": 1}
+        ):
+            due.setdefault(invoice["customer_id"], []).append((invoice["id"], level + 1))
+
+    notice_ids = {customer_id: notice_id(customer_id, today.isoformat()) for customer_id in due}
+    # Customers reminded earlier today keep their levels until tomorrow
+    done = set(await db.dunning_notices.distinct("id", {"id": {"$in": list(notice_ids.values())}}))
+    now = datetime.now(timezone.utc).isoformat()
+    for customer_id, invoices in due.items():
+        if notice_ids[customer_id] in done:
+            continue
+        await db.invoices.bulk_write([
+            UpdateMany(
+                {
+                    "id": {"$in": [invoice_id for invoice_id, reached in invoices if reached == level]},
+                    "dunning_level": _level_query(level - 1)
+                },
+                {"$set": {"dunning_level": level, "last_reminder_at": now, "dunning_notice_id": notice_ids[customer_id]}}
+            )
+            for level in {reached for _, reached in invoices}
+        ], ordered=False)
+
+    # Includes notices of earlier runs that stopped after advancing levels
+    tagged = await db.invoices.distinct("dunning_notice_id", {"status": "overdue", "dunning_notice_id": {"$ne": None}})
+    queued = set(await db.dunning_notices.distinct("id", {"id": {"$in": tagged}}))
+    return await _queue_notices([n for n in tagged if n not in queued])
+
+
+async def _queue_notices(notice_ids: List[str]) -> int:
+    """Write the notices of invoices tagged with these ids"""
+    if not notice_ids:
+        return 0
+    by_notice: Dict[str, List[dict]] = {}
+    async for invoice in db.invoices.find(
+        {"dunning_notice_id": {"$in": notice_ids}, "status": "overdue"},
+        {
+            "_id": 0, "id": 1, "customer_id": 1, "customer_name": 1, "invoice_number": 1,
+            "balance_due": 1, "due_date": 1, "dunning_level": 1, "dunning_notice_id": 1
+        }
+    ):
+        by_notice.setdefault(invoice.pop("dunning_notice_id"), []).append(invoice)
+
+    customers = await db.customers.find(
+        {"id": {"$in": list({invoices[0]["customer_id"] for invoices in by_notice.values()})}},
+        {"_id": 0, "id": 1, "name": 1, "email": 1}
+    ).to_list(None)
+    emails = {c["id"]: c.get("email") for c in customers}
+
+    queued = 0
+    now = datetime.now(timezone.utc).isoformat()
+    for nid, invoices in by_notice.items():
+        run_date = nid.split(":", 1)[0]
+        for invoice in invoices:
+            invoice["level"] = invoice.pop("dunning_level")
+            invoice["days_overdue"] = (date.fromisoformat(run_date) - date.fromisoformat(invoice["due_date"][:10])).days
+        customer_id = invoices[0]["customer_id"]
+        try:
+            await db.dunning_notices.insert_one({
+                "id": nid,
+                "customer_id": customer_id,
+                "customer_name": invoices[0]["customer_name"],
+                "email": emails.get(customer_id),
+                "run_date": run_date,
+                "invoices": invoices,
+                "total_due": round(sum(i.get("balance_due") or 0 for i in invoices), 2),
+                "status": "pending",
+                "attempts": 0,
+                "created_at": now
+            })
+        except DuplicateKeyError:
+            # Already queued
+            continue
+        queued += 1
+    return queued
+
+
+async def deliver_pending() -> dict:
+    """Send queued notices through the notifier"""
+    sent = failed = 0
+    async for notice in db.dunning_notices.find(
+        {"status": "pending", "attempts": {"$lt": DUNNING_MAX_ATTEMPTS}},
+        {"status": 0, "attempts": 0, "last_error": 0}
+    ):
+        notice_id = notice.pop("_id")
+        try:
+            await notifier.send(notice)
+        except Exception as error:
+            failed += 1
+            logger.warning("Dunning notice for %s failed: %s", notice["customer_id"], error)
+            await db.dunning_notices.update_one(
+                {"_id": notice_id}, {"$inc": {"attempts": 1}, "$set": {"last_error": str(error)}}
+            )
+            continue
+        sent += 1
+        await db.dunning_notices.update_one(
+            {"_id": notice_id},
+            {"$inc": {"attempts": 1}, "$set": {"status": "sent", "sent_at": datetime.now(timezone.utc).isoformat()}}
+        )
+    return {"sent": sent, "failed": failed}
+
+
+async def run_dunning(today: Optional[date] = None) -> dict:
+    """Sweep overdue invoices, queue reminders and deliver them"""
+    today = today or datetime.now(timezone.utc).date()
+    async with lease(DUNNING_LEASE, ttl=600) as lock:
+        marked = await sweep_overdue(today)
+        await lock.renew()
+        queued = await queue_reminders(today)
+        await lock.renew()
+        delivery = await deliver_pending()
+    return {"date": today.isoformat(), "marked_overdue": marked, "reminders_queued": queued, **delivery}
+
+
+async def run_daily():
+    """Background loop running the sweep once a day"""
+    while True:
+        await asyncio.sleep(seconds_until(DUNNING_RUN_AT, datetime.now(timezone.utc)))
+        try:
+            result = await run_dunning()
+            logger.info("Dunning run: %s", result)
+        except LockHeld:
+            # Another worker is running it
+            continue
+        except Exception:
+            logger.exception("Dunning run failed")
@@ -0,0 +1,225 @@
+"""Offline geocoding of customer addresses.
+
+Coordinates come from a local ``geocode_addresses`` lookup table keyed by a
+normalized address string, loaded from a dataset file (no external geocoder is
+called). Lookups go through a bounded in-process cache of normalized
+addresses, and results are stored on customers as GeoJSON points covered by a
+2dsphere index.
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+import asyncio
+import csv
+import itertools
+import os
+import re
+
+from pymongo import UpdateOne
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+GEOCODE_DATASET_PATH = os.environ.get("GEOCODE_DATASET_PATH", "")
+GEOCODE_CACHE_SIZE = int(os.environ.get("GEOCODE_CACHE_SIZE", "10000"))
+LOAD_BATCH_SIZE = 1000
+
+# USPS-style abbreviations so "123 Main Street" and "123 main st." match
+ABBREVIATIONS = {
+    "STREET": "ST", "AVENUE": "AVE", "ROAD": "RD", "DRIVE": "DR", "LANE": "LN",
+    "BOULEVARD": "BLVD", "COURT": "CT", "CIRCLE": "CIR", "PLACE": "PL",
+    "TERRACE": "TER", "PARKWAY": "PKWY", "HIGHWAY": "HWY", "TRAIL": "TRL",
+    "NORTH": "N", "SOUTH": "S", "EAST": "E", "WEST": "W",
+    "NORTHEAST": "NE", "NORTHWEST": "NW", "SOUTHEAST": "SE", "SOUTHWEST": "SW",
+    "APARTMENT": "APT", "SUITE": "STE",
+}
+
+# Applied to normalized addresses, where the ZIP+4 hyphen is already a space
+ZIP_RE = re.compile(r"\s\d{5}(\s\d{4})?$")
+
+
+def normalize_address(address: str) -> str:
+    """Canonical form of an address used as the lookup key"""
+    text = re.sub(r"[^\w\s]", " ", (address or "").upper())
+    words = [ABBREVIATIONS.get(word, word) for word in text.split()]
+    return " ".join(words)
+
+
+def _candidates(address: str) -> List[str]:
+    """Lookup keys to try, most specific first"""
+    normalized = normalize_address(address)
+    keys = [normalized]
+    without_zip = ZIP_RE.sub("", normalized)
+    if without_zip != normalized:
+        keys.append(without_zip)
+    return keys
+
+
+def to_point(lon: float, lat: float) -> dict:
+    return {"type": "Point", "coordinates": [lon, lat]}
+
+
+class AddressCache:
+    """Bounded LRU of normalized address -> point (None caches a miss)"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._items: "OrderedDict[str, Optional[dict]]" = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._items
+
+    def get(self, key: str) -> Optional[dict]:
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def put(self, key: str, value: Optional[dict]):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        while len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def clear(self):
+        self._items.clear()
+
+
+cache = AddressCache(GEOCODE_CACHE_SIZE)
+
+
+async def ensure_indexes():
+    await db.geocode_addresses.create_index("normalized", unique=True)
+    await db.customers.create_index([("location", "2dsphere")])
+
+
+def _read_dataset(path: str) -> Iterator[dict]:
+    """Rows of a CSV dataset as {normalized, lat, lon}.
+
+    Accepts either an ``address,lat,lon`` file or an OpenAddresses-style file
+    with LON, LAT, NUMBER, STREET, CITY, REGION and POSTCODE columns.
+    """
+    with open(path, newline="", encoding="utf-8") as handle:
+        reader = csv.DictReader(handle)
+        fields = {name.upper(): name for name in reader.fieldnames or []}
+        for row in reader:
+            if "ADDRESS" in fields:
+                address = row[fields["ADDRESS"]]
+            else:
+                parts = [row.get(fields.get(key, ""), "") for key in ("NUMBER", "STREET", "CITY", "REGION", "POSTCODE")]
+                address = " ".join(part for part in parts if part)
+            try:
+                lat = float(row[fields["LAT"]])
+                lon = float(row[fields["LON"]])
+            except (KeyError, TypeError, ValueError):
+                continue
+            normalized = normalize_address(address)
+            if normalized:
+                yield {"normalized": normalized, "lat": lat, "lon": lon}
+
+
+async def load_dataset(source: Optional[str] = None) -> dict:
+    """Upsert every row of the GEOCODE_DATASET_PATH file into the lookup table.
+
+    The CSV is parsed a batch at a time in a worker thread, so a large file
+    neither blocks the event loop nor is held in memory at once.
+    """
+    path = GEOCODE_DATASET_PATH
+    if not path or not os.path.exists(path):
+        raise FileNotFoundError("Geocoding dataset is not configured")
+    source = source or os.path.basename(path)
+
+    rows = _read_dataset(path)
+    loaded = 0
+    while True:
+        batch = await asyncio.to_thread(lambda: list(itertools.islice(rows, LOAD_BATCH_SIZE)))
+        if not batch:
+            break
+        await db.geocode_addresses.bulk_write([
+            UpdateOne({"normalized": row["normalized"]}, {"$set": {**row, "source": source}}, upsert=True)
+            for row in batch
+        ], ordered=False)
+        loaded += len(batch)
+
+    cache.clear()
+    return {"source": source, "loaded": loaded}
+
+
+async def lookup_many(addresses: List[str]) -> Dict[str, Optional[dict]]:
+    """Geocode many addresses with at most one table query, returns address -> point"""
+    keys = {address: _candidates(address) for address in addresses}
+    resolved: Dict[str, Optional[dict]] = {}
+    for candidates in keys.values():
+        for key in candidates:
+            if key in cache:
+                resolved[key] = cache.get(key)
+
+    missing = {key for candidates in keys.values() for key in candidates if key not in resolved}
+    if missing:
+        found = await db.geocode_addresses.find(
+            {"normalized": {"$in": list(missing)}}, {"_id": 0, "normalized": 1, "lat": 1, "lon": 1}
+        ).to_list(None)
+        for row in found:
+            resolved[row["normalized"]] = to_point(row["lon"], row["lat"])
+        for key in missing:
+            resolved.setdefault(key, None)
+            cache.put(key, resolved[key])
+
+    return {
+        address: next((resolved[key] for key in candidates if resolved[key]), None)
+        for address, candidates in keys.items()
+    }
+
+
+async def geocode_address(address: str) -> Optional[dict]:
+    """GeoJSON point for one address, or None when it is not in the table"""
+    return (await lookup_many([address]))[address]
+
+
+async def geocode_customers(only_missing: bool = True, batch_size: int = 500) -> dict:
+    """Batch geocode customers and store their locations"""
+    query = {"location": None} if only_missing else {}
+    cursor = db.customers.find(query, {"_id": 0, "id": 1, "address": 1})
+
+    processed = 0
+    matched = 0
+    unmatched = []
+
+    async def flush(batch):
+        nonlocal matched
+        points = await lookup_many([c.get("address", "") for c in batch])
+        now = datetime.now(timezone.utc).isoformat()
+        operations = []
+        for customer in batch:
+            point = points.get(customer.get("address", ""))
+            if point:
+                operations.append(UpdateOne(
+                    {"id": customer["id"]},
+                    {"$set": {"location": point, "updated_at": now}}
+                ))
+            else:
+                unmatched.append(customer["id"])
+        if operations:
+            await db.customers.bulk_write(operations, ordered=False)
+            matched += len(operations)
+
+    batch = []
+    async for customer in cursor:
+        batch.append(customer)
+        processed += 1
+        if len(batch) >= batch_size:
+            await flush(batch)
+            batch = []
+    if batch:
+        await flush(batch)
+
+    return {
+        "processed": processed,
+        "geocoded": matched,
+        "unmatched": len(unmatched),
+        "unmatched_customer_ids": unmatched
+    }
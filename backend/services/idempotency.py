@@ -0,0 +1,225 @@
+"""Idempotency-Key support for mutating requests.
+
+A client that may retry a POST, PUT, PATCH or DELETE sends an
+``Idempotency-Key`` header. The first request with a key reserves it in
+``idempotency_keys`` and its response is stored there once it completes; a
+retry with the same key gets the stored response back from a single point
+lookup, without the write running again. Keys are scoped to the caller's
+Authorization header and expire after IDEMPOTENCY_TTL_HOURS through a TTL
+index.
+
+A reservation carries an owner token and a ``lock_until`` that the running
+request keeps extending, so it is only taken over once its request has
+died, however slow the write. Storing and releasing the response match the
+owner, so a request that lost its reservation never touches its successor's.
+
+Reusing a key for a different request is rejected with 422, and a retry that
+arrives while the first request is still running gets 409. Server errors
+release the key so the request can be retried for real.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import Optional, Tuple
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get("IDEMPOTENCY_TTL_HOURS", "24"))
+# A reservation not extended for this long is taken to belong to a request that died
+IDEMPOTENCY_LOCK_SECONDS = int(os.environ.get("IDEMPOTENCY_LOCK_SECONDS", "60"))
+# How often a running request extends its reservation
+IDEMPOTENCY_HEARTBEAT_SECONDS = IDEMPOTENCY_LOCK_SECONDS / 3
+# Responses larger than this are not stored, and their keys are released
+MAX_STORED_BODY = 1024 * 1024
+
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+HEADER = b"idempotency-key"
+
+
+async def ensure_indexes():
+    await db.idempotency_keys.create_index("key", unique=True)
+    await db.idempotency_keys.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_TTL_HOURS * 3600)
+
+
+def _hash(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(hashlib.sha256(part).digest())
+    return digest.hexdigest()
+
+
+async def reserve(key: str, fingerprint: str) -> Tuple[Optional[str], Optional[dict]]:
+    """Claim a key for a new request.
+
+    Returns (owner, None) when claimed, or (None, record) when the key is
+    taken. A retry of a completed request costs one lookup.
+    """
+    owner = str(uuid.uuid4())
+    while True:
+        existing = await db.idempotency_keys.find_one({"key": key}, {"_id": 0})
+        now = datetime.now(timezone.utc)
+        lock_until = now + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)
+        if existing is None:
+            try:
+                await db.idempotency_keys.insert_one({
+                    "key": key, "fingerprint": fingerprint, "status": "processing",
+                    "owner": owner, "lock_until": lock_until, "created_at": now
+                })
+                return owner, None
+            except DuplicateKeyError:
+                # Reserved between the lookup and the insert
+                continue
+        if existing["status"] != "processing":
+            return None, existing
+        # Take over a reservation whose request stopped extending it
+        taken = await db.idempotency_keys.find_one_and_update(
+            {"key": key, "status": "processing", "lock_until": {"$lt": now}},
+            {"$set": {"fingerprint": fingerprint, "owner": owner, "lock_until": lock_until, "created_at": now}},
+            return_document=ReturnDocument.AFTER
+        )
+        return (owner, None) if taken else (None, existing)
+
+
+async def extend(key: str, owner: str) -> bool:
+    """Push back a running request's reservation; False if it was lost"""
+    result = await db.idempotency_keys.update_one(
+        {"key": key, "owner": owner, "status": "processing"},
+        {"$set": {"lock_until": datetime.now(timezone.utc) + timedelta(seconds=IDEMPOTENCY_LOCK_SECONDS)}}
+    )
+    return result.matched_count == 1
+
+
+async def _heartbeat(key: str, owner: str):
+    while True:
+        await asyncio.sleep(IDEMPOTENCY_HEARTBEAT_SECONDS)
+        try:
+            if not await extend(key, owner):
+                logger.warning("Idempotency reservation was lost while its request was running")
+                return
+        except Exception:
+            logger.exception("Could not extend idempotency reservation")
+
+
+async def complete(key: str, owner: str, status: int, headers: list, body: bytes):
+    await db.idempotency_keys.update_one({"key": key, "owner": owner}, {"$set": {
+        "status": "completed",
+        "response": {
+            "status": status,
+            "headers": [[name.decode("latin-1"), value.decode("latin-1")] for name, value in headers],
+            "body": body
+        }
+    }})
+
+
+async def release(key: str, owner: str):
+    await db.idempotency_keys.delete_one({"key": key, "owner": owner, "status": "processing"})
+
+
+async def _send_json(send, status: int, detail: str):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware replaying stored responses for repeated Idempotency-Keys"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS:
+            return await self.app(scope, receive, send)
+        headers = dict(scope["headers"])
+        client_key = headers.get(HEADER)
+        if not client_key:
+            return await self.app(scope, receive, send)
+
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+
+        key = _hash(client_key, headers.get(b"authorization", b""))
+        fingerprint = _hash(scope["method"].encode(), scope["path"].encode(), scope.get("query_string", b""), body)
+        owner, existing = await reserve(key, fingerprint)
+        if existing:
+            if existing["fingerprint"] != fingerprint:
+                return await _send_json(send, 422, "Idempotency-Key was already used for a different request")
+            if existing["status"] != "completed":
+                return await _send_json(send, 409, "A request with this Idempotency-Key is still in progress")
+            response = existing["response"]
+            await send({
+                "type": "http.response.start",
+                "status": response["status"],
+                "headers": [
+                    (name.encode("latin-1"), value.encode("latin-1")) for name, value in response["headers"]
+                ] + [(b"idempotent-replayed", b"true")]
+            })
+            await send({"type": "http.response.body", "body": response["body"]})
+            return
+
+        replayed = False
+
+        async def replay_receive():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        start = {}
+        chunks = []
+        size = 0
+
+        async def capture_send(message):
+            nonlocal size
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                size += len(message.get("body", b""))
+                if size <= MAX_STORED_BODY:
+                    chunks.append(message.get("body", b""))
+            await send(message)
+
+        heartbeat = asyncio.create_task(_heartbeat(key, owner))
+        try:
+            await self.app(scope, replay_receive, capture_send)
+        except BaseException:
+            await release(key, owner)
+            raise
+        finally:
+            heartbeat.cancel()
+
+        if not start or start["status"] >= 500 or size > MAX_STORED_BODY:
+            await release(key, owner)
+            return
+        try:
+            await complete(key, owner, start["status"], start.get("headers", []), b"".join(chunks))
+        except Exception:
+            # The write itself succeeded; a retry will re-run it once the reservation lapses
+            logger.exception("Could not store response for idempotency key")
@@ -0,0 +1,105 @@
+"""Invoice number allocation.
+
+Numbers look like ``INV-2025-001`` and come from one sequence document per
+year in ``invoice_sequences``, advanced with an atomic ``$inc``. A block of
+numbers can be reserved in one call for batch billing. A unique index on
+``invoice_number`` backs the sequence.
+
+A number given by the client in the same format moves its year's sequence
+past it before the invoice is stored, so the sequence never hands it out
+again. Numbers issued before the sequences existed are synced once, on the
+first startup, and a marker in ``migrations`` skips the scan after that.
+"""
+from datetime import datetime, timezone
+from typing import List
+import logging
+import re
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+logger = logging.getLogger(__name__)
+
+NUMBER_RE = re.compile(r"^INV-(\d{4})-(\d+)$")
+
+# Marker in ``migrations`` of the one-off sync of existing numbers
+SEQUENCES_SYNCED = "invoice-sequences-synced"
+
+
+def format_number(year: int, sequence: int) -> str:
+    return f"INV-{year}-{sequence:03d}"
+
+
+async def ensure_indexes():
+    await db.invoice_sequences.create_index("id", unique=True)
+    await db.migrations.create_index("id", unique=True)
+    await sync_sequences_once()
+    try:
+        await db.invoices.create_index("invoice_number", unique=True)
+    except OperationFailure:
+        # Existing duplicates have to be renumbered by hand before the index can be built
+        logger.exception("Could not create unique index on invoice_number")
+
+
+async def sync_sequences():
+    """Move each year's sequence past the highest number already issued"""
+    highest = {}
+    async for invoice in db.invoices.find({"invoice_number": {"$regex": "^INV-"}}, {"_id": 0, "invoice_number": 1}):
+        match = NUMBER_RE.match(invoice["invoice_number"])
+        if match:
+            year, sequence = int(match.group(1)), int(match.group(2))
+            highest[year] = max(highest.get(year, 0), sequence)
+    for year, sequence in highest.items():
+        await advance_sequence(year, sequence)
+
+
+async def sync_sequences_once():
+    """Sync the sequences the first time the service starts after deploy"""
+    if await db.migrations.find_one({"id": SEQUENCES_SYNCED}):
+        return
+    # Syncing is idempotent, so workers starting together may both run it
+    await sync_sequences()
+    try:
+        await db.migrations.insert_one({"id": SEQUENCES_SYNCED, "completed_at": datetime.now(timezone.utc).isoformat()})
+    except DuplicateKeyError:
+        pass
+
+
+async def advance_sequence(year: int, sequence: int):
+    await db.invoice_sequences.update_one(
+        {"id": f"invoices-{year}"}, {"$max": {"value": sequence}}, upsert=True
+    )
+
+
+async def claim_number(invoice_number: str):
+    """Keep the sequence from handing out a number the client chose"""
+    match = NUMBER_RE.match(invoice_number)
+    if match:
+        await advance_sequence(int(match.group(1)), int(match.group(2)))
+
+
+async def allocate_numbers(year: int, count: int = 1) -> List[str]:
+    """Reserve count consecutive invoice numbers for a year"""
+    if count <= 0:
+        return []
+    sequence = await db.invoice_sequences.find_one_and_update(
+        {"id": f"invoices-{year}"},
+        {"$inc": {"value": count}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    last = sequence["value"]
+    return [format_number(year, n) for n in range(last - count + 1, last + 1)]
+
+
+async def allocate_number(year: int) -> str:
+    return (await allocate_numbers(year, 1))[0]
@@ -0,0 +1,199 @@
+"""Server-side invoice search.
+
+Filters combine an invoice_number prefix, customer, status and issue/due
+date ranges; results are sorted by issue date, due date or total and paged
+with an opaque cursor over (sort value, id), so deep pages cost the same as
+the first one.
+
+Every search runs on a compound index chosen by ``search_index``: the
+equality filters first (customer_id, status or both), then the sort field,
+then id as tie-breaker. That index serves the sort without an in-memory SORT
+stage, and a range on the sort field bounds the index scan. A date range on
+the other field would scan every key of the equality prefix, so it runs on
+the index with that field in place of the sort field instead: the scan is
+bounded by the range and only the matches are sorted, keeping the top page.
+Those are the same keys as the sort indexes on that field, so no extra
+indexes are needed. A number prefix search runs on the unique invoice_number
+index and is sorted by number. ``explain_search`` reports the plan a search
+gets.
+
+Invoices without a sort value sort as null, first in ascending order and last
+in descending order, and the cursor pages through them in that position.
+"""
+from typing import List, Optional, Tuple
+import base64
+import json
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+SORT_FIELDS = ("issue_date", "due_date", "total")
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+
+class SearchError(Exception):
+    """Invalid search parameters"""
+
+
+def search_index(
+    customer_id: Optional[str], status: Optional[str], sort: str, range_field: Optional[str] = None
+) -> List[Tuple[str, int]]:
+    """Index key serving a combination of filters and sort.
+
+    range_field is a ranged date field other than the sort field, which then
+    leads the index after the equality filters.
+    """
+    if sort == "invoice_number":
+        return [("invoice_number", 1)]
+    keys = []
+    if customer_id:
+        keys.append(("customer_id", 1))
+    if status:
+        keys.append(("status", 1))
+    return keys + [(range_field or sort, 1), ("id", 1)]
+
+
+async def ensure_indexes():
+    # Range indexes share their keys with the sort indexes of the ranged field
+    for sort in SORT_FIELDS:
+        for customer_id, status in ((None, None), ("customer", None), (None, "status"), ("customer", "status")):
+            await db.invoices.create_index(search_index(customer_id, status, sort))
+
+
+def encode_cursor(value, invoice_id: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([value, invoice_id]).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[object, str]:
+    try:
+        value, invoice_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise SearchError("Invalid cursor")
+    return value, invoice_id
+
+
+def _range(start: Optional[str], end: Optional[str]) -> dict:
+    bounds = {}
+    if start:
+        bounds["$gte"] = start
+    if end:
+        bounds["$lte"] = end
+    return bounds
+
+
+def build_search(
+    number_prefix: Optional[str] = None,
+    customer_id: Optional[str] = None,
+    status: Optional[str] = None,
+    issue_from: Optional[str] = None,
+    issue_to: Optional[str] = None,
+    due_from: Optional[str] = None,
+    due_to: Optional[str] = None,
+    sort: str = "issue_date",
+    descending: bool = True,
+    cursor: Optional[str] = None
+) -> Tuple[dict, str, int, list]:
+    """Query, sort field, direction and index hint for a search"""
+    if number_prefix:
+        sort = "invoice_number"
+    elif sort not in SORT_FIELDS:
+        raise SearchError(f"sort must be one of {', '.join(SORT_FIELDS)}")
+    direction = -1 if descending else 1
+
+    query = {}
+    if number_prefix:
+        # Anchored, case-sensitive prefix regexes are bounded scans of the index
+        query["invoice_number"] = {"$regex": f"^{_escape_regex(number_prefix)}"}
+    if customer_id:
+        query["customer_id"] = customer_id
+    if status:
+        query["status"] = status
+    if _range(issue_from, issue_to):
+        query["issue_date"] = _range(issue_from, issue_to)
+    if _range(due_from, due_to):
+        query["due_date"] = _range(due_from, due_to)
+
+    ranged = [field for field in ("issue_date", "due_date") if field in query]
+    range_field = None if sort in ranged or sort == "invoice_number" else next(iter(ranged), None)
+
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        page = _page_after(sort, direction, value, last_id)
+        query = {"$and": [query, page]} if query else page
+
+    return query, sort, direction, search_index(customer_id, status, sort, range_field)
+
+
+def _page_after(sort: str, direction: int, value, last_id: str) -> dict:
+    """Filter for the documents after (value, last_id) in sort order.
+
+    Null and missing values sort before every other value, so they come
+    first ascending and last descending; comparison operators never match
+    them, so they are matched with equality to None.
+    """
+    after = "$lt" if direction == -1 else "$gt"
+    if sort == "invoice_number":
+        return {sort: {after: value}}
+    same = {sort: value, "id": {after: last_id}}
+    if value is None:
+        return {"$or": [same, {sort: {"$ne": None}}]} if direction == 1 else same
+    later = [{sort: {after: value}}, same]
+    if direction == -1:
+        later.append({sort: None})
+    return {"$or": later}
+
+
+def _escape_regex(text: str) -> str:
+    return "".join(f"\\{c}" if c in r".^$*+?{}[]\|()" else c for c in text)
+
+
+def _sort_spec(sort: str, direction: int) -> list:
+    return [(sort, direction)] if sort == "invoice_number" else [(sort, direction), ("id", direction)]
+
+
+async def search_invoices(limit: int = DEFAULT_LIMIT, **filters) -> dict:
+    """One page of matching invoices and the cursor of the next page"""
+    limit = max(1, min(limit, MAX_LIMIT))
+    query, sort, direction, hint = build_search(**filters)
+    # One extra document tells whether another page exists
+    invoices = await db.invoices.find(query, {"_id": 0}).sort(_sort_spec(sort, direction)).hint(hint).limit(limit + 1).to_list(None)
+    next_cursor = None
+    if len(invoices) > limit:
+        invoices = invoices[:limit]
+        last = invoices[-1]
+        next_cursor = encode_cursor(last.get(sort), last["id"])
+    return {"items": invoices, "next_cursor": next_cursor}
+
+
+def _plan_stages(plan: dict) -> List[dict]:
+    stages = [plan]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += _plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += _plan_stages(child)
+    return stages
+
+
+async def explain_search(limit: int = DEFAULT_LIMIT, **filters) -> dict:
+    """Index, sort stage and scan counts of the plan a search runs with"""
+    limit = max(1, min(limit, MAX_LIMIT))
+    query, sort, direction, hint = build_search(**filters)
+    explain = await db.invoices.find(query, {"_id": 0}).sort(_sort_spec(sort, direction)).hint(hint).limit(limit + 1).explain()
+    stages = _plan_stages(explain["queryPlanner"]["winningPlan"])
+    stats = explain.get("executionStats", {})
+    return {
+        "index": next((s.get("indexName") for s in stages if s.get("stage") == "IXSCAN"), None),
+        "expected_index": "_".join(f"{field}_{order}" for field, order in hint),
+        "in_memory_sort": any(s.get("stage") == "SORT" for s in stages),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "returned": stats.get("nReturned")
+    }
@@ -0,0 +1,81 @@
+"""Lease locks for work that must not run concurrently.
+
+Every API worker runs the same background loops and endpoints, so jobs that
+are not safe to overlap take a named lease in ``locks`` first. A lease
+expires on its own after ``ttl`` seconds, so a worker that dies does not hold
+it forever; long runs renew it as they make progress.
+"""
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import uuid
+
+from pymongo.errors import DuplicateKeyError
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+class LockHeld(Exception):
+    """The lease is held by someone else"""
+
+
+async def ensure_indexes():
+    await db.locks.create_index("id", unique=True)
+
+
+async def acquire(name: str, ttl: int) -> Optional[str]:
+    """Take the lease if it is free or expired; returns the owner token"""
+    owner = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    try:
+        await db.locks.update_one(
+            {"id": name, "expires_at": {"$lt": now}},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl), "acquired_at": now}},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        # A live lease exists, so the upsert tried to insert a second document
+        return None
+    return owner
+
+
+async def renew(name: str, owner: str, ttl: int) -> bool:
+    result = await db.locks.update_one(
+        {"id": name, "owner": owner},
+        {"$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl)}}
+    )
+    return result.matched_count == 1
+
+
+async def release(name: str, owner: str):
+    await db.locks.delete_one({"id": name, "owner": owner})
+
+
+class Lease:
+    def __init__(self, name: str, owner: str, ttl: int):
+        self.name = name
+        self.owner = owner
+        self.ttl = ttl
+
+    async def renew(self):
+        """Extend the lease; raises LockHeld if it was lost"""
+        if not await renew(self.name, self.owner, self.ttl):
+            raise LockHeld(self.name)
+
+
+@asynccontextmanager
+async def lease(name: str, ttl: int = 300):
+    """Hold a lease for the duration of a block, raising LockHeld if it is taken"""
+    owner = await acquire(name, ttl)
+    if owner is None:
+        raise LockHeld(name)
+    try:
+        yield Lease(name, owner, ttl)
+    finally:
+        await release(name, owner)
@@ -0,0 +1,241 @@
+"""Payments ledger and invoice balances.
+
+Every payment, refund or manual adjustment is appended to the ``payments``
+collection and never updated. Invoice ``paid_amount`` and ``balance_due`` are
+running totals of that ledger, moved by one pipeline update per payment that
+adds the amount and derives balance, status and paid date from the result,
+so concurrent payments can't overwrite each other. ``reconcile_invoices``
+rebuilds the totals from the ledger.
+"""
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from models import Payment
+from services.counters import record_change
+from services.locks import lease
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+RECONCILE_BATCH_SIZE = 500
+# Ledger entries younger than this may belong to a payment still being applied
+RECONCILE_SETTLE_SECONDS = 300
+
+DUPLICATE_KEY = 11000
+
+INVOICE_FIELDS = {
+    "_id": 0, "id": 1, "customer_id": 1, "status": 1, "total": 1, "paid_amount": 1, "balance_due": 1,
+    "paid_date": 1, "issue_date": 1
+}
+
+
+class PaymentError(Exception):
+    """A payment that can't be applied to the invoice"""
+
+
+async def ensure_indexes():
+    await db.payments.create_index([("invoice_id", 1), ("created_at", 1)])
+    await db.payments.create_index([("customer_id", 1), ("created_at", -1)])
+    # A reference (check number, gateway charge id) is applied to an invoice once
+    await db.payments.create_index(
+        [("invoice_id", 1), ("reference", 1)], unique=True,
+        partialFilterExpression={"reference": {"$type": "string"}}
+    )
+
+
+def settle_stages(now: datetime) -> list:
+    """Pipeline stages deriving balance_due, status and paid_date from paid_amount"""
+    paid_date = now.isoformat()
+    return [
+        {"$set": {"balance_due": {"$round": [{"$subtract": ["$total", "$paid_amount"]}, 2]}}},
+        {"$set": {
+            "status": {"$switch": {
+                "branches": [
+                    {"case": {"$lte": ["$balance_due", 0]}, "then": "paid"},
+                    # A refund reopens a paid invoice
+                    {"case": {"$eq": ["$status", "paid"]}, "then": "sent"}
+                ],
+                "default": "$status"
+            }},
+            "paid_date": {"$cond": [
+                {"$lte": ["$balance_due", 0]}, {"$ifNull": ["$paid_date", paid_date]}, None
+            ]},
+            "updated_at": now
+        }}
+    ]
+
+
+def payment_pipeline(amount: float, now: datetime) -> list:
+    """Single-write invoice update adding amount to paid_amount"""
+    return [
+        {"$set": {"paid_amount": {"$round": [{"$add": [{"$ifNull": ["$paid_amount", 0]}, amount]}, 2]}}},
+        *settle_stages(now)
+    ]
+
+
+async def record_payment(
+    invoice_id: str,
+    amount: float,
+    method: str = "manual",
+    reference: Optional[str] = None
+) -> Optional[dict]:
+    """Append a ledger entry and apply it to the invoice.
+
+    Returns {"payment", "invoice"}, or None when the invoice does not exist.
+    The ledger entry is written first, so a failure before the invoice update
+    is repaired by reconcile_invoices rather than losing the payment. An
+    invoice deleted in between takes the entry back out of the ledger.
+    Recording a reference already on the invoice returns the earlier entry
+    instead of applying it twice.
+    """
+    invoice = await db.invoices.find_one({"id": invoice_id}, INVOICE_FIELDS)
+    if invoice is None:
+        return None
+    if invoice.get("status") == "cancelled":
+        raise PaymentError("Cannot record a payment on a cancelled invoice")
+
+    payment = Payment(
+        invoice_id=invoice_id,
+        customer_id=invoice["customer_id"],
+        amount=round(amount, 2),
+        method=method,
+        reference=reference
+    )
+    doc = payment.model_dump()
+    try:
+        await db.payments.insert_one(doc)
+    except DuplicateKeyError:
+        existing = await db.payments.find_one({"invoice_id": invoice_id, "reference": reference}, {"_id": 0})
+        return {"payment": existing, "invoice": await db.invoices.find_one({"id": invoice_id}, {"_id": 0})}
+    doc.pop("_id", None)
+
+    updated = await db.invoices.find_one_and_update(
+        {"id": invoice_id},
+        payment_pipeline(payment.amount, datetime.now(timezone.utc)),
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if updated is None:
+        await db.payments.delete_one({"id": doc["id"]})
+        return None
+    # Counters and balances only look at status and the money fields, which moved by exactly this amount
+    before = {
+        **updated,
+        "status": invoice["status"],
+        "paid_amount": updated["paid_amount"] - payment.amount,
+        "balance_due": updated["balance_due"] + payment.amount
+    }
+    await record_change("invoices", before, updated)
+    return {"payment": doc, "invoice": updated}
+
+
+async def get_payments(invoice_id: str) -> List[dict]:
+    return await db.payments.find({"invoice_id": invoice_id}, {"_id": 0}).sort("created_at", 1).to_list(None)
+
+
+def _paid_at(invoice: dict, default: datetime) -> datetime:
+    """When an invoice without ledger entries was paid, as near as it is known"""
+    value = invoice.get("paid_date") or invoice.get("issue_date")
+    if not value:
+        return default
+    paid = datetime.fromisoformat(value) if isinstance(value, str) else value
+    return paid if paid.tzinfo else paid.replace(tzinfo=timezone.utc)
+
+
+async def reconcile_invoices(invoice_ids: Optional[List[str]] = None) -> dict:
+    """Rebuild paid_amount, balance_due and status of invoices from the ledger.
+
+    Invoices paid before the ledger existed have no entries; their current
+    paid_amount is recorded once as an opening balance entry instead of
+    being reset; its fixed reference lets the unique (invoice_id, reference)
+    index drop a second one. Runs hold a lease, so they never overlap, and
+    raise LockHeld while another is in progress. Invoices are read a batch at a time and the ledger is summed
+    for that batch right after. An invoice with a ledger entry from the last
+    RECONCILE_SETTLE_SECONDS is skipped, as its payment may be written but
+    not yet applied, and corrections only apply if paid_amount has not moved
+    since it was read, so payments made during the run are never lost or
+    counted twice.
+    """
+    query = {"id": {"$in": invoice_ids}} if invoice_ids else {}
+    now = datetime.now(timezone.utc)
+    # Entry _ids carry their insert time, which is what matters here
+    settled = ObjectId.from_datetime(now - timedelta(seconds=RECONCILE_SETTLE_SECONDS))
+    result = {"checked": 0, "corrected": 0, "corrected_invoice_ids": [], "opening_balances": 0, "skipped_in_flight": 0}
+
+    async def reconcile_batch(invoices: List[dict]):
+        ledger = {
+            row["_id"]: row
+            async for row in db.payments.aggregate([
+                {"$match": {"invoice_id": {"$in": [invoice["id"] for invoice in invoices]}}},
+                {"$group": {"_id": "$invoice_id", "paid": {"$sum": "$amount"}, "latest": {"$max": "$_id"}}}
+            ])
+        }
+        openings = []
+        for invoice in invoices:
+            result["checked"] += 1
+            paid = invoice.get("paid_amount") or 0.0
+            entries = ledger.get(invoice["id"])
+            if entries is None:
+                if paid:
+                    openings.append(Payment(
+                        invoice_id=invoice["id"],
+                        customer_id=invoice["customer_id"],
+                        amount=round(paid, 2),
+                        method="opening_balance",
+                        reference=f"opening-{invoice['id']}",
+                        # Dated when the invoice was paid so statements place it in that month
+                        created_at=_paid_at(invoice, now)
+                    ).model_dump())
+                ledger_paid = round(paid, 2)
+            elif entries["latest"] > settled:
+                result["skipped_in_flight"] += 1
+                continue
+            else:
+                ledger_paid = round(entries["paid"], 2)
+
+            expected_balance = round((invoice.get("total") or 0.0) - ledger_paid, 2)
+            if abs(paid - ledger_paid) <= 0.005 and abs((invoice.get("balance_due") or 0.0) - expected_balance) <= 0.005:
+                continue
+            updated = await db.invoices.find_one_and_update(
+                {"id": invoice["id"], "paid_amount": invoice.get("paid_amount")},
+                [{"$set": {"paid_amount": ledger_paid}}, *settle_stages(now)],
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER
+            )
+            # No match: paid or deleted since it was read, left for the next run
+            if updated is not None:
+                result["corrected_invoice_ids"].append(invoice["id"])
+                await record_change("invoices", invoice, updated)
+        if openings:
+            try:
+                await db.payments.insert_many(openings, ordered=False)
+                result["opening_balances"] += len(openings)
+            except BulkWriteError as error:
+                # Opening entries recorded since the ledger was read are kept once
+                if any(e.get("code") != DUPLICATE_KEY for e in error.details.get("writeErrors", [])):
+                    raise
+                result["opening_balances"] += error.details.get("nInserted", 0)
+
+    async with lease("reconcile-invoices") as lock:
+        batch = []
+        async for invoice in db.invoices.find(query, INVOICE_FIELDS):
+            batch.append(invoice)
+            if len(batch) >= RECONCILE_BATCH_SIZE:
+                await reconcile_batch(batch)
+                await lock.renew()
+                batch = []
+        if batch:
+            await reconcile_batch(batch)
+
+    result["corrected"] = len(result["corrected_invoice_ids"])
+    return result
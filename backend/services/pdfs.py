@@ -0,0 +1,400 @@
+"""Invoice and quote PDFs.
+
+Documents are laid out by a small built-in PDF writer (standard Helvetica
+fonts, compressed content streams), so no native PDF toolkit is needed.
+Rendering is CPU-bound and runs in a ``ProcessPoolExecutor`` to keep the
+event loop free; the render functions are module-level and only take plain
+dicts so they can be sent to worker processes. The pool is started with the
+app and uses spawned processes, which do not inherit the server's threads
+and connections.
+
+Rendered files are cached on disk under PDF_CACHE_DIR, keyed by document id
+and a hash of everything that is rendered, the document and the customer
+details printed on it: any change to either misses the cache, and the stale
+file is removed when the new one is stored. Deleting a document evicts its
+files.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import AsyncIterator, Callable, Dict, List, Optional
+import asyncio
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import zipfile
+import zlib
+
+from fastapi import Response
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+logger = logging.getLogger(__name__)
+
+PDF_CACHE_DIR = Path(os.environ.get("PDF_CACHE_DIR", Path(__file__).resolve().parent.parent / "pdf_cache"))
+PDF_WORKERS = int(os.environ.get("PDF_WORKERS", str(os.cpu_count() or 2)))
+COMPANY_NAME = os.environ.get("COMPANY_NAME", "PoolPro")
+ZIP_BATCH_SIZE = 50
+
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792  # US Letter, points
+MARGIN = 50
+
+_executor: Optional[ProcessPoolExecutor] = None
+# Renders in flight, so concurrent requests for one document share a render
+_rendering: Dict[str, "asyncio.Future"] = {}
+
+
+# Layout
+
+# Helvetica advance widths (1/1000 em) for the characters used in amounts;
+# everything else is approximated, which is close enough for right alignment
+_WIDTHS = {c: 556 for c in "0123456789$"}
+_WIDTHS.update({".": 278, ",": 278, "-": 333, " ": 278})
+
+
+def _text_width(text: str, size: float) -> float:
+    return sum(_WIDTHS.get(c, 556) for c in text) * size / 1000
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def _money(value: Optional[float]) -> str:
+    value = value or 0.0
+    sign = "-" if value < 0 else ""
+    return f"{sign}${abs(value):,.2f}"
+
+
+def _wrap(text: str, width: int) -> List[str]:
+    lines, line = [], ""
+    for word in text.split():
+        if line and len(line) + 1 + len(word) > width:
+            lines.append(line)
+            line = word
+        else:
+            line = f"{line} {word}" if line else word
+    if line:
+        lines.append(line)
+    return lines or [""]
+
+
+class _Layout:
+    """Top-to-bottom page layout emitting PDF content stream operators"""
+
+    def __init__(self):
+        self.pages: List[List[str]] = []
+        self.new_page()
+
+    def new_page(self):
+        self.ops: List[str] = []
+        self.pages.append(self.ops)
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def ensure(self, height: float):
+        if self.y - height < MARGIN:
+            self.new_page()
+
+    def text(self, x: float, y: float, text: str, size: float = 10, bold: bool = False, align: str = "left"):
+        if align == "right":
+            x -= _text_width(text, size)
+        font = "F2" if bold else "F1"
+        self.ops.append(f"BT /{font} {size} Tf {x:.2f} {y:.2f} Td ({_escape(text)}) Tj ET")
+
+    def rule(self, y: float):
+        self.ops.append(f"0.5 w {MARGIN} {y:.2f} m {PAGE_WIDTH - MARGIN} {y:.2f} l S")
+
+
+def build_pdf(pages: List[List[str]]) -> bytes:
+    """Assemble content streams into a PDF file"""
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once page object numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>",
+    ]
+    kids = []
+    for ops in pages:
+        stream = zlib.compress("\n".join(ops).encode("cp1252", errors="replace"))
+        objects.append(
+            b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream"
+        )
+        content_number = len(objects)
+        objects.append((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_number} 0 R >>"
+        ).encode())
+        kids.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>".encode()
+
+    out = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        out += b"%010d 00000 n \n" % offset
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+def _render(title: str, number: str, meta: List[tuple], customer: dict, items: List[dict], totals: List[tuple], notes: Optional[str]) -> bytes:
+    layout = _Layout()
+    right = PAGE_WIDTH - MARGIN
+
+    layout.text(MARGIN, layout.y - 20, COMPANY_NAME, size=20, bold=True)
+    layout.text(right, layout.y - 20, title, size=20, bold=True, align="right")
+    layout.y -= 44
+    layout.text(right, layout.y, number, size=11, align="right")
+    for label, value in meta:
+        layout.y -= 14
+        layout.text(right, layout.y, f"{label}: {value}", size=10, align="right")
+
+    top = PAGE_HEIGHT - MARGIN - 44
+    layout.text(MARGIN, top, "Bill to", size=10, bold=True)
+    y = top
+    for line in [customer.get("name"), customer.get("address"), customer.get("email")]:
+        if line:
+            y -= 14
+            layout.text(MARGIN, y, line, size=10)
+    layout.y = min(layout.y, y) - 30
+
+    def header():
+        layout.text(MARGIN, layout.y, "Description", bold=True)
+        layout.text(right - 190, layout.y, "Qty", bold=True, align="right")
+        layout.text(right - 90, layout.y, "Unit price", bold=True, align="right")
+        layout.text(right, layout.y, "Amount", bold=True, align="right")
+        layout.rule(layout.y - 6)
+        layout.y -= 22
+
+    header()
+    for item in items:
+        lines = _wrap(item.get("description", ""), 52)
+        if layout.y - 14 * len(lines) < MARGIN:
+            layout.new_page()
+            header()
+        layout.text(right - 190, layout.y, str(item.get("quantity", 1)), align="right")
+        layout.text(right - 90, layout.y, _money(item.get("unit_price")), align="right")
+        layout.text(right, layout.y, _money(item.get("total")), align="right")
+        for line in lines:
+            layout.text(MARGIN, layout.y, line)
+            layout.y -= 14
+        layout.y -= 4
+
+    layout.ensure(20 + 16 * len(totals))
+    layout.rule(layout.y + 6)
+    layout.y -= 10
+    for label, value, bold in totals:
+        layout.text(right - 110, layout.y, label, bold=bold, align="right")
+        layout.text(right, layout.y, _money(value), bold=bold, align="right")
+        layout.y -= 16
+
+    if notes:
+        lines = _wrap(notes, 90)
+        layout.ensure(30 + 14 * min(len(lines), 3))
+        layout.y -= 14
+        layout.text(MARGIN, layout.y, "Notes", bold=True)
+        for line in lines:
+            layout.ensure(14)
+            layout.y -= 14
+            layout.text(MARGIN, layout.y, line)
+
+    return build_pdf(layout.pages)
+
+
+def render_invoice(invoice: dict, customer: dict) -> bytes:
+    meta = [("Issued", invoice.get("issue_date", "")), ("Due", invoice.get("due_date", ""))]
+    if invoice.get("status") == "paid":
+        meta.append(("Paid", (invoice.get("paid_date") or "")[:10]))
+    totals = [
+        ("Subtotal", invoice.get("subtotal"), False),
+        ("Tax", invoice.get("tax"), False),
+        ("Total", invoice.get("total"), True),
+    ]
+    if invoice.get("paid_amount"):
+        totals.append(("Paid", -invoice["paid_amount"], False))
+    totals.append(("Balance due", invoice.get("balance_due"), True))
+    return _render(
+        "INVOICE", invoice["invoice_number"], meta, customer,
+        invoice.get("line_items", []), totals, invoice.get("notes")
+    )
+
+
+def render_quote(quote: dict, customer: dict) -> bytes:
+    meta = [("Status", quote.get("status", "").title()), ("Valid until", quote.get("valid_until", ""))]
+    totals = [
+        ("Subtotal", quote.get("subtotal"), False),
+        ("Tax", quote.get("tax"), False),
+        ("Total", quote.get("total"), True),
+    ]
+    return _render("QUOTE", quote["id"], meta, customer, quote.get("items", []), totals, quote.get("notes"))
+
+
+# Rendering service
+
+def start() -> ProcessPoolExecutor:
+    """Start the worker processes"""
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _executor
+
+
+def _get_executor() -> ProcessPoolExecutor:
+    # Started with the app; scripts that render without it start the pool here
+    return _executor or start()
+
+
+def shutdown():
+    """Stop the worker processes"""
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def cache_path(kind: str, doc: dict, customer: dict) -> Path:
+    """Cache file of a document, named by a hash of the render inputs"""
+    inputs = json.dumps([COMPANY_NAME, doc, customer], sort_keys=True, default=str)
+    version = hashlib.sha256(inputs.encode()).hexdigest()[:20]
+    return PDF_CACHE_DIR / kind / f"{doc['id']}-{version}.pdf"
+
+
+def _evict(kind: str, doc_id: str):
+    for path in (PDF_CACHE_DIR / kind).glob(f"{doc_id}-*.pdf"):
+        path.unlink(missing_ok=True)
+
+
+async def evict(kind: str, doc_id: str):
+    """Remove the cached files of a deleted document"""
+    await asyncio.to_thread(_evict, kind, doc_id)
+
+
+def _store(path: Path, data: bytes):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp = path.with_suffix(f".{os.getpid()}.tmp")
+    temp.write_bytes(data)
+    os.replace(temp, path)
+    # Earlier versions of the same document are stale now
+    for old in path.parent.glob(f"{path.name.rsplit('-', 1)[0]}-*.pdf"):
+        if old != path:
+            old.unlink(missing_ok=True)
+
+
+def _read(path: Path) -> Optional[bytes]:
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+async def _customers(customer_ids: List[str]) -> Dict[str, dict]:
+    customers = await db.customers.find(
+        {"id": {"$in": customer_ids}}, {"_id": 0, "id": 1, "name": 1, "address": 1, "email": 1}
+    ).to_list(None)
+    return {c["id"]: c for c in customers}
+
+
+async def _get_pdf(kind: str, doc: dict, customer: Optional[dict], render: Callable[[dict, dict], bytes]) -> bytes:
+    customer = customer or {"name": doc.get("customer_name")}
+    path = cache_path(kind, doc, customer)
+    data = await asyncio.to_thread(_read, path)
+    if data is not None:
+        return data
+
+    key = str(path)
+    if key not in _rendering:
+        async def build():
+            try:
+                loop = asyncio.get_running_loop()
+                rendered = await loop.run_in_executor(_get_executor(), render, doc, customer)
+                await asyncio.to_thread(_store, path, rendered)
+                return rendered
+            finally:
+                _rendering.pop(key, None)
+        _rendering[key] = asyncio.ensure_future(build())
+    # A waiter that is cancelled (its client went away) must not cancel the render for the others
+    return await asyncio.shield(_rendering[key])
+
+
+async def invoice_pdf(invoice: dict) -> bytes:
+    customer = (await _customers([invoice["customer_id"]])).get(invoice["customer_id"])
+    return await _get_pdf("invoices", invoice, customer, render_invoice)
+
+
+async def quote_pdf(quote: dict) -> bytes:
+    customer = (await _customers([quote["customer_id"]])).get(quote["customer_id"])
+    return await _get_pdf("quotes", quote, customer, render_quote)
+
+
+def pdf_response(data: bytes, filename: str) -> Response:
+    return Response(content=data, media_type="application/pdf", headers={
+        "Content-Disposition": f'inline; filename="{filename}.pdf"'
+    })
+
+
+class _ZipStream:
+    """Write-only file object collecting what ZipFile writes, drained as chunks"""
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offset = 0
+
+    def write(self, data) -> int:
+        self.buffer += data
+        self.offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.offset
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        chunk = bytes(self.buffer)
+        self.buffer.clear()
+        return chunk
+
+
+async def billing_run_zip(run_id: str) -> AsyncIterator[bytes]:
+    """Zip of every invoice in a billing run, streamed as it is rendered.
+
+    Invoices are rendered a batch at a time across the process pool, so only
+    one batch of PDFs is held in memory.
+    """
+    stream = _ZipStream()
+    # PDF content is already compressed
+    archive = zipfile.ZipFile(stream, mode="w", compression=zipfile.ZIP_STORED)
+    cursor = db.invoices.find({"billing_run_id": run_id}, {"_id": 0}).sort("invoice_number", 1)
+
+    async def write(batch: List[dict]):
+        customers = await _customers(list({invoice["customer_id"] for invoice in batch}))
+        rendered = await asyncio.gather(*[
+            _get_pdf("invoices", invoice, customers.get(invoice["customer_id"]), render_invoice)
+            for invoice in batch
+        ])
+        for invoice, data in zip(batch, rendered):
+            archive.writestr(f"{invoice['invoice_number']}.pdf", data)
+
+    batch: List[dict] = []
+    async for invoice in cursor:
+        batch.append(invoice)
+        if len(batch) >= ZIP_BATCH_SIZE:
+            await write(batch)
+            batch = []
+            yield stream.drain()
+    if batch:
+        await write(batch)
+    archive.close()
+    yield stream.drain()
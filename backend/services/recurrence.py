@@ -0,0 +1,206 @@
+"""Recurring routine-service job generation.
+
+Every active customer gets a weekly "Routine Service" job on their service day
+for the next N weeks. Each generated job carries a ``recurrence_key`` of
+customer and date covered by a unique index, so runs can be repeated (or
+overlap) without creating duplicates. New jobs are written with one bulk
+insert.
+
+Routes are per weekday and hold the stops of one date: every run points each
+route at its next service date, attaching that date's routine jobs and
+detaching routine jobs of other dates, so routes roll forward week by week.
+"""
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from pymongo.errors import BulkWriteError
+
+from models import Job
+from services.counters import record_changes
+from services.route_membership import update_membership
+from services.scheduling import booked_until
+from services.service_time import service_minutes
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+ROUTINE_SERVICE_TYPE = "Routine Service"
+ROUTINE_DAY_START_MINUTE = 8 * 60
+UNASSIGNED_TECHNICIAN = "Unassigned"
+
+WEEKDAYS = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+
+DUPLICATE_KEY = 11000
+
+
+async def ensure_indexes():
+    await db.jobs.create_index(
+        "recurrence_key", unique=True,
+        partialFilterExpression={"recurrence_key": {"$type": "string"}}
+    )
+
+
+def recurrence_key(customer_id: str, scheduled_date: str) -> str:
+    return f"routine:{customer_id}:{scheduled_date}"
+
+
+def format_time(minute: float) -> str:
+    """"09:00 AM" style time for a minute of the day"""
+    hours, minutes = divmod(int(round(minute)), 60)
+    return f"{(hours % 12) or 12:02d}:{minutes:02d} {'AM' if hours % 24 < 12 else 'PM'}"
+
+
+def service_dates(service_day: str, start: date, weeks: int) -> List[str]:
+    """The next weeks occurrences of a weekday on or after start"""
+    if service_day not in WEEKDAYS:
+        return []
+    first = start + timedelta(days=(WEEKDAYS.index(service_day) - start.weekday()) % 7)
+    return [(first + timedelta(weeks=k)).isoformat() for k in range(weeks)]
+
+
+async def _routes_by_customer(days: List[str]) -> dict:
+    """Active routes per day, their jobs, and which route each customer is already on"""
+    routes = await db.routes.find(
+        {"day": {"$in": days}, "status": "active"}, {"_id": 0}
+    ).to_list(None)
+    job_ids = [job_id for route in routes for job_id in route.get("jobs", [])]
+    jobs = await db.jobs.find(
+        {"id": {"$in": job_ids}},
+        {"_id": 0, "id": 1, "customer_id": 1, "scheduled_date": 1, "recurrence_key": 1}
+    ).to_list(None)
+    customer_by_job = {job["id"]: job["customer_id"] for job in jobs}
+
+    by_day: Dict[str, List[dict]] = {}
+    customer_route: Dict[Tuple[str, str], dict] = {}
+    for route in routes:
+        by_day.setdefault(route["day"], []).append(route)
+        for job_id in route.get("jobs", []):
+            customer_id = customer_by_job.get(job_id)
+            if customer_id:
+                customer_route.setdefault((route["day"], customer_id), route)
+    return {"by_day": by_day, "customer_route": customer_route, "jobs": {job["id"]: job for job in jobs}}
+
+
+async def generate_routine_jobs(weeks: int = 4, start: Optional[date] = None) -> dict:
+    """Create the missing routine jobs for every active customer for the next weeks"""
+    start = start or datetime.now(timezone.utc).date()
+
+    customers = await db.customers.find(
+        {"status": "active"},
+        {
+            "_id": 0, "id": 1, "name": 1, "address": 1, "service_day": 1, "route_position": 1,
+            "pools.id": 1, "pools.type": 1, "pools.gallons": 1, "pools.equipment": 1
+        }
+    ).to_list(None)
+    wanted = {
+        recurrence_key(customer["id"], scheduled): (customer, scheduled)
+        for customer in customers
+        for scheduled in service_dates(customer.get("service_day"), start, weeks)
+    }
+    existing = await db.jobs.find(
+        {"recurrence_key": {"$in": list(wanted)}},
+        {"_id": 0, "id": 1, "customer_id": 1, "scheduled_date": 1, "recurrence_key": 1}
+    ).to_list(None)
+    for job in existing:
+        wanted.pop(job["recurrence_key"], None)
+
+    # Every service day's routes roll forward, not only those getting new jobs
+    routing = await _routes_by_customer(list({c.get("service_day") for c in customers if c.get("service_day")}))
+    planned_stops = {
+        route["id"]: len(route.get("jobs", []))
+        for routes in routing["by_day"].values() for route in routes
+    }
+
+    # Route order: by date, then the customer's position on their service day
+    pending = sorted(wanted.items(), key=lambda item: (item[1][1], item[1][0].get("route_position", 1)))
+    docs = []
+    route_of: Dict[str, Optional[dict]] = {}
+    # New stops of a technician's day are booked back to back after the jobs it already has
+    technicians = list({route["technician_name"] for routes in routing["by_day"].values() for route in routes})
+    booked = await booked_until(technicians, list({scheduled for _, scheduled in wanted.values()})) if pending else {}
+    next_start: Dict[Tuple[Optional[str], str], float] = {}
+    for key, (customer, scheduled) in pending:
+        day = customer["service_day"]
+        route = routing["customer_route"].get((day, customer["id"]))
+        if route is None and routing["by_day"].get(day):
+            # New customers go to the day's lightest route and stay there
+            route = min(routing["by_day"][day], key=lambda r: planned_stops[r["id"]])
+            routing["customer_route"][(day, customer["id"])] = route
+            planned_stops[route["id"]] += 1
+        slot = (route["technician_name"] if route else None, scheduled)
+        start_minute = next_start.get(slot, max(ROUTINE_DAY_START_MINUTE, booked.get(slot, 0)))
+        job = Job(
+            customer_id=customer["id"],
+            customer_name=customer["name"],
+            customer_address=customer.get("address", ""),
+            service_type=ROUTINE_SERVICE_TYPE,
+            scheduled_date=scheduled,
+            scheduled_time=format_time(start_minute),
+            technician=route["technician_name"] if route else UNASSIGNED_TECHNICIAN,
+            recurrence_key=key
+        ).model_dump()
+        if route is not None:
+            next_start[slot] = start_minute + service_minutes(job, customer)
+        docs.append(job)
+        route_of[job["id"]] = route
+
+    inserted = docs
+    if docs:
+        try:
+            await db.jobs.insert_many(docs, ordered=False)
+        except BulkWriteError as error:
+            # A concurrent run created some of these first; keep the rest
+            failed = {
+                e["index"] for e in error.details.get("writeErrors", [])
+                if e.get("code") == DUPLICATE_KEY
+            }
+            if len(failed) < len(error.details.get("writeErrors", [])):
+                raise
+            inserted = [doc for k, doc in enumerate(docs) if k not in failed]
+        for doc in inserted:
+            doc.pop("_id", None)
+        await record_changes("jobs", [(None, doc) for doc in inserted])
+
+    # Each route only carries its next date; later dates are attached by later runs
+    next_jobs: Dict[Tuple[str, str], List[str]] = {}
+    for doc in inserted:
+        route = route_of[doc["id"]]
+        if route is not None:
+            next_jobs.setdefault((route["id"], doc["scheduled_date"]), []).append(doc["id"])
+    service_day = {customer["id"]: customer.get("service_day") for customer in customers}
+    for job in existing:
+        route = routing["customer_route"].get((service_day.get(job["customer_id"]), job["customer_id"]))
+        if route is not None:
+            next_jobs.setdefault((route["id"], job["scheduled_date"]), []).append(job["id"])
+
+    now = datetime.now(timezone.utc).isoformat()
+    routes_updated = 0
+    for day, routes in routing["by_day"].items():
+        next_date = service_dates(day, start, 1)[0]
+        for route in routes:
+            current = route.get("jobs", [])
+            add = [j for j in next_jobs.get((route["id"], next_date), []) if j not in current]
+            remove = [
+                j for j in current
+                if routing["jobs"].get(j, {}).get("recurrence_key")
+                and routing["jobs"][j].get("scheduled_date") != next_date
+            ]
+            if add or remove:
+                await update_membership(route["id"], add, remove, now)
+                routes_updated += 1
+
+    return {
+        "start_date": start.isoformat(),
+        "weeks": weeks,
+        "customers": len(customers),
+        "created": len(inserted),
+        "skipped_existing": len(existing) + len(docs) - len(inserted),
+        "unrouted": sum(1 for doc in inserted if route_of[doc["id"]] is None),
+        "routes_updated": routes_updated
+    }
@@ -0,0 +1,175 @@
+"""Multi-technician daily route building (vehicle routing).
+
+The day's stops are split across technicians with an angular sweep around
+their centroid, cut into chunks of roughly equal workload (service plus
+travel minutes). Each chunk is ordered with the single-route optimizer, then
+stops are relocated from the longest route to the route where they are
+cheapest to insert while that lowers the longest duration. Finally stops are
+moved off routes that exceed the shift length, or left unassigned when no
+route has room. Everything is bounded by a time budget so 500+ stops finish
+in a few seconds.
+"""
+import math
+import time
+from typing import List, Sequence, Tuple
+
+from services.route_optimizer import optimize_order, path_length
+
+
+def sweep_order(points: Sequence[Sequence[float]]) -> List[int]:
+    """Stop indices sorted by angle around the centroid, starting after the widest gap"""
+    n = len(points)
+    if n == 0:
+        return []
+    cx = sum(p[0] for p in points) / n
+    cy = sum(p[1] for p in points) / n
+    angles = [math.atan2(p[1] - cy, p[0] - cx) for p in points]
+    order = sorted(range(n), key=lambda i: angles[i])
+    # Start the sweep after the largest angular gap so no cluster is cut in two
+    gaps = [
+        (angles[order[(k + 1) % n]] - angles[order[k]]) % (2 * math.pi)
+        for k in range(n)
+    ]
+    start = (max(range(n), key=lambda k: gaps[k]) + 1) % n
+    return order[start:] + order[:start]
+
+
+def split_by_workload(order: List[int], service: List[float], travel: List[List[float]], parts: int) -> List[List[int]]:
+    """Cut a sweep order into parts of roughly equal service plus travel time"""
+    if parts <= 1 or not order:
+        return [list(order)] + [[] for _ in range(max(parts - 1, 0))]
+    costs = []
+    for k, stop in enumerate(order):
+        hop = travel[order[k - 1]][stop] if k > 0 else 0.0
+        costs.append(service[stop] + hop)
+    total = sum(costs)
+    chunks: List[List[int]] = [[] for _ in range(parts)]
+    running = 0.0
+    for stop, cost in zip(order, costs):
+        # Assign by the midpoint of the stop's workload share
+        index = min(int((running + cost / 2) / total * parts), parts - 1) if total > 0 else 0
+        chunks[index].append(stop)
+        running += cost
+    return chunks
+
+
+def route_duration(route: List[int], service: List[float], travel: List[List[float]]) -> float:
+    return sum(service[s] for s in route) + path_length(travel, route)
+
+
+def _cheapest_insertion(route: List[int], stop: int, travel: List[List[float]]) -> Tuple[float, int]:
+    """Extra travel and position for inserting stop into an open path"""
+    if not route:
+        return 0.0, 0
+    best = (travel[stop][route[0]], 0)
+    end = travel[route[-1]][stop]
+    if end < best[0]:
+        best = (end, len(route))
+    for k in range(len(route) - 1):
+        a, b = route[k], route[k + 1]
+        delta = travel[a][stop] + travel[stop][b] - travel[a][b]
+        if delta < best[0]:
+            best = (delta, k + 1)
+    return best
+
+
+def _removal_saving(route: List[int], k: int, travel: List[List[float]]) -> float:
+    """Travel saved by removing route[k] from an open path"""
+    stop = route[k]
+    if len(route) == 1:
+        return 0.0
+    if k == 0:
+        return travel[stop][route[1]]
+    if k == len(route) - 1:
+        return travel[route[k - 1]][stop]
+    a, b = route[k - 1], route[k + 1]
+    return travel[a][stop] + travel[stop][b] - travel[a][b]
+
+
+def _rebalance(routes: List[List[int]], service: List[float], travel: List[List[float]], deadline: float):
+    """Relocate stops off the longest route while that shortens it"""
+    durations = [route_duration(r, service, travel) for r in routes]
+    while time.monotonic() < deadline:
+        longest = max(range(len(routes)), key=lambda r: durations[r])
+        source = routes[longest]
+        best = None
+        for k, stop in enumerate(source):
+            saving = _removal_saving(source, k, travel) + service[stop]
+            for target in range(len(routes)):
+                if target == longest:
+                    continue
+                extra, position = _cheapest_insertion(routes[target], stop, travel)
+                new_target = durations[target] + extra + service[stop]
+                new_source = durations[longest] - saving
+                new_max = max(new_target, new_source)
+                if new_max < durations[longest] - 1e-6 and (best is None or new_max < best[0]):
+                    best = (new_max, k, target, position, new_source, new_target)
+        if best is None:
+            return
+        _, k, target, position, new_source, new_target = best
+        stop = source.pop(k)
+        routes[target].insert(position, stop)
+        durations[longest] = new_source
+        durations[target] = new_target
+
+
+def _enforce_shift(routes: List[List[int]], service: List[float], travel: List[List[float]], shift: float) -> List[int]:
+    """Move stops off over-long routes; stops that fit nowhere are returned"""
+    unassigned = []
+    durations = [route_duration(r, service, travel) for r in routes]
+    for r, route in enumerate(routes):
+        while route and durations[r] > shift:
+            # Drop the stop whose removal saves the most time
+            k = max(range(len(route)), key=lambda i: _removal_saving(route, i, travel) + service[route[i]])
+            durations[r] -= _removal_saving(route, k, travel) + service[route[k]]
+            stop = route.pop(k)
+            placed = False
+            for target in sorted(range(len(routes)), key=lambda t: durations[t]):
+                if target == r:
+                    continue
+                extra, position = _cheapest_insertion(routes[target], stop, travel)
+                if durations[target] + extra + service[stop] <= shift:
+                    routes[target].insert(position, stop)
+                    durations[target] += extra + service[stop]
+                    placed = True
+                    break
+            if not placed:
+                unassigned.append(stop)
+    return unassigned
+
+
+def build_routes(
+    points: Sequence[Sequence[float]],
+    service: List[float],
+    travel: List[List[float]],
+    technicians: int,
+    shift_minutes: float,
+    time_budget: float = 3.0
+) -> Tuple[List[List[int]], List[int]]:
+    """Split and order stops across technicians.
+
+    points are [lon, lat] per stop, service the minutes spent at each stop and
+    travel the stop-to-stop travel minutes. Returns one ordered list of stop
+    indices per technician and the stops that did not fit any shift.
+    """
+    if technicians <= 0:
+        return [], list(range(len(points)))
+    start = time.monotonic()
+    deadline = start + time_budget
+
+    routes = split_by_workload(sweep_order(points), service, travel, technicians)
+
+    def optimize_all(budget: float):
+        per_route = budget / max(len(routes), 1)
+        for r, route in enumerate(routes):
+            if len(route) > 2:
+                sub = [[travel[a][b] for b in route] for a in route]
+                order = optimize_order(sub, per_route)
+                routes[r] = [route[i] for i in order]
+
+    # Spend roughly half the budget ordering, the rest balancing and re-ordering
+    optimize_all(time_budget * 0.4)
+    _rebalance(routes, service, travel, start + time_budget * 0.7)
+    unassigned = _enforce_shift(routes, service, travel, shift_minutes)
+    optimize_all(max(deadline - time.monotonic(), 0.0))
+    return routes, unassigned
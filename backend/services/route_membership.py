@@ -0,0 +1,154 @@
+"""Atomic route job membership updates.
+
+Adding and removing stops is a single pipeline update on the route document:
+removed ids are filtered out, new ids are appended unless already present
+(``$pull`` / ``$addToSet`` semantics that keep the stop order) and
+``total_stops`` is recomputed from the resulting array.
+
+The estimate change is computed from the job list just read and applied in
+the same update, which only matches while the route still has that list; if
+another edit got in first the change is recomputed and retried. Membership
+and estimate therefore never disagree, and concurrent edits never overwrite
+each other's changes.
+"""
+from typing import Dict, List, Set
+
+from pymongo import ReturnDocument
+
+from services.daily_plans import invalidate as invalidate_plans
+from services.service_time import load_stops, travel_minutes_between
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+def membership_pipeline(add: List[str], remove: List[str], updated_at: str) -> list:
+    """Pipeline update removing then appending job ids and recounting stops"""
+    jobs = {"$ifNull": ["$jobs", []]}
+    if remove:
+        jobs = {"$filter": {
+            "input": jobs,
+            "cond": {"$not": [{"$in": ["$$this", {"$literal": remove}]}]}
+        }}
+    stages = [{"$set": {"jobs": jobs, "updated_at": updated_at}}]
+    if add:
+        stages.append({"$set": {"jobs": {"$concatArrays": ["$jobs", {"$filter": {
+            "input": {"$literal": list(dict.fromkeys(add))},
+            "cond": {"$not": [{"$in": ["$$this", "$jobs"]}]}
+        }}]}}})
+    stages.append({"$set": {"total_stops": {"$size": "$jobs"}}})
+    return stages
+
+
+def estimate_pipeline(service_delta: float, travel_delta: float) -> list:
+    """Pipeline update adding to the stored estimate and recomputing estimated_duration"""
+    return [
+        {"$set": {
+            "service_minutes": {"$round": [{"$max": [0, {"$add": [{"$ifNull": ["$service_minutes", 0]}, service_delta]}]}, 1]},
+            "travel_minutes": {"$round": [{"$max": [0, {"$add": [{"$ifNull": ["$travel_minutes", 0]}, travel_delta]}]}, 1]}
+        }},
+        {"$set": {"estimated_duration": {"$toInt": {"$round": [{"$add": ["$service_minutes", "$travel_minutes"]}, 0]}}}}
+    ]
+
+
+def apply_membership(before: List[str], add: List[str], remove: List[str]) -> List[str]:
+    """The job list the membership pipeline produces from before"""
+    removed = set(remove)
+    jobs = [job_id for job_id in before if job_id not in removed]
+    present = set(jobs)
+    for job_id in dict.fromkeys(add):
+        if job_id not in present:
+            jobs.append(job_id)
+            present.add(job_id)
+    return jobs
+
+
+def _neighbourhood(jobs: List[str], k: int, stops: Dict[str, dict], loaded: Set[str]) -> List[str]:
+    """Stops on each side of jobs[k] up to the nearest located one.
+
+    Travel skips stops without a location, so the leg into and out of a stop
+    runs to the nearest located stop, not just the adjacent one. Stops not
+    loaded yet end the walk until their location is known.
+    """
+    found = []
+    for step in (-1, 1):
+        i = k + step
+        while 0 <= i < len(jobs):
+            found.append(jobs[i])
+            if jobs[i] not in loaded or (jobs[i] in stops and stops[jobs[i]]["location"]):
+                break
+            i += step
+    return found
+
+
+async def estimate_delta(before: List[str], after: List[str]) -> dict:
+    """Service and travel change between two job lists.
+
+    Only stops whose neighbourhood changed are loaded: the removed and added
+    jobs and the stops around them out to the nearest located stop.
+    """
+    before_set, after_set = set(before), set(after)
+    changed = (before_set - after_set) | (after_set - before_set)
+    if not changed:
+        return {"service_minutes": 0.0, "travel_minutes": 0.0}
+    involved, loaded, stops = set(changed), set(), {}
+    while True:
+        missing = list(involved - loaded)
+        if missing:
+            stops.update(await load_stops(missing))
+            loaded.update(missing)
+        wanted = set()
+        for jobs in (before, after):
+            for k, job_id in enumerate(jobs):
+                if job_id in changed:
+                    wanted.update(_neighbourhood(jobs, k, stops, loaded))
+        if wanted <= involved:
+            break
+        involved |= wanted
+
+    def travel_around(jobs: List[str]) -> float:
+        # Sum travel over maximal runs of involved stops; other legs are unchanged
+        total, run = 0.0, []
+        for job_id in jobs + [None]:
+            if job_id in involved:
+                run.append(job_id)
+            else:
+                total += travel_minutes_between(stops, run)
+                run = []
+        return total
+
+    service = sum(stops[j]["service_minutes"] for j in after_set - before_set if j in stops)
+    service -= sum(stops[j]["service_minutes"] for j in before_set - after_set if j in stops)
+    return {"service_minutes": service, "travel_minutes": travel_around(after) - travel_around(before)}
+
+
+async def update_membership(route_id: str, add: List[str], remove: List[str], updated_at: str):
+    """Atomically add and remove jobs and adjust the estimate in one update.
+
+    Returns the updated route document, or None when the route does not exist.
+    """
+    while True:
+        route = await db.routes.find_one({"id": route_id}, {"_id": 0, "jobs": 1})
+        if route is None:
+            return None
+        before_jobs = route.get("jobs") or []
+        after_jobs = apply_membership(before_jobs, add, remove)
+        pipeline = membership_pipeline(add, remove, updated_at)
+        if after_jobs != before_jobs:
+            delta = await estimate_delta(before_jobs, after_jobs)
+            pipeline += estimate_pipeline(delta["service_minutes"], delta["travel_minutes"])
+        # Only matches while the jobs are still the ones the estimate was computed from
+        updated = await db.routes.find_one_and_update(
+            {"id": route_id, "jobs": route.get("jobs")},
+            pipeline,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated is not None:
+            await invalidate_plans("routes", [updated])
+            return updated
@@ -0,0 +1,112 @@
+"""Stop-order optimization for a single route.
+
+Routes are open paths (the technician does not return to a depot), which is
+handled by adding a dummy node at zero distance from every stop and solving
+the resulting tour. The tour is built with nearest neighbour and improved
+with 2-opt and Or-opt moves until no move helps or the time budget runs out.
+"""
+import time
+from typing import List, Optional
+
+
+def path_length(dist: List[List[float]], order: List[int]) -> float:
+    """Length of an open path visiting stops in order"""
+    return sum(dist[order[k]][order[k + 1]] for k in range(len(order) - 1))
+
+
+def _nearest_neighbour(dist: List[List[float]], first: int) -> List[int]:
+    n = len(dist)
+    order = [first]
+    remaining = set(range(n)) - {first}
+    while remaining:
+        last = dist[order[-1]]
+        nxt = min(remaining, key=lambda j: last[j])
+        order.append(nxt)
+        remaining.remove(nxt)
+    return order
+
+
+def _two_opt(dist: List[List[float]], tour: List[int], deadline: float) -> bool:
+    """One pass of 2-opt over a closed tour, applying every improving move"""
+    m = len(tour)
+    improved = False
+    for i in range(m - 1):
+        a, b = tour[i], tour[i + 1]
+        # When i == 0 the last edge shares tour[0] with edge (a, b)
+        for j in range(i + 2, m if i > 0 else m - 1):
+            c, d = tour[j], tour[(j + 1) % m]
+            delta = dist[a][c] + dist[b][d] - dist[a][b] - dist[c][d]
+            if delta < -1e-9:
+                tour[i + 1:j + 1] = reversed(tour[i + 1:j + 1])
+                b = tour[i + 1]
+                improved = True
+        if time.monotonic() > deadline:
+            break
+    return improved
+
+
+def _or_opt(dist: List[List[float]], tour: List[int], deadline: float) -> bool:
+    """Move segments of one to three stops to their best position, tour[0] stays fixed"""
+    m = len(tour)
+    improved = False
+    for seg_len in (1, 2, 3):
+        i = 1
+        while i + seg_len <= m:
+            if time.monotonic() > deadline:
+                return improved
+            segment = tour[i:i + seg_len]
+            prev, nxt = tour[i - 1], tour[(i + seg_len) % m]
+            first, last = segment[0], segment[-1]
+            gain = dist[prev][first] + dist[last][nxt] - dist[prev][nxt]
+
+            rest = tour[:i] + tour[i + seg_len:]
+            best_delta, best_k, best_reversed = -1e-9, None, False
+            for k in range(len(rest)):
+                p, q = rest[k], rest[(k + 1) % len(rest)]
+                if p == prev:
+                    continue
+                forward = dist[p][first] + dist[last][q] - dist[p][q] - gain
+                backward = dist[p][last] + dist[first][q] - dist[p][q] - gain
+                if forward < best_delta:
+                    best_delta, best_k, best_reversed = forward, k, False
+                if backward < best_delta:
+                    best_delta, best_k, best_reversed = backward, k, True
+
+            if best_k is None:
+                i += 1
+                continue
+            if best_reversed:
+                segment.reverse()
+            tour[:] = rest[:best_k + 1] + segment + rest[best_k + 1:]
+            improved = True
+    return improved
+
+
+def optimize_order(dist: List[List[float]], time_budget: float = 0.5, initial: Optional[List[int]] = None) -> List[int]:
+    """Near-optimal open-path visiting order for the stops of a distance matrix.
+
+    Returns indices into dist. The result is never longer than initial (or the
+    identity order when no initial order is given).
+    """
+    n = len(dist)
+    initial = list(initial) if initial is not None else list(range(n))
+    if n <= 2:
+        return initial
+    deadline = time.monotonic() + time_budget
+
+    # Dummy node n sits at zero distance from every stop to turn the path into a tour
+    extended = [row + [0.0] for row in dist] + [[0.0] * (n + 1)]
+    tour = [n] + _nearest_neighbour(dist, initial[0])
+
+    while time.monotonic() < deadline:
+        improved = _two_opt(extended, tour, deadline)
+        improved = _or_opt(extended, tour, deadline) or improved
+        if not improved:
+            break
+
+    # Rotate so the dummy node is first, then drop it
+    start = tour.index(n)
+    order = tour[start + 1:] + tour[:start]
+    if path_length(dist, order) > path_length(dist, initial):
+        return initial
+    return order
@@ -0,0 +1,214 @@
+"""Technician schedule conflict detection.
+
+A job occupies its technician from ``scheduled_time`` for the estimated
+service time. The jobs of one technician on one day are fetched through the
+(technician, scheduled_date, scheduled_time) index; checking one booking
+against them is a linear pass.
+
+Listing every conflict sweeps each day in start order through a
+``DaySchedule``: bookings sorted by start with a running maximum of end
+times. Bookings arrive in start order, so each insert lands at the end of
+the list, and a query is a binary search plus a walk back while the running
+maximum still reaches the new start.
+
+Checking and writing a booking are two steps, so ``booking`` holds a lease on
+the technician's day around them; concurrent bookings of the same day take
+turns instead of both passing the check.
+"""
+from bisect import bisect_left, insort
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import time
+
+from services.locks import LockHeld, acquire, release
+from services.service_time import service_minutes
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+# Only jobs still to be worked can conflict
+ACTIVE_STATUSES = ["scheduled", "in-progress"]
+UNASSIGNED_TECHNICIAN = "Unassigned"
+# How long a booking waits for another booking of the same day to finish
+BOOKING_WAIT_SECONDS = 5.0
+BOOKING_LEASE_SECONDS = 30
+
+JOB_FIELDS = {
+    "_id": 0, "id": 1, "customer_id": 1, "customer_name": 1, "technician": 1, "status": 1,
+    "scheduled_date": 1, "scheduled_time": 1, "service_type": 1, "pools": 1
+}
+
+
+async def ensure_indexes():
+    await db.jobs.create_index([("technician", 1), ("scheduled_date", 1), ("scheduled_time", 1)])
+
+
+def parse_time(value: Optional[str]) -> Optional[int]:
+    """Minutes after midnight for "09:00 AM" or "14:30", None when unparseable"""
+    for fmt in ("%I:%M %p", "%H:%M"):
+        try:
+            parsed = datetime.strptime((value or "").strip().upper(), fmt)
+        except ValueError:
+            continue
+        return parsed.hour * 60 + parsed.minute
+    return None
+
+
+class DaySchedule:
+    """Bookings of one technician on one day, sorted by start minute"""
+
+    def __init__(self):
+        self._bookings: List[Tuple[int, int, str]] = []  # (start, end, job_id)
+        self._max_end: List[int] = []  # Latest end among bookings[:k + 1]
+
+    def __len__(self) -> int:
+        return len(self._bookings)
+
+    def add(self, start: int, end: int, job_id: str):
+        """Insert a booking; O(n) in general, O(log n) when added in start order"""
+        booking = (start, end, job_id)
+        insort(self._bookings, booking)
+        k = bisect_left(self._bookings, booking)
+        previous = self._max_end[k - 1] if k > 0 else end
+        self._max_end.insert(k, max(previous, end))
+        for j in range(k + 1, len(self._max_end)):
+            if self._max_end[j] >= self._max_end[j - 1]:
+                break
+            self._max_end[j] = self._max_end[j - 1]
+
+    def overlapping(self, start: int, end: int) -> List[Tuple[int, int, str]]:
+        """Bookings overlapping [start, end)"""
+        # Only bookings starting before end can overlap; walk back while any could still reach start
+        k = bisect_left(self._bookings, (end,)) - 1
+        found = []
+        while k >= 0 and self._max_end[k] > start:
+            booking = self._bookings[k]
+            if booking[1] > start:
+                found.append(booking)
+            k -= 1
+        found.reverse()
+        return found
+
+
+async def _customers(customer_ids: List[str]) -> Dict[str, dict]:
+    customers = await db.customers.find(
+        {"id": {"$in": list(set(customer_ids))}},
+        {"_id": 0, "id": 1, "pools.id": 1, "pools.type": 1, "pools.gallons": 1, "pools.equipment": 1}
+    ).to_list(None)
+    return {c["id"]: c for c in customers}
+
+
+def _interval(job: dict, customers: Dict[str, dict]) -> Optional[Tuple[int, int]]:
+    start = parse_time(job.get("scheduled_time"))
+    if start is None:
+        return None
+    return start, start + int(round(service_minutes(job, customers.get(job.get("customer_id")))))
+
+
+def _bookable(job: dict) -> bool:
+    return job.get("status", "scheduled") in ACTIVE_STATUSES and job.get("technician") not in (None, "", UNASSIGNED_TECHNICIAN)
+
+
+@asynccontextmanager
+async def booking(job: dict):
+    """Hold the technician's day while a booking is checked and written.
+
+    Raises LockHeld when another booking of that day does not finish within
+    BOOKING_WAIT_SECONDS.
+    """
+    if not _bookable(job):
+        yield
+        return
+    name = f"booking-{job['technician']}-{job['scheduled_date']}"
+    deadline = time.monotonic() + BOOKING_WAIT_SECONDS
+    owner = await acquire(name, BOOKING_LEASE_SECONDS)
+    while owner is None:
+        if time.monotonic() > deadline:
+            raise LockHeld(name)
+        await asyncio.sleep(0.05)
+        owner = await acquire(name, BOOKING_LEASE_SECONDS)
+    try:
+        yield
+    finally:
+        await release(name, owner)
+
+
+async def find_conflicts(job: dict, exclude_id: Optional[str] = None) -> List[dict]:
+    """Active jobs of the same technician overlapping job on its date"""
+    if not _bookable(job):
+        return []
+    day_jobs = await db.jobs.find(
+        {
+            "technician": job["technician"],
+            "scheduled_date": job["scheduled_date"],
+            "status": {"$in": ACTIVE_STATUSES},
+            "id": {"$ne": exclude_id}
+        },
+        JOB_FIELDS
+    ).to_list(None)
+    customers = await _customers([job["customer_id"]] + [j["customer_id"] for j in day_jobs])
+    interval = _interval(job, customers)
+    if interval is None:
+        return []
+
+    conflicts = []
+    for other in day_jobs:
+        other_interval = _interval(other, customers)
+        if other_interval and other_interval[0] < interval[1] and other_interval[1] > interval[0]:
+            conflicts.append({**other, "start_minute": other_interval[0], "end_minute": other_interval[1]})
+    return sorted(conflicts, key=lambda c: (c["start_minute"], c["end_minute"], c["id"]))
+
+
+async def booked_until(technicians: List[str], dates: List[str]) -> Dict[Tuple[str, str], int]:
+    """Minute the last active job of each (technician, date) ends"""
+    jobs = await db.jobs.find(
+        {"technician": {"$in": technicians}, "scheduled_date": {"$in": dates}, "status": {"$in": ACTIVE_STATUSES}},
+        JOB_FIELDS
+    ).to_list(None)
+    customers = await _customers([job["customer_id"] for job in jobs])
+    ends: Dict[Tuple[str, str], int] = {}
+    for job in jobs:
+        interval = _interval(job, customers)
+        if interval:
+            day = (job["technician"], job["scheduled_date"])
+            ends[day] = max(ends.get(day, 0), interval[1])
+    return ends
+
+
+async def list_conflicts(scheduled_date: Optional[str] = None, technician: Optional[str] = None) -> List[dict]:
+    """Every overlapping pair of active jobs, grouped per technician and day"""
+    query = {"status": {"$in": ACTIVE_STATUSES}, "technician": {"$ne": UNASSIGNED_TECHNICIAN}}
+    if technician:
+        query["technician"] = technician
+    if scheduled_date:
+        query["scheduled_date"] = scheduled_date
+    jobs = await db.jobs.find(query, JOB_FIELDS).to_list(None)
+    customers = await _customers([job["customer_id"] for job in jobs])
+
+    days: Dict[Tuple[str, str], DaySchedule] = {}
+    by_id = {job["id"]: job for job in jobs}
+    conflicts = []
+    for job in sorted(jobs, key=lambda j: (j["technician"], j["scheduled_date"], parse_time(j.get("scheduled_time")) or 0)):
+        interval = _interval(job, customers)
+        if interval is None:
+            continue
+        schedule = days.setdefault((job["technician"], job["scheduled_date"]), DaySchedule())
+        for start, end, other_id in schedule.overlapping(*interval):
+            conflicts.append({
+                "technician": job["technician"],
+                "scheduled_date": job["scheduled_date"],
+                "job_ids": [other_id, job["id"]],
+                "customer_names": [by_id[other_id].get("customer_name"), job.get("customer_name")],
+                "scheduled_times": [by_id[other_id].get("scheduled_time"), job.get("scheduled_time")],
+                "overlap_minutes": min(end, interval[1]) - max(start, interval[0])
+            })
+        schedule.add(*interval, job["id"])
+    return conflicts
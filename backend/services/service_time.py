@@ -0,0 +1,141 @@
+"""Service-time model and route duration estimates.
+
+Time on site is estimated from the job's service type plus, for every pool
+serviced, a base by pool type, a volume term and a per-equipment term.
+Route durations are service time plus road travel time between consecutive
+stops.
+"""
+from typing import Dict, List, Optional
+
+from services.travel_matrix import customer_locations, matrix_for_points, minutes
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+# Fixed minutes per visit by job service type
+SERVICE_TYPE_MINUTES = {
+    "Routine Service": 10,
+    "Repair": 45,
+    "One-time Service": 30,
+}
+DEFAULT_SERVICE_TYPE_MINUTES = 20
+
+# Minutes per pool by pool type
+POOL_TYPE_MINUTES = {
+    "In-Ground": 20,
+    "Above-Ground": 15,
+    "Spa/Hot Tub": 10,
+}
+DEFAULT_POOL_TYPE_MINUTES = 15
+
+MINUTES_PER_10K_GALLONS = 2.0
+MINUTES_PER_EQUIPMENT = 3.0
+
+
+def service_minutes(job: dict, customer: Optional[dict]) -> float:
+    """Estimated minutes on site for a job"""
+    total = SERVICE_TYPE_MINUTES.get(job.get("service_type"), DEFAULT_SERVICE_TYPE_MINUTES)
+    pools = (customer or {}).get("pools", [])
+    if job.get("pools"):
+        wanted = set(job["pools"])
+        pools = [pool for pool in pools if pool.get("id") in wanted]
+    for pool in pools:
+        total += POOL_TYPE_MINUTES.get(pool.get("type"), DEFAULT_POOL_TYPE_MINUTES)
+        total += (pool.get("gallons") or 0) / 10000 * MINUTES_PER_10K_GALLONS
+        total += len(pool.get("equipment") or []) * MINUTES_PER_EQUIPMENT
+    return total
+
+
+async def load_stops(job_ids: List[str]) -> Dict[str, dict]:
+    """Service minutes and [lon, lat] (or None) per job id, in two queries"""
+    jobs = await db.jobs.find(
+        {"id": {"$in": list(set(job_ids))}},
+        {"_id": 0, "id": 1, "customer_id": 1, "service_type": 1, "pools": 1}
+    ).to_list(None)
+    customer_ids = list({job["customer_id"] for job in jobs})
+    customers = await db.customers.find(
+        {"id": {"$in": customer_ids}},
+        {"_id": 0, "id": 1, "location": 1, "pools.id": 1, "pools.type": 1, "pools.gallons": 1, "pools.equipment": 1}
+    ).to_list(None)
+    by_id = {c["id"]: c for c in customers}
+    stops = {}
+    for job in jobs:
+        customer = by_id.get(job["customer_id"])
+        location = (customer or {}).get("location")
+        stops[job["id"]] = {
+            "service_minutes": service_minutes(job, customer),
+            "location": location["coordinates"] if location else None
+        }
+    return stops
+
+
+def travel_minutes_between(stops: Dict[str, dict], job_ids: List[str]) -> float:
+    """Road travel minutes visiting located jobs in order"""
+    points = [stops[j]["location"] for j in job_ids if j in stops and stops[j]["location"]]
+    if len(points) < 2:
+        return 0.0
+    travel = minutes(matrix_for_points(points, "road"))
+    return float(sum(travel[k, k + 1] for k in range(len(points) - 1)))
+
+
+def estimate_fields(service: float, travel: float) -> dict:
+    """Route fields stored for an estimate"""
+    return {
+        "service_minutes": round(service, 1),
+        "travel_minutes": round(travel, 1),
+        "estimated_duration": int(round(service + travel))
+    }
+
+
+async def estimate_route(job_ids: List[str]) -> dict:
+    """Full estimate for a route's ordered jobs"""
+    stops = await load_stops(job_ids)
+    service = sum(stops[j]["service_minutes"] for j in job_ids if j in stops)
+    return estimate_fields(service, travel_minutes_between(stops, job_ids))
+
+
+async def customer_locations_for_jobs(job_ids: List[str]) -> Dict[str, Optional[List[float]]]:
+    """[lon, lat] (or None) of each job's customer"""
+    jobs = await db.jobs.find({"id": {"$in": list(set(job_ids))}}, {"_id": 0, "id": 1, "customer_id": 1}).to_list(None)
+    locations = await customer_locations([job["customer_id"] for job in jobs])
+    return {job["id"]: locations.get(job["customer_id"]) for job in jobs}
+
+
+async def estimate_travel(job_ids: List[str]) -> float:
+    """Travel minutes for a new order of the same jobs (service time is unchanged)"""
+    locations = await customer_locations_for_jobs(job_ids)
+    stops = {j: {"location": loc} for j, loc in locations.items()}
+    return travel_minutes_between(stops, job_ids)
+
+
+async def backfill_estimates() -> int:
+    """Estimate routes stored before service and travel minutes were tracked.
+
+    Incremental updates add to the stored totals, so a route without them
+    would otherwise count only the stops changed since. Each write is
+    conditional on the job list it was estimated from. A route edited in the
+    meantime no longer matches the query, as the edit's $inc creates the
+    fields, so it is estimated again from its current jobs right away.
+    """
+    filled = 0
+    async for route in db.routes.find(
+        {"$or": [{"service_minutes": {"$exists": False}}, {"travel_minutes": {"$exists": False}}]},
+        {"_id": 0, "id": 1, "jobs": 1}
+    ):
+        while route:
+            result = await db.routes.update_one(
+                {"id": route["id"], "jobs": route.get("jobs")},
+                {"$set": await estimate_route(route.get("jobs") or [])}
+            )
+            if result.matched_count:
+                filled += result.modified_count
+                break
+            # Edited or deleted since it was read
+            route = await db.routes.find_one({"id": route["id"]}, {"_id": 0, "id": 1, "jobs": 1})
+    return filled
@@ -0,0 +1,232 @@
+"""Monthly customer statements.
+
+A statement covers one calendar month for one customer: the balance owed at
+the start of the month, invoices issued and payments received during it, and
+the closing balance. Draft and cancelled invoices are left out, and so are
+payments on them or on deleted invoices. Invoices paid before the payments
+ledger existed have no entries; their paid_amount counts as paid on their
+paid_date, as in ``account_balances``.
+
+All customers' statements come out of one pass over two cursors, invoices
+sorted by (customer_id, issue_date) and payments sorted by customer_id, both
+served by existing indexes. Each cursor is grouped by customer and the two
+groupings are merged on customer_id, so only one customer's documents are in
+memory at a time. Statements can be streamed as NDJSON or CSV, or stored in
+``statements`` for the portal.
+"""
+from datetime import date, datetime, timezone
+from typing import AsyncIterator, List, Optional, Tuple
+import csv
+import io
+import json
+
+from pymongo import UpdateOne
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+STORE_BATCH_SIZE = 500
+
+# Invoices that are not owed
+UNBILLED_STATUSES = ["draft", "cancelled"]
+
+CSV_FIELDS = [
+    "customer_id", "customer_name", "month", "opening_balance", "total_invoiced",
+    "total_paid", "closing_balance", "invoice_count", "payment_count"
+]
+
+
+async def ensure_indexes():
+    await db.statements.create_index([("customer_id", 1), ("month", -1)], unique=True)
+
+
+def month_bounds(month: str) -> Tuple[date, date]:
+    """First day of the month and of the month after, from YYYY-MM"""
+    start = datetime.strptime(month, "%Y-%m").date()
+    end = date(start.year + 1, 1, 1) if start.month == 12 else date(start.year, start.month + 1, 1)
+    return start, end
+
+
+async def _grouped(cursor) -> AsyncIterator[Tuple[str, List[dict]]]:
+    """(customer_id, documents) from a cursor sorted by customer_id"""
+    customer_id, group = None, []
+    async for doc in cursor:
+        if doc["customer_id"] != customer_id and group:
+            yield customer_id, group
+            group = []
+        customer_id = doc["customer_id"]
+        group.append(doc)
+    if group:
+        yield customer_id, group
+
+
+async def _next(groups) -> Optional[Tuple[str, List[dict]]]:
+    try:
+        return await groups.__anext__()
+    except StopAsyncIteration:
+        return None
+
+
+async def _merged(invoices, payments) -> AsyncIterator[Tuple[str, List[dict], List[dict]]]:
+    """Merge two customer groupings into (customer_id, invoices, payments)"""
+    invoice_group = await _next(invoices)
+    payment_group = await _next(payments)
+    while invoice_group or payment_group:
+        if payment_group is None or (invoice_group and invoice_group[0] < payment_group[0]):
+            yield invoice_group[0], invoice_group[1], []
+            invoice_group = await _next(invoices)
+        elif invoice_group is None or payment_group[0] < invoice_group[0]:
+            yield payment_group[0], [], payment_group[1]
+            payment_group = await _next(payments)
+        else:
+            yield invoice_group[0], invoice_group[1], payment_group[1]
+            invoice_group = await _next(invoices)
+            payment_group = await _next(payments)
+
+
+def _as_datetime(value) -> datetime:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+def build_statement(
+    customer_id: str, month: str, start: date, end: date, invoices: List[dict], payments: List[dict]
+) -> dict:
+    """One customer's statement for the month from start to end.
+
+    invoices are those issued before end; payments are all of the customer's
+    ledger entries, later ones only telling which invoices have a ledger.
+    """
+    start_at = datetime(start.year, start.month, start.day, tzinfo=timezone.utc)
+    end_at = datetime(end.year, end.month, end.day, tzinfo=timezone.utc)
+    first_day = start.isoformat()
+
+    included = {i["id"] for i in invoices}
+    in_ledger = {p["invoice_id"] for p in payments}
+    payments = [p for p in payments if p["invoice_id"] in included]
+    for invoice in invoices:
+        if invoice["id"] not in in_ledger and invoice.get("paid_amount"):
+            payments.append({
+                "id": f"{invoice['id']}-paid",
+                "invoice_id": invoice["id"],
+                "amount": invoice["paid_amount"],
+                "method": "opening_balance",
+                "created_at": invoice.get("paid_date") or invoice["issue_date"]
+            })
+
+    def paid_at(payment: dict) -> datetime:
+        return _as_datetime(payment["created_at"])
+
+    payments = [p for p in payments if paid_at(p) < end_at]
+    billed_before = sum(i.get("total") or 0.0 for i in invoices if i["issue_date"] < first_day)
+    paid_before = sum(p["amount"] for p in payments if paid_at(p) < start_at)
+    opening = round(billed_before - paid_before, 2)
+
+    issued = [
+        {key: i.get(key) for key in ("id", "invoice_number", "issue_date", "due_date", "total")}
+        for i in invoices if i["issue_date"] >= first_day
+    ]
+    received = sorted(
+        (
+            {
+                "id": p["id"],
+                "invoice_id": p["invoice_id"],
+                "amount": p["amount"],
+                "method": p.get("method"),
+                "date": paid_at(p).date().isoformat()
+            }
+            for p in payments if paid_at(p) >= start_at
+        ),
+        key=lambda p: p["date"]
+    )
+    total_invoiced = round(sum(i["total"] or 0.0 for i in issued), 2)
+    total_paid = round(sum(p["amount"] for p in received), 2)
+    names = [i.get("customer_name") for i in invoices if i.get("customer_name")]
+    return {
+        "id": f"stmt-{customer_id}-{month}",
+        "customer_id": customer_id,
+        "customer_name": names[-1] if names else None,
+        "month": month,
+        "opening_balance": opening,
+        "invoices": issued,
+        "payments": received,
+        "total_invoiced": total_invoiced,
+        "total_paid": total_paid,
+        "closing_balance": round(opening + total_invoiced - total_paid, 2)
+    }
+
+
+async def generate_statements(month: str) -> AsyncIterator[dict]:
+    """Statements of every customer with a balance or activity in the month"""
+    start, end = month_bounds(month)
+    invoices = db.invoices.find(
+        {"issue_date": {"$lt": end.isoformat()}, "status": {"$nin": UNBILLED_STATUSES}},
+        {
+            "_id": 0, "id": 1, "customer_id": 1, "customer_name": 1, "invoice_number": 1,
+            "issue_date": 1, "due_date": 1, "total": 1, "paid_amount": 1, "paid_date": 1
+        }
+    ).sort([("customer_id", 1), ("issue_date", 1), ("id", 1)])
+    # Not bounded by the month: later entries still show which invoices have a ledger
+    payments = db.payments.find(
+        {},
+        {"_id": 0, "id": 1, "customer_id": 1, "invoice_id": 1, "amount": 1, "method": 1, "created_at": 1}
+    ).sort([("customer_id", 1), ("created_at", -1)])
+
+    async for customer_id, customer_invoices, customer_payments in _merged(_grouped(invoices), _grouped(payments)):
+        statement = build_statement(customer_id, month, start, end, customer_invoices, customer_payments)
+        if statement["opening_balance"] or statement["invoices"] or statement["payments"]:
+            yield statement
+
+
+async def statements_ndjson(month: str) -> AsyncIterator[bytes]:
+    async for statement in generate_statements(month):
+        yield (json.dumps(statement) + "\n").encode()
+
+
+async def statements_csv(month: str) -> AsyncIterator[bytes]:
+    """One summary row per customer"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    async for statement in generate_statements(month):
+        writer.writerow({
+            **statement,
+            "invoice_count": len(statement["invoices"]),
+            "payment_count": len(statement["payments"])
+        })
+        if buffer.tell() >= 64 * 1024:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+async def store_statements(month: str) -> dict:
+    """Write the month's statements to the statements collection for the portal"""
+    now = datetime.now(timezone.utc).isoformat()
+    operations = []
+    stored = 0
+    async for statement in generate_statements(month):
+        statement["generated_at"] = now
+        operations.append(UpdateOne(
+            {"customer_id": statement["customer_id"], "month": month}, {"$set": statement}, upsert=True
+        ))
+        if len(operations) >= STORE_BATCH_SIZE:
+            await db.statements.bulk_write(operations, ordered=False)
+            stored += len(operations)
+            operations = []
+    if operations:
+        await db.statements.bulk_write(operations, ordered=False)
+        stored += len(operations)
+    return {"month": month, "statements": stored, "generated_at": now}
+
+
+async def get_statement(customer_id: str, month: str) -> Optional[dict]:
+    return await db.statements.find_one({"customer_id": customer_id, "month": month}, {"_id": 0})
@@ -0,0 +1,141 @@
+"""Pairwise distance and travel-time matrices between customer locations.
+
+Matrices are computed with vectorized NumPy haversine, optionally scaled by a
+road factor, and cached in a size-bounded LRU keyed by the set of locations.
+The same set of stops requested in a different order is served from the cache
+by reindexing the cached matrix.
+"""
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+import os
+
+import numpy as np
+
+# MongoDB will be accessed from server.py
+db = None
+
+def init_db(database):
+    """Initialize database connection"""
+    global db
+    db = database
+
+
+EARTH_RADIUS_KM = 6371.0088
+ROAD_FACTOR = float(os.environ.get("ROAD_FACTOR", "1.3"))
+AVERAGE_SPEED_KMH = float(os.environ.get("AVERAGE_SPEED_KMH", "40"))
+MATRIX_CACHE_MAX_CELLS = int(os.environ.get("MATRIX_CACHE_MAX_CELLS", "4000000"))
+
+MODES = ("haversine", "road")
+
+LocationKey = Tuple[Tuple[float, float], ...]
+
+
+def haversine_matrix(coordinates: np.ndarray) -> np.ndarray:
+    """Great-circle distances in km between every pair of [lon, lat] rows"""
+    radians = np.radians(coordinates)
+    lon = radians[:, 0]
+    lat = radians[:, 1]
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    h = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(h, 0.0, 1.0)))
+
+
+def compute_matrix(coordinates: np.ndarray, mode: str = "road") -> np.ndarray:
+    """Distance matrix in km for the given mode"""
+    distances = haversine_matrix(coordinates)
+    if mode == "road":
+        distances = distances * ROAD_FACTOR
+    return distances
+
+
+def minutes(distances: np.ndarray) -> np.ndarray:
+    """Travel time in minutes for a distance matrix at the average speed"""
+    return distances / AVERAGE_SPEED_KMH * 60.0
+
+
+class MatrixCache:
+    """LRU of distance matrices bounded by the total number of cells"""
+
+    def __init__(self, max_cells: int):
+        self.max_cells = max_cells
+        self.cells = 0
+        self.hits = 0
+        self.misses = 0
+        self._items: "OrderedDict[Tuple[str, LocationKey], np.ndarray]" = OrderedDict()
+
+    def get(self, key) -> Optional[np.ndarray]:
+        matrix = self._items.get(key)
+        if matrix is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._items.move_to_end(key)
+        return matrix
+
+    def put(self, key, matrix: np.ndarray):
+        if matrix.size > self.max_cells:
+            return
+        if key in self._items:
+            self.cells -= self._items.pop(key).size
+        self._items[key] = matrix
+        self.cells += matrix.size
+        while self.cells > self.max_cells:
+            _, evicted = self._items.popitem(last=False)
+            self.cells -= evicted.size
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._items),
+            "cells": self.cells,
+            "max_cells": self.max_cells,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+cache = MatrixCache(MATRIX_CACHE_MAX_CELLS)
+
+
+def matrix_for_points(points: List[List[float]], mode: str = "road") -> np.ndarray:
+    """Distance matrix for [lon, lat] points in the given order, using the cache"""
+    if not points:
+        return np.zeros((0, 0))
+    rounded = [(round(lon, 6), round(lat, 6)) for lon, lat in points]
+    # Canonical order of the location set; the caller's order is a reindex of it
+    canonical = sorted(set(rounded))
+    key = (mode, tuple(canonical))
+    matrix = cache.get(key)
+    if matrix is None:
+        matrix = compute_matrix(np.array(canonical, dtype=float), mode)
+        cache.put(key, matrix)
+    position = {point: i for i, point in enumerate(canonical)}
+    index = np.array([position[point] for point in rounded])
+    return matrix[np.ix_(index, index)]
+
+
+async def customer_locations(customer_ids: List[str]) -> Dict[str, List[float]]:
+    """[lon, lat] of every listed customer that has a location"""
+    customers = await db.customers.find(
+        {"id": {"$in": list(set(customer_ids))}, "location": {"$ne": None}},
+        {"_id": 0, "id": 1, "location": 1}
+    ).to_list(None)
+    return {c["id"]: c["location"]["coordinates"] for c in customers}
+
+
+async def get_matrix(customer_ids: List[str], mode: str = "road") -> dict:
+    """Distance (km) and travel time (minutes) matrices for a list of customers.
+
+    Rows follow the requested order; customers without a location are left out
+    and listed under ``missing``.
+    """
+    locations = await customer_locations(customer_ids)
+    located = [cid for cid in dict.fromkeys(customer_ids) if cid in locations]
+    distances = matrix_for_points([locations[cid] for cid in located], mode)
+    return {
+        "customer_ids": located,
+        "missing": [cid for cid in dict.fromkeys(customer_ids) if cid not in locations],
+        "mode": mode,
+        "distances_km": distances,
+        "durations_min": minutes(distances)
+    }
@@ -0,0 +1,27 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# Backend modules import each other as top-level packages (services, routers, models)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+
+def _unround(value):
+    if isinstance(value, dict):
+        if set(value) == {"$round"}:
+            return _unround(value["$round"][0])
+        return {k: _unround(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_unround(v) for v in value]
+    return value
+
+
+@pytest.fixture
+def unrounded(monkeypatch):
+    """Patch pipeline builders to drop $round, which mongomock does not implement"""
+    def patch(module, *names):
+        for name in names:
+            original = getattr(module, name)
+            monkeypatch.setattr(module, name, lambda *args, _f=original, **kwargs: _unround(_f(*args, **kwargs)))
+    return patch
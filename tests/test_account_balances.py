@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import account_balances, locks
+from services.account_balances import apply_invoice_changes, balance_contribution
+
+
+@pytest.fixture
+def db():
+    database = AsyncMongoMockClient()["test"]
+    account_balances.init_db(database)
+    locks.init_db(database)
+
+    async def setup():
+        await locks.ensure_indexes()
+        await account_balances.ensure_indexes()
+        await database.customers.insert_many([
+            # Free-form value from before balances were derived
+            {"id": "c1", "account_balance": 75.0},
+            {"id": "c2", "account_balance": -40.0},
+        ])
+        await database.invoices.insert_many([
+            {"id": "i1", "customer_id": "c1", "status": "sent", "total": 100.0, "paid_amount": 30.0, "balance_due": 70.0},
+            {"id": "i2", "customer_id": "c1", "status": "draft", "total": 50.0, "paid_amount": 0.0, "balance_due": 50.0},
+            {"id": "i3", "customer_id": "c2", "status": "overdue", "total": 40.0, "paid_amount": 0.0, "balance_due": 40.0},
+        ])
+
+    asyncio.run(setup())
+    return database
+
+
+async def balances(db):
+    return {c["id"]: c["account_balance"] async for c in db.customers.find({}, {"_id": 0})}
+
+
+def test_balance_contribution():
+    assert balance_contribution({"status": "sent", "balance_due": 70.0}) == -70.0
+    assert balance_contribution({"status": "paid", "balance_due": -5.0}) == 5.0
+    assert balance_contribution({"status": "cancelled", "balance_due": 70.0}) == 0.0
+    assert balance_contribution(None) == 0.0
+
+
+def test_reconcile_once_replaces_free_form_balances_once(db):
+    async def scenario():
+        await account_balances.reconcile_once()
+        first = await balances(db)
+        # Later drift is left to the regular reconcile
+        await db.customers.update_one({"id": "c2"}, {"$set": {"account_balance": 0.0}})
+        await account_balances.reconcile_once()
+        return first, await balances(db), await db.migrations.count_documents({})
+
+    first, second, markers = asyncio.run(scenario())
+    assert first == {"c1": -70.0, "c2": -40.0}
+    assert second["c2"] == 0.0
+    assert markers == 1
+
+
+def test_invoice_changes_move_balances(db):
+    async def scenario():
+        await account_balances.reconcile_once()
+        sent = {"id": "i1", "customer_id": "c1", "status": "sent", "balance_due": 70.0}
+        await apply_invoice_changes([
+            (sent, {**sent, "status": "paid", "balance_due": 0.0}),
+            (None, {"id": "i4", "customer_id": "c2", "status": "sent", "balance_due": 10.0}),
+            ({"id": "i3", "customer_id": "c2", "status": "overdue", "balance_due": 40.0}, None),
+        ])
+        return await balances(db)
+
+    assert asyncio.run(scenario()) == {"c1": 0.0, "c2": -10.0}
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+from routers import alerts
+from routers.alerts import build_alert_query
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = AsyncMongoMockClient()["test"]
+    alerts.init_db(database)
+    changes = []
+
+    async def record_changes(kind, batch):
+        changes.extend(batch)
+
+    monkeypatch.setattr(alerts, "record_changes", record_changes)
+    database.changes = changes
+
+    async def setup():
+        await database.alerts.insert_many([
+            {"id": "a1", "customer_id": "c1", "type": "chemical", "severity": "high", "resolved": False},
+            {"id": "a2", "customer_id": "c1", "type": "leak", "severity": "medium", "resolved": False},
+            {"id": "a3", "customer_id": "c2", "type": "chemical", "severity": "high", "resolved": False},
+            {"id": "a4", "customer_id": "c2", "type": "chemical", "severity": "high", "resolved": True},
+        ])
+
+    asyncio.run(setup())
+    return database
+
+
+async def states(db):
+    return {a["id"]: a["resolved"] async for a in db.alerts.find({}, {"_id": 0})}
+
+
+def test_build_alert_query():
+    assert build_alert_query() == {}
+    assert build_alert_query(resolved=False, severity="high", type="chemical", customer_id="c1", ids=["a1"]) == {
+        "resolved": False, "severity": "high", "type": "chemical", "customer_id": "c1", "id": {"$in": ["a1"]}
+    }
+    # An empty id list is no filter at all
+    assert build_alert_query(ids=[]) == {}
+
+
+@pytest.mark.parametrize("endpoint", [alerts.bulk_resolve_alerts, alerts.bulk_delete_alerts])
+def test_bulk_endpoints_require_a_filter(db, endpoint):
+    async def scenario():
+        with pytest.raises(HTTPException) as error:
+            await endpoint(None, None, None, None, None)
+        return error.value, await db.alerts.count_documents({})
+
+    error, count = asyncio.run(scenario())
+    assert error.status_code == 400
+    assert count == 4
+
+
+def test_bulk_resolve_matches_only_unresolved(db):
+    async def scenario():
+        result = await alerts.bulk_resolve_alerts(None, "high", "chemical", None, None)
+        return result, await states(db)
+
+    result, resolved = asyncio.run(scenario())
+    assert result["matched"] == 2
+    assert result["resolved"] == 2
+    assert resolved == {"a1": True, "a2": False, "a3": True, "a4": True}
+    assert sorted((before["resolved"], after["resolved"], after["customer_id"]) for before, after in db.changes) == [
+        (False, True, "c1"), (False, True, "c2")
+    ]
+
+
+def test_bulk_resolve_by_ids_and_of_resolved_alerts(db):
+    async def scenario():
+        by_ids = await alerts.bulk_resolve_alerts(None, None, None, None, ["a2", "a4"])
+        already = await alerts.bulk_resolve_alerts(True, None, None, None, None)
+        return by_ids, already, await states(db)
+
+    by_ids, already, resolved = asyncio.run(scenario())
+    assert by_ids["resolved"] == 1
+    assert already["resolved"] == 0
+    assert resolved == {"a1": False, "a2": True, "a3": False, "a4": True}
+
+
+def test_bulk_delete(db):
+    async def scenario():
+        result = await alerts.bulk_delete_alerts(None, None, None, "c2", None)
+        return result, await states(db)
+
+    result, remaining = asyncio.run(scenario())
+    assert result["deleted"] == 2
+    assert remaining == {"a1": False, "a2": False}
+    assert sorted((before["resolved"], after) for before, after in db.changes) == [(False, None), (True, None)]
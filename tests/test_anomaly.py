@@ -0,0 +1,118 @@
+import asyncio
+
+import numpy as np
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import anomaly
+
+STEADY = [{"fc": 3.0 + 0.2 * (i % 2), "ch": 300 + 4 * (i % 3), "cya": 50 + 2 * (i % 2)} for i in range(10)]
+
+
+def dated(readings, start=1):
+    return [{**r, "date": f"2025-03-{start + i:02d}"} for i, r in enumerate(readings)]
+
+
+def test_leak_scores_a_joint_hardness_and_stabilizer_drop():
+    leak = STEADY + [{"fc": 3.0, "ch": 220, "cya": 25}]
+    scores = anomaly.score_pools([leak, STEADY], [1, 1])
+    assert scores["leak"][0] > anomaly.DEFAULT_THRESHOLD
+    assert scores["leak"][1] < anomaly.DEFAULT_THRESHOLD
+    assert scores["flow"][0] < anomaly.DEFAULT_THRESHOLD
+
+
+def test_hardness_drop_alone_is_not_a_leak():
+    refill = STEADY + [{"fc": 3.0, "ch": 220, "cya": 50}]
+    scores = anomaly.score_pools([refill], [1])
+    assert scores["leak"][0] < anomaly.DEFAULT_THRESHOLD
+
+
+def test_flow_scores_a_sustained_chlorine_drop():
+    flow = STEADY + [{"fc": 0.5, "ch": 300, "cya": 50} for _ in range(4)]
+    scores = anomaly.score_pools([flow], [4])
+    assert scores["flow"][0] > anomaly.DEFAULT_THRESHOLD
+    assert scores["leak"][0] < anomaly.DEFAULT_THRESHOLD
+
+
+def test_changepoint_before_new_readings_does_not_count():
+    flow = STEADY + [{"fc": 0.5, "ch": 300, "cya": 50} for _ in range(4)]
+    scores = anomaly.score_pools([flow], [1])
+    assert scores["flow"][0] < anomaly.DEFAULT_THRESHOLD
+
+
+def test_short_and_padded_series():
+    scores = anomaly.score_pools([STEADY[:3], STEADY[:1]], [3, 1])
+    assert scores["leak"].tolist() == [0.0, 0.0]
+    assert scores["flow"].tolist() == [0.0, 0.0]
+    matrix = anomaly.build_matrix([STEADY[:2]], "fc", window=4)
+    assert np.isnan(matrix[0, :2]).all()
+    assert matrix[0, 2:].tolist() == [3.0, 3.2]
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = AsyncMongoMockClient()["test"]
+    anomaly.init_db(database)
+    changes = []
+
+    async def record_changes(kind, batch):
+        changes.append((kind, batch))
+
+    monkeypatch.setattr(anomaly, "record_changes", record_changes)
+    database.changes = changes
+    return database
+
+
+def customer(customer_id, readings):
+    return {
+        "id": customer_id, "name": customer_id.upper(), "status": "active", "updated_at": "2025-03-01T00:00:00+00:00",
+        "pools": [{"id": f"{customer_id}-pool", "name": "Main", "chem_readings": dated(readings)}]
+    }
+
+
+def test_scan_raises_alerts_once_and_skips_scored_readings(db, monkeypatch):
+    async def scenario():
+        await db.customers.insert_many([
+            customer("c1", STEADY + [{"fc": 3.0, "ch": 220, "cya": 25}]),
+            customer("c2", STEADY)
+        ])
+        first = await anomaly.run_anomaly_scan()
+        alerts = await db.alerts.find({}, {"_id": 0}).to_list(None)
+
+        # Customers touched since the run are reloaded, but their pools have no new readings
+        await db.customers.update_many({}, {"$set": {"updated_at": "2999-01-01T00:00:00+00:00"}})
+        scored = []
+        real = anomaly.score_pools
+        monkeypatch.setattr(anomaly, "score_pools", lambda series, counts: scored.append(counts) or real(series, counts))
+        second = await anomaly.run_anomaly_scan()
+
+        await db.customers.update_one(
+            {"id": "c2"},
+            {"$push": {"pools.0.chem_readings": {"date": "2025-03-20", "fc": 3.0, "ch": 300, "cya": 50}}}
+        )
+        third = await anomaly.run_anomaly_scan()
+        state = {s["pool_id"]: s["scored_readings"] for s in await db.anomaly_state.find({}).to_list(None)}
+        return first, alerts, second, third, scored, state
+
+    first, alerts, second, third, scored, state = asyncio.run(scenario())
+    assert first["pools_scored"] == 2
+    assert [(a["customer_id"], a["type"]) for a in alerts] == [("c1", "leak")]
+    assert second["customers_loaded"] == 2
+    assert second["pools_scored"] == 0
+    assert third["pools_scored"] == 1
+    assert scored == [[1]]
+    assert third["alerts_created"] == 0
+    assert state == {"c1-pool": 11, "c2-pool": 11}
+
+
+def test_full_scan_rescores_without_duplicating_open_alerts(db):
+    async def scenario():
+        await db.customers.insert_one(customer("c1", STEADY + [{"fc": 3.0, "ch": 220, "cya": 25}]))
+        await anomaly.run_anomaly_scan()
+        full = await anomaly.run_anomaly_scan(full=True)
+        return full, await db.alerts.count_documents({})
+
+    full, alert_count = asyncio.run(scenario())
+    assert full["pools_scored"] == 1
+    assert full["alerts_created"] == 0
+    assert alert_count == 1
@@ -0,0 +1,37 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import archiving, locks
+from services.locks import LockHeld
+
+
+@pytest.fixture
+def db():
+    database = AsyncMongoMockClient()["test"]
+    archiving.init_db(database)
+    locks.init_db(database)
+    asyncio.run(locks.ensure_indexes())
+    return database
+
+
+def test_concurrent_run_is_refused_while_lease_is_held(db):
+    resolved_at = (datetime.now(timezone.utc) - timedelta(days=200)).isoformat()
+
+    async def scenario():
+        await db.alerts.insert_many([
+            {"id": f"a{i}", "resolved": True, "resolved_at": resolved_at, "type": "leak", "severity": "high"}
+            for i in range(3)
+        ])
+        async with locks.lease("archive-alerts"):
+            with pytest.raises(LockHeld):
+                await archiving.archive_collection("alerts", older_than_days=90)
+        result = await archiving.archive_collection("alerts", older_than_days=90)
+        rollup = await archiving.get_rollup("alerts")
+        return result, rollup
+
+    result, rollup = asyncio.run(scenario())
+    assert result["archived"] == 3
+    assert rollup["total"] == 3
@@ -0,0 +1,125 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import autopay, locks, payments
+from services.autopay import FakeGateway
+
+
+class Killed(BaseException):
+    """Stands in for the process dying"""
+
+
+@pytest.fixture
+def db(monkeypatch, unrounded):
+    database = AsyncMongoMockClient()["test"]
+    autopay.init_db(database)
+    payments.init_db(database)
+    locks.init_db(database)
+    unrounded(payments, "settle_stages", "payment_pipeline")
+
+    async def record_change(kind, before, after):
+        pass
+
+    monkeypatch.setattr(payments, "record_change", record_change)
+    monkeypatch.setattr(autopay, "gateway", FakeGateway(latency=0))
+
+    async def setup():
+        await locks.ensure_indexes()
+        await autopay.ensure_indexes()
+        await payments.ensure_indexes()
+        await database.customers.insert_one({"id": "c1", "autopay": True, "status": "active"})
+        await database.invoices.insert_one({
+            "id": "inv-1", "customer_id": "c1", "status": "sent",
+            "total": 120.0, "paid_amount": 0.0, "balance_due": 120.0
+        })
+
+    asyncio.run(setup())
+    return database
+
+
+def kill_after_charge(monkeypatch):
+    real = autopay.record_payment
+
+    async def record_payment(*args, **kwargs):
+        monkeypatch.setattr(autopay, "record_payment", real)
+        raise Killed()
+
+    monkeypatch.setattr(autopay, "record_payment", record_payment)
+
+
+async def state(db):
+    return (
+        await db.invoices.find_one({"id": "inv-1"}, {"_id": 0}),
+        await db.payments.find({"invoice_id": "inv-1"}, {"_id": 0}).to_list(None),
+        await db.autopay_charges.find({}, {"_id": 0}).sort("created_at", 1).to_list(None)
+    )
+
+
+@pytest.mark.parametrize("second_run", ["autopay-2026-03-02", "autopay-2026-03-03"])
+def test_run_killed_between_charge_and_apply(db, monkeypatch, second_run):
+    kill_after_charge(monkeypatch)
+
+    async def scenario():
+        with pytest.raises(Killed):
+            await autopay._run("autopay-2026-03-02")
+        _, ledger, rows = await state(db)
+        assert ledger == [] and rows[0]["status"] == "pending"
+        # Resuming the same run or the next day's run must apply the charge already taken
+        await autopay._run(second_run)
+        return await state(db)
+
+    invoice, ledger, rows = asyncio.run(scenario())
+    assert len(autopay.gateway._charges) == 1
+    charge = next(iter(autopay.gateway._charges.values()))
+    assert [(p["amount"], p["reference"]) for p in ledger] == [(120.0, charge["id"])]
+    assert invoice["status"] == "paid"
+    assert rows[0]["status"] == "succeeded"
+    assert all(row["status"] != "pending" for row in rows)
+
+
+def test_paid_invoice_is_not_charged_again(db):
+    async def scenario():
+        await autopay._run("autopay-2026-03-02")
+        await autopay._run("autopay-2026-03-03")
+        return await state(db)
+
+    invoice, ledger, rows = asyncio.run(scenario())
+    assert len(autopay.gateway._charges) == 1
+    assert len(ledger) == 1
+    assert [row["status"] for row in rows] == ["succeeded"]
+
+
+def test_record_payment_applies_a_reference_once(db):
+    async def scenario():
+        first = await payments.record_payment("inv-1", 50.0, reference="ch-1")
+        again = await payments.record_payment("inv-1", 50.0, reference="ch-1")
+        return first, again, await state(db)
+
+    first, again, (invoice, ledger, _) = asyncio.run(scenario())
+    assert again["payment"]["id"] == first["payment"]["id"]
+    assert len(ledger) == 1
+    assert invoice["paid_amount"] == 50.0
+
+
+def test_pending_rows_of_a_run_held_elsewhere_are_left_alone(db, monkeypatch):
+    kill_after_charge(monkeypatch)
+
+    async def scenario():
+        with pytest.raises(Killed):
+            await autopay._run("autopay-2026-03-02")
+        # The first run is still going in another worker
+        async with locks.lease(autopay.run_lease("autopay-2026-03-02")):
+            await autopay._run("autopay-2026-03-03")
+            during = await state(db)
+        await autopay._run("autopay-2026-03-04")
+        return during, await state(db)
+
+    (_, _, rows_during), (invoice, ledger, rows) = asyncio.run(scenario())
+    # The held run's row is untouched; the next run's own row reuses the same gateway key
+    assert {row["run_id"]: row["status"] for row in rows_during}["autopay-2026-03-02"] == "pending"
+    assert len(autopay.gateway._charges) == 1
+    assert len(ledger) == 1
+    assert invoice["status"] == "paid"
+    assert {row["run_id"]: row["status"] for row in rows}["autopay-2026-03-02"] == "succeeded"
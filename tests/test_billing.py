@@ -0,0 +1,127 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import billing, invoice_numbers, locks
+
+RUN = "billing-2025-03-01-2025-03-31"
+
+
+class Killed(BaseException):
+    """Stands in for the process dying"""
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = AsyncMongoMockClient()["test"]
+    for module in (billing, invoice_numbers, locks):
+        module.init_db(database)
+    monkeypatch.setattr(billing, "BILLING_BATCH_CUSTOMERS", 1)
+
+    async def record_changes(kind, changes):
+        pass
+
+    monkeypatch.setattr(billing, "record_changes", record_changes)
+
+    async def setup():
+        await locks.ensure_indexes()
+        await billing.ensure_indexes()
+        await database.invoices.create_index("invoice_number", unique=True)
+        await database.jobs.insert_many([
+            job("j1", "c1", "2025-03-03"), job("j2", "c1", "2025-03-10"),
+            job("j3", "c2", "2025-03-04", service_type="Repair"),
+            # Outside the period
+            job("j4", "c2", "2025-04-01"),
+        ])
+
+    asyncio.run(setup())
+    return database
+
+
+def job(job_id, customer_id, scheduled_date, service_type="Routine Service"):
+    return {
+        "id": job_id, "customer_id": customer_id, "customer_name": customer_id.upper(),
+        "service_type": service_type, "scheduled_date": scheduled_date, "status": "completed", "invoice_id": None
+    }
+
+
+async def run_billing(start="2025-03-01", end="2025-03-31"):
+    await billing.start_run(start, end)
+    await billing._tasks[RUN]
+    return await billing.get_run(RUN)
+
+
+async def invoices(db):
+    return {i["customer_id"]: i async for i in db.invoices.find({}, {"_id": 0}).sort("customer_id", 1)}
+
+
+def test_run_totals(db):
+    run = asyncio.run(run_billing())
+    by_customer = asyncio.run(invoices(db))
+    assert run["status"] == "completed"
+    assert (run["customers_processed"], run["invoices_created"], run["jobs_invoiced"]) == (2, 2, 3)
+    assert by_customer["c1"]["total"] == 270.0
+    assert by_customer["c2"]["total"] == 162.0
+    assert run["total_billed"] == 432.0
+
+
+def test_rerun_bills_nothing_twice(db):
+    async def scenario():
+        await run_billing()
+        numbers = {i["invoice_number"] for i in (await invoices(db)).values()}
+        # Reopen the run as if it had stopped after writing invoices but before marking jobs
+        await db.billing_runs.update_one({"id": RUN}, {"$set": {"status": "running", "last_customer_id": None}})
+        await db.jobs.update_many({}, {"$set": {"invoice_id": None}})
+        run = await run_billing()
+        return numbers, run, await invoices(db), await db.invoice_sequences.find_one({})
+
+    numbers, run, after, sequence = asyncio.run(scenario())
+    assert (run["invoices_created"], run["jobs_invoiced"], run["total_billed"]) == (2, 3, 432.0)
+    assert {i["invoice_number"] for i in after.values()} == numbers
+    assert [len(i["job_ids"]) for i in after.values()] == [2, 1]
+    # No numbers reserved for customers already invoiced
+    assert sequence["value"] == 2
+
+
+def test_resume_after_crash_bills_late_jobs_once(db, monkeypatch):
+    real = billing.record_changes
+
+    async def crash(kind, changes):
+        monkeypatch.setattr(billing, "record_changes", real)
+        raise Killed()
+
+    async def scenario():
+        monkeypatch.setattr(billing, "record_changes", crash)
+        await billing.start_run("2025-03-01", "2025-03-31")
+        with pytest.raises(Killed):
+            await billing._tasks[RUN]
+        billing._tasks.pop(RUN, None)
+        await locks.db.locks.delete_many({})
+        # c1 had another job completed before the run resumed
+        await db.jobs.insert_one(job("j5", "c1", "2025-03-17"))
+        await billing.resume_interrupted_runs()
+        await billing._tasks[RUN]
+        return await billing.get_run(RUN), await invoices(db), await db.jobs.find({}, {"_id": 0}).to_list(None)
+
+    run, by_customer, jobs = asyncio.run(scenario())
+    assert run["status"] == "completed"
+    assert by_customer["c1"]["job_ids"] == ["j1", "j2", "j5"]
+    assert by_customer["c1"]["total"] == 405.0
+    assert {j["id"]: j["invoice_id"] for j in jobs if j["invoice_id"]} == {
+        "j1": by_customer["c1"]["id"], "j2": by_customer["c1"]["id"], "j5": by_customer["c1"]["id"],
+        "j3": by_customer["c2"]["id"]
+    }
+    # The crashed batch's invoice was never counted, its late job was
+    assert (run["invoices_created"], run["jobs_invoiced"]) == (1, 2)
+
+
+def test_run_held_by_another_worker_is_skipped(db):
+    async def scenario():
+        async with locks.lease(f"billing-run-{RUN}"):
+            run = await run_billing()
+        return run, await db.invoices.count_documents({})
+
+    run, count = asyncio.run(scenario())
+    assert run["status"] == "running"
+    assert count == 0
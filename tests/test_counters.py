@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import account_balances, counters, daily_plans
+from services.counters import counter_delta
+
+
+@pytest.fixture
+def db():
+    database = AsyncMongoMockClient()["test"]
+    counters.init_db(database)
+    account_balances.init_db(database)
+    daily_plans.init_db(database)
+    return database
+
+
+def test_counter_delta():
+    assert counter_delta("jobs", None, {"status": "scheduled"}) == {"jobs.total": 1, "jobs.scheduled": 1}
+    assert counter_delta("jobs", {"status": "scheduled"}, {"status": "completed"}) == {
+        "jobs.scheduled": -1, "jobs.completed": 1
+    }
+    assert counter_delta("alerts", {"resolved": False}, None) == {"alerts.total": -1, "alerts.unresolved": -1}
+    assert counter_delta(
+        "invoices",
+        {"total": 100.0, "paid_amount": 0.0, "balance_due": 100.0},
+        {"total": 100.0, "paid_amount": 40.0, "balance_due": 60.0}
+    ) == {"invoices.total_paid": 40.0, "invoices.total_outstanding": -40.0}
+    assert counter_delta("quotes", {"status": "pending"}, {"status": "pending"}) == {}
+
+
+def test_summary_is_rebuilt_on_first_read_then_incremented(db):
+    async def scenario():
+        await db.jobs.insert_one({"id": "j1", "customer_id": "c1", "status": "completed"})
+        await db.jobs_archive.insert_one({"id": "j0", "customer_id": "c1", "status": "completed"})
+        await db.alerts.insert_one({"id": "a1", "customer_id": "c1", "resolved": False})
+        # No summary yet: increments are not upserted
+        await counters.record_change("jobs", None, {"id": "j1", "customer_id": "c1", "status": "completed"})
+        missing = await db.customer_summaries.count_documents({})
+
+        first = await counters.get_summary("c1")
+        await counters.record_changes("jobs", [
+            (None, {"id": "j2", "customer_id": "c1", "status": "scheduled"}),
+            ({"id": "j1", "customer_id": "c1", "status": "completed"}, None),
+        ])
+        await counters.record_change("alerts", {"customer_id": "c1", "resolved": False}, {"customer_id": "c1", "resolved": True})
+        return missing, first, await counters.get_summary("c1")
+
+    missing, first, second = asyncio.run(scenario())
+    assert missing == 0
+    assert first["jobs"] == {"total": 2, "completed": 2}
+    assert first["alerts"] == {"total": 1, "unresolved": 1}
+    assert first["invoices"] == {}
+    assert second["jobs"] == {"total": 2, "completed": 1, "scheduled": 1}
+    assert second["alerts"] == {"total": 1, "unresolved": 0, "resolved": 1}
+
+
+def test_invoice_changes_move_account_balances(db):
+    async def scenario():
+        await db.customers.insert_one({"id": "c1", "account_balance": 0.0})
+        await counters.record_changes("invoices", [
+            (None, {"customer_id": "c1", "status": "sent", "total": 100.0, "paid_amount": 0.0, "balance_due": 100.0}),
+            (None, {"customer_id": "c1", "status": "draft", "total": 50.0, "paid_amount": 0.0, "balance_due": 50.0}),
+        ])
+        opened = (await db.customers.find_one({"id": "c1"}))["account_balance"]
+        await counters.record_change(
+            "invoices",
+            {"customer_id": "c1", "status": "sent", "total": 100.0, "paid_amount": 0.0, "balance_due": 100.0},
+            {"customer_id": "c1", "status": "sent", "total": 100.0, "paid_amount": 40.0, "balance_due": 60.0}
+        )
+        return opened, (await db.customers.find_one({"id": "c1"}))["account_balance"]
+
+    assert asyncio.run(scenario()) == (-100.0, -60.0)
+
+
+def test_job_and_alert_changes_drop_daily_plans(db):
+    today = daily_plans.local_today().isoformat()
+
+    async def scenario():
+        await db.daily_plans.insert_many([
+            {"technician_name": "Tech", "date": today, "stops": [{"customer": {"id": "c1"}}]},
+            {"technician_name": "Other", "date": today, "stops": [{"customer": {"id": "c2"}}]},
+            {"technician_name": "Third", "date": today, "stops": [{"customer": {"id": "c3"}}]},
+        ])
+        await counters.record_change(
+            "jobs", None, {"customer_id": "c9", "status": "scheduled", "technician": "Tech", "scheduled_date": today}
+        )
+        await counters.record_change("alerts", None, {"customer_id": "c2", "resolved": False})
+        # Quotes do not appear in plans
+        await counters.record_change("quotes", None, {"customer_id": "c3", "status": "pending"})
+        return sorted([p["technician_name"] async for p in db.daily_plans.find({})])
+
+    assert asyncio.run(scenario()) == ["Third"]
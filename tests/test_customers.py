@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo import UpdateOne
+
+from models import ChemReadingBulkCreate
+from routers import alerts, customers
+
+GOOD = {"fc": 2.0, "ph": 7.4, "ta": 100, "ch": 300, "cya": 40}
+
+
+class Customers:
+    """Resolves pools.$ to the matched pool's index, as mongomock can't $push through it"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    async def bulk_write(self, operations, **kwargs):
+        resolved = []
+        for op in operations:
+            customer = await self._collection.find_one({"id": op._filter["id"]})
+            index = [p["id"] for p in customer["pools"]].index(op._filter["pools.id"])
+            update = {
+                operator: {field.replace("pools.$.", f"pools.{index}."): value for field, value in fields.items()}
+                for operator, fields in op._doc.items()
+            }
+            resolved.append(UpdateOne(op._filter, update))
+        return await self._collection.bulk_write(resolved, **kwargs)
+
+
+class Database:
+    def __init__(self, database):
+        self._database = database
+        self.customers = Customers(database.customers)
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = AsyncMongoMockClient()["test"]
+    customers.init_db(Database(database))
+    alerts.init_db(database)
+    changes = []
+
+    async def record_changes(kind, batch):
+        changes.append((kind, batch))
+
+    monkeypatch.setattr(alerts, "record_changes", record_changes)
+    database.changes = changes
+
+    async def setup():
+        await database.customers.insert_many([
+            {"id": "c1", "name": "One", "pools": [
+                {"id": "p1", "name": "Main", "last_service": "2025-03-01", "chem_readings": []},
+                {"id": "p2", "name": "Spa", "last_service": "2025-03-20", "chem_readings": []},
+            ]},
+            {"id": "c2", "name": "Two", "pools": [
+                {"id": "p3", "name": "Main", "last_service": "2025-03-01", "chem_readings": []},
+            ]},
+        ])
+        # Already open, so the low chlorine in p1's latest reading is not raised again
+        await database.alerts.insert_one(
+            {"id": "a0", "type": "chemical", "resolved": False, "pool_id": "p1", "title": "Low Free Chlorine"}
+        )
+
+    asyncio.run(setup())
+    return database
+
+
+def reading(customer_id, pool_id, date, **values):
+    return {"customer_id": customer_id, "pool_id": pool_id, "date": date, **GOOD, **values}
+
+
+def test_bulk_readings_are_grouped_per_pool(db):
+    payload = ChemReadingBulkCreate(readings=[
+        reading("c1", "p1", "2025-03-10", fc=0.2, ph=8.4),
+        reading("c1", "p1", "2025-03-05", ph=8.4),
+        reading("c1", "p2", "2025-03-10", ch=100),
+        reading("c2", "p3", "2025-03-10"),
+        reading("c2", "p9", "2025-03-10"),
+        reading("c9", "p1", "2025-03-10"),
+    ])
+
+    async def scenario():
+        result = await customers.add_chem_readings_bulk(payload)
+        docs = {c["id"]: c async for c in db.customers.find({}, {"_id": 0})}
+        new_alerts = await db.alerts.find({"id": {"$ne": "a0"}}, {"_id": 0}).to_list(None)
+        return result, docs, new_alerts
+
+    result, docs, new_alerts = asyncio.run(scenario())
+    assert result["applied"] == 4
+    assert result["pools_updated"] == 3
+    assert result["customers_updated"] == 2
+    assert [(r["index"], r["reason"]) for r in result["rejected"]] == [(4, "Pool not found"), (5, "Customer not found")]
+
+    p1, p2 = docs["c1"]["pools"]
+    # Readings land in date order; last_service only moves forward
+    assert [r["date"] for r in p1["chem_readings"]] == ["2025-03-05", "2025-03-10"]
+    assert p1["last_service"] == "2025-03-10"
+    assert p2["last_service"] == "2025-03-20"
+    assert docs["c2"]["pools"][0]["last_service"] == "2025-03-10"
+
+    # Only each pool's latest reading is evaluated, skipping alerts already open
+    assert result["alerts_created"] == 2
+    assert sorted((a["pool_id"], a["title"], a["severity"]) for a in new_alerts) == [
+        ("p1", "High pH", "high"), ("p2", "Low Calcium Hardness", "high")
+    ]
+    assert [a["customer_name"] for a in new_alerts] == ["One", "One"]
+    assert db.changes[0][0] == "alerts" and len(db.changes[0][1]) == 2
+
+
+def test_bulk_readings_with_nothing_valid(db):
+    payload = ChemReadingBulkCreate(readings=[reading("c9", "p1", "2025-03-10")])
+    result = asyncio.run(customers.add_chem_readings_bulk(payload))
+    assert result["applied"] == 0
+    assert result["alerts_created"] == 0
+    assert db.changes == []
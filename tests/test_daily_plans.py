@@ -0,0 +1,94 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import daily_plans, locks
+from services.daily_plans import invalidate, seconds_until
+
+CHICAGO = ZoneInfo("America/Chicago")
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = AsyncMongoMockClient()["test"]
+    daily_plans.init_db(database)
+    monkeypatch.setattr(daily_plans, "local_today", lambda: date(2026, 3, 2))
+    return database
+
+
+def test_seconds_until_uses_local_wall_clock():
+    now = datetime(2026, 6, 1, 1, 30, tzinfo=CHICAGO)
+    assert seconds_until("02:00", now) == 30 * 60
+    assert seconds_until("01:00", now) == timedelta(hours=23, minutes=30).total_seconds()
+
+
+def test_seconds_until_across_dst_change():
+    # Clocks go forward on 2026-03-08, so 02:00 -> 03:00 the next night is 23 real hours
+    now = datetime(2026, 3, 7, 3, 0, tzinfo=CHICAGO)
+    assert seconds_until("03:00", now) == timedelta(hours=23).total_seconds()
+
+
+def plan(technician_id, name, plan_date, day, customer_ids):
+    return {
+        "technician_id": technician_id, "technician_name": name, "date": plan_date, "day": day,
+        "stops": [{"customer": {"id": c}} for c in customer_ids]
+    }
+
+
+def test_invalidate_drops_only_affected_plans(db):
+    async def remaining():
+        return sorted((p["technician_id"], p["date"]) for p in await db.daily_plans.find().to_list(None))
+
+    async def scenario():
+        await db.daily_plans.insert_many([
+            plan("t1", "Ana", "2026-03-02", "Monday", ["c1"]),
+            plan("t1", "Ana", "2026-03-03", "Tuesday", ["c2"]),
+            plan("t2", "Ben", "2026-03-02", "Monday", ["c3"]),
+            plan("t2", "Ben", "2026-02-23", "Monday", ["c3"]),
+            plan("t2", "Ben", "2026-03-09", "Monday", ["c4"]),
+        ])
+        await invalidate("jobs", [{"technician": "Ana", "scheduled_date": "2026-03-03"}, None])
+        after_job = await remaining()
+        await invalidate("alerts", [{"customer_id": "c3"}])
+        after_alert = await remaining()
+        await invalidate("routes", [{"technician_id": "t2", "day": "Monday"}])
+        return after_job, after_alert, await remaining()
+
+    after_job, after_alert, after_route = asyncio.run(scenario())
+    assert ("t1", "2026-03-03") not in after_job and len(after_job) == 4
+    # Past plans are history and stay
+    assert after_alert == [("t1", "2026-03-02"), ("t2", "2026-02-23"), ("t2", "2026-03-09")]
+    assert after_route == [("t1", "2026-03-02"), ("t2", "2026-02-23")]
+
+
+@pytest.mark.parametrize("held", [False, True])
+def test_nightly_run_skips_while_another_worker_builds(db, monkeypatch, held):
+    locks.init_db(db)
+    built = []
+    sleeps = []
+
+    async def precompute_plans():
+        built.append(True)
+        return {"technicians": 0, "date": "2026-03-03"}
+
+    async def sleep(seconds):
+        # Wake once for the nightly run, then stop the loop
+        sleeps.append(seconds)
+        if len(sleeps) > 1:
+            raise asyncio.CancelledError()
+
+    monkeypatch.setattr(daily_plans, "precompute_plans", precompute_plans)
+    monkeypatch.setattr(daily_plans.asyncio, "sleep", sleep)
+
+    async def scenario():
+        await locks.ensure_indexes()
+        if held:
+            await locks.acquire(daily_plans.PLAN_PRECOMPUTE_LEASE, 600)
+        with pytest.raises(asyncio.CancelledError):
+            await daily_plans.run_nightly()
+
+    asyncio.run(scenario())
+    assert built == ([] if held else [True])
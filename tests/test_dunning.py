@@ -0,0 +1,85 @@
+import asyncio
+from datetime import date
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import dunning, locks
+from services.locks import LockHeld
+
+TODAY = date(2025, 3, 20)
+
+
+@pytest.fixture
+def db():
+    database = AsyncMongoMockClient()["test"]
+    dunning.init_db(database)
+    locks.init_db(database)
+
+    async def setup():
+        await locks.ensure_indexes()
+        await dunning.ensure_indexes()
+        await database.customers.insert_one({"id": "c1", "name": "Pat", "email": "pat@example.com"})
+        await database.invoices.insert_many([
+            {"id": "i1", "customer_id": "c1", "customer_name": "Pat", "invoice_number": "INV-2025-001",
+             "status": "overdue", "due_date": "2025-03-10", "balance_due": 40.0},
+            {"id": "i2", "customer_id": "c1", "customer_name": "Pat", "invoice_number": "INV-2025-002",
+             "status": "overdue", "due_date": "2025-02-25", "balance_due": 60.0, "dunning_level": 1},
+        ])
+
+    asyncio.run(setup())
+    return database
+
+
+async def levels(db):
+    return {i["id"]: i.get("dunning_level") async for i in db.invoices.find({})}
+
+
+def test_queue_reminders_once_per_day(db):
+    async def scenario():
+        first = await dunning.queue_reminders(TODAY)
+        again = await dunning.queue_reminders(TODAY)
+        return first, again, await levels(db), await db.dunning_notices.find({}, {"_id": 0}).to_list(None)
+
+    first, again, after, notices = asyncio.run(scenario())
+    assert (first, again) == (1, 0)
+    assert after == {"i1": 1, "i2": 2}
+    [notice] = notices
+    assert notice["id"] == "2025-03-20:c1"
+    assert sorted((i["id"], i["level"]) for i in notice["invoices"]) == [("i1", 1), ("i2", 2)]
+    assert notice["total_due"] == 100.0
+
+
+def test_notice_lost_after_levels_advanced_is_queued_next_run(db, monkeypatch):
+    queue_notices = dunning._queue_notices
+
+    async def crash(notice_ids):
+        raise RuntimeError("worker died")
+
+    async def scenario():
+        monkeypatch.setattr(dunning, "_queue_notices", crash)
+        with pytest.raises(RuntimeError):
+            await dunning.queue_reminders(TODAY)
+        monkeypatch.setattr(dunning, "_queue_notices", queue_notices)
+        queued = await dunning.queue_reminders(date(2025, 3, 21))
+        return queued, await levels(db), await db.dunning_notices.find({}, {"_id": 0}).to_list(None)
+
+    queued, after, notices = asyncio.run(scenario())
+    assert queued == 1
+    # Not advanced a second time for the day that lost its notice
+    assert after == {"i1": 1, "i2": 2}
+    assert [n["run_date"] for n in notices] == ["2025-03-20"]
+
+
+def test_run_dunning_skips_while_another_worker_runs(db):
+    async def scenario():
+        async with locks.lease(dunning.DUNNING_LEASE):
+            await dunning.run_dunning(TODAY)
+
+    with pytest.raises(LockHeld):
+        asyncio.run(scenario())
+
+
+def test_bad_notifier_falls_back_to_log(monkeypatch):
+    monkeypatch.setenv("DUNNING_NOTIFIER", "no_such_module:Notifier")
+    assert isinstance(dunning.load_notifier(), dunning.LogNotifier)
@@ -0,0 +1,36 @@
+import asyncio
+
+from mongomock_motor import AsyncMongoMockClient
+
+from services import geocoding
+from services.geocoding import _candidates, normalize_address
+
+
+def test_normalize_address_abbreviates_and_strips_punctuation():
+    assert normalize_address("123 Main Street, Austin, TX") == "123 MAIN ST AUSTIN TX"
+    assert normalize_address("123 main st.") == "123 MAIN ST"
+    assert normalize_address(None) == ""
+
+
+def test_candidates_drop_zip_and_zip_plus_four():
+    assert _candidates("1 Congress Ave, Austin, TX 78701") == [
+        "1 CONGRESS AVE AUSTIN TX 78701", "1 CONGRESS AVE AUSTIN TX"
+    ]
+    assert _candidates("1 Congress Ave, Austin, TX 78701-1234") == [
+        "1 CONGRESS AVE AUSTIN TX 78701 1234", "1 CONGRESS AVE AUSTIN TX"
+    ]
+    assert _candidates("1 Congress Ave") == ["1 CONGRESS AVE"]
+
+
+def test_load_dataset_reads_only_the_configured_file(tmp_path, monkeypatch):
+    dataset = tmp_path / "addresses.csv"
+    dataset.write_text("address,lat,lon\n1 Congress Ave Austin TX,30.26,-97.74\nbad row,x,y\n")
+    monkeypatch.setattr(geocoding, "GEOCODE_DATASET_PATH", str(dataset))
+    db = AsyncMongoMockClient()["test"]
+    geocoding.init_db(db)
+
+    result = asyncio.run(geocoding.load_dataset())
+
+    assert result == {"source": "addresses.csv", "loaded": 1}
+    row = asyncio.run(db.geocode_addresses.find_one({"normalized": "1 CONGRESS AVE AUSTIN TX"}))
+    assert (row["lat"], row["lon"]) == (30.26, -97.74)
@@ -0,0 +1,68 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import idempotency
+
+
+@pytest.fixture
+def db():
+    database = AsyncMongoMockClient()["test"]
+    idempotency.init_db(database)
+    asyncio.run(idempotency.ensure_indexes())
+    return database
+
+
+async def expire(db, key):
+    await db.idempotency_keys.update_one(
+        {"key": key}, {"$set": {"lock_until": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+    )
+
+
+def test_retry_sees_running_then_completed_request(db):
+    async def scenario():
+        owner, _ = await idempotency.reserve("k", "f")
+        _, running = await idempotency.reserve("k", "f")
+        await idempotency.complete("k", owner, 201, [(b"content-type", b"application/json")], b"{}")
+        _, completed = await idempotency.reserve("k", "f")
+        return owner, running, completed
+
+    owner, running, completed = asyncio.run(scenario())
+    assert owner
+    assert running["status"] == "processing"
+    assert completed["status"] == "completed"
+    assert completed["response"]["status"] == 201
+
+
+def test_extended_reservation_is_not_taken_over(db):
+    async def scenario():
+        owner, _ = await idempotency.reserve("k", "f")
+        await expire(db, "k")
+        # The running request's heartbeat gets in first
+        extended = await idempotency.extend("k", owner)
+        retry_owner, existing = await idempotency.reserve("k", "f")
+        return extended, retry_owner, existing
+
+    extended, retry_owner, existing = asyncio.run(scenario())
+    assert extended
+    assert retry_owner is None
+    assert existing["status"] == "processing"
+
+
+def test_lapsed_owner_cannot_touch_new_reservation(db):
+    async def scenario():
+        first, _ = await idempotency.reserve("k", "f")
+        await expire(db, "k")
+        second, _ = await idempotency.reserve("k", "f")
+        await idempotency.complete("k", first, 200, [], b"stale")
+        await idempotency.release("k", first)
+        extended = await idempotency.extend("k", first)
+        return first, second, extended, await db.idempotency_keys.find_one({"key": "k"})
+
+    first, second, extended, record = asyncio.run(scenario())
+    assert second and second != first
+    assert not extended
+    assert record["owner"] == second
+    assert record["status"] == "processing"
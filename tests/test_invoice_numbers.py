@@ -0,0 +1,38 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import invoice_numbers
+
+
+@pytest.fixture
+def db():
+    database = AsyncMongoMockClient()["test"]
+    invoice_numbers.init_db(database)
+    return database
+
+
+def test_claimed_number_is_not_allocated_again(db):
+    async def scenario():
+        first = await invoice_numbers.allocate_number(2025)
+        await invoice_numbers.claim_number("INV-2025-010")
+        # Other formats don't touch the sequence
+        await invoice_numbers.claim_number("LEGACY-2025-500")
+        return first, await invoice_numbers.allocate_numbers(2025, 2)
+
+    first, block = asyncio.run(scenario())
+    assert first == "INV-2025-001"
+    assert block == ["INV-2025-011", "INV-2025-012"]
+
+
+def test_existing_numbers_are_synced_once(db):
+    async def scenario():
+        await db.invoices.insert_one({"id": "a", "invoice_number": "INV-2024-041"})
+        await invoice_numbers.ensure_indexes()
+        # Added behind the sequence's back after the sync; not scanned again
+        await db.invoices.insert_one({"id": "b", "invoice_number": "INV-2024-090"})
+        await invoice_numbers.ensure_indexes()
+        return await invoice_numbers.allocate_number(2024)
+
+    assert asyncio.run(scenario()) == "INV-2024-042"
@@ -0,0 +1,62 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import invoice_search
+from services.invoice_search import build_search
+
+
+@pytest.fixture
+def db():
+    database = AsyncMongoMockClient()["test"]
+    invoice_search.init_db(database)
+    asyncio.run(invoice_search.ensure_indexes())
+    return database
+
+
+def test_customer_and_status_lead_the_index():
+    *_, hint = build_search(customer_id="c1", status="sent", sort="total")
+    assert hint == [("customer_id", 1), ("status", 1), ("total", 1), ("id", 1)]
+
+
+def test_range_on_other_date_field_bounds_the_scan():
+    *_, hint = build_search(status="sent", due_from="2025-01-01", due_to="2025-01-31", sort="issue_date")
+    assert hint == [("status", 1), ("due_date", 1), ("id", 1)]
+    # A range on the sort field is bounded by the sort index itself
+    *_, hint = build_search(status="sent", issue_from="2025-01-01", due_from="2025-01-01", sort="issue_date")
+    assert hint == [("status", 1), ("issue_date", 1), ("id", 1)]
+
+
+def test_hints_name_existing_indexes(db):
+    async def index_keys():
+        return [list(spec["key"]) for spec in (await db.invoices.index_information()).values()]
+
+    keys = asyncio.run(index_keys())
+    for filters in (
+        {"customer_id": "c1", "status": "sent", "sort": "due_date"},
+        {"customer_id": "c1", "issue_from": "2025-01-01", "sort": "total"},
+        {"due_to": "2025-01-31", "sort": "issue_date"},
+    ):
+        *_, hint = build_search(**filters)
+        assert hint in keys
+
+
+@pytest.mark.parametrize("descending", [False, True])
+def test_cursor_pages_through_missing_sort_values(db, descending):
+    async def scenario():
+        await db.invoices.insert_many([
+            {"id": "a", "total": 10.0}, {"id": "b", "total": None}, {"id": "c", "total": 20.0},
+            {"id": "d"}, {"id": "e", "total": 10.0},
+        ])
+        seen, cursor = [], None
+        while True:
+            query, sort, direction, _ = build_search(sort="total", descending=descending, cursor=cursor)
+            page = await db.invoices.find(query, {"_id": 0}).sort([(sort, direction), ("id", direction)]).limit(2).to_list(None)
+            seen += [invoice["id"] for invoice in page]
+            if len(page) < 2:
+                return seen
+            cursor = invoice_search.encode_cursor(page[-1].get(sort), page[-1]["id"])
+
+    expected = ["b", "d", "a", "e", "c"]
+    assert asyncio.run(scenario()) == (expected[::-1] if descending else expected)
@@ -0,0 +1,208 @@
+import asyncio
+import itertools
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+from services import locks, payments
+from services.locks import LockHeld
+
+OLD = datetime.now(timezone.utc) - timedelta(days=2)
+_seconds = itertools.count()
+
+
+@pytest.fixture
+def db(monkeypatch, unrounded):
+    database = AsyncMongoMockClient()["test"]
+    payments.init_db(database)
+    locks.init_db(database)
+    asyncio.run(locks.ensure_indexes())
+    asyncio.run(payments.ensure_indexes())
+    unrounded(payments, "settle_stages", "payment_pipeline")
+    changes = []
+
+    async def record_change(kind, before, after):
+        changes.append((before, after))
+
+    monkeypatch.setattr(payments, "record_change", record_change)
+    database.changes = changes
+    return database
+
+
+def invoice(invoice_id, total, paid):
+    return {
+        "id": invoice_id, "customer_id": "c1", "status": "sent",
+        "total": total, "paid_amount": paid, "balance_due": round(total - paid, 2)
+    }
+
+
+def entry(invoice_id, amount, inserted=OLD):
+    # _id timestamps have one-second resolution; keep them distinct
+    inserted = inserted - timedelta(seconds=next(_seconds))
+    return {
+        "_id": ObjectId.from_datetime(inserted), "id": f"pay-{ObjectId()}", "invoice_id": invoice_id,
+        "customer_id": "c1", "amount": amount, "method": "manual", "created_at": inserted
+    }
+
+
+class Invoices:
+    """Invoices collection that can run a concurrent write just before each update"""
+
+    def __init__(self, collection, before_update=None):
+        self.collection = collection
+        self.before_update = before_update
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def find_one_and_update(self, query, *args, projection=None, **kwargs):
+        if self.before_update:
+            await self.before_update(query["id"])
+        # mongomock re-reads the AFTER document with the original filter when given a projection
+        updated = await self.collection.find_one_and_update(query, *args, **kwargs)
+        if updated is not None:
+            updated.pop("_id", None)
+        return updated
+
+
+class Payments:
+    """Payments collection that can run a concurrent write just before inserting"""
+
+    def __init__(self, collection, before_insert=None):
+        self.collection = collection
+        self.before_insert = before_insert
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+    async def insert_many(self, docs, *args, **kwargs):
+        if self.before_insert:
+            await self.before_insert()
+        return await self.collection.insert_many(docs, *args, **kwargs)
+
+
+def use(db, before_update=None, before_insert=None):
+    payments.db = SimpleNamespace(
+        invoices=Invoices(db.invoices, before_update), payments=Payments(db.payments, before_insert)
+    )
+
+
+def test_reconcile_corrects_from_ledger(db):
+    async def scenario():
+        await db.invoices.insert_many([
+            invoice("drifted", 100.0, 20.0),
+            invoice("clean", 50.0, 50.0),
+            invoice("in-flight", 80.0, 0.0),
+            {**invoice("legacy", 60.0, 60.0), "paid_date": "2024-11-02"},
+        ])
+        await db.payments.insert_many([
+            entry("drifted", 30.0), entry("drifted", 40.0),
+            entry("clean", 50.0),
+            # Written a moment ago and maybe not applied yet
+            entry("in-flight", 80.0, inserted=datetime.now(timezone.utc)),
+        ])
+        use(db)
+        result = await payments.reconcile_invoices()
+        opening = await db.payments.find_one({"method": "opening_balance"})
+        return result, {i["id"]: i async for i in db.invoices.find({}, {"_id": 0})}, opening
+
+    result, invoices, opening = asyncio.run(scenario())
+    assert result["corrected_invoice_ids"] == ["drifted"]
+    assert result["skipped_in_flight"] == 1
+    assert result["opening_balances"] == 1
+    # Dated when the invoice was paid, not when reconcile ran
+    assert opening["created_at"].date().isoformat() == "2024-11-02"
+    assert invoices["drifted"]["paid_amount"] == 70.0
+    assert invoices["drifted"]["balance_due"] == 30.0
+    assert invoices["in-flight"]["paid_amount"] == 0.0
+    assert [(before["paid_amount"], after["paid_amount"]) for before, after in db.changes] == [(20.0, 70.0)]
+
+
+def test_reconcile_leaves_invoice_paid_during_run(db):
+    async def pay(invoice_id):
+        await db.invoices.update_one({"id": invoice_id}, {"$inc": {"paid_amount": 10.0, "balance_due": -10.0}})
+
+    async def scenario():
+        await db.invoices.insert_one(invoice("drifted", 100.0, 20.0))
+        await db.payments.insert_one(entry("drifted", 30.0))
+        use(db, pay)
+        result = await payments.reconcile_invoices()
+        return result, await db.invoices.find_one({"id": "drifted"})
+
+    result, drifted = asyncio.run(scenario())
+    assert result["corrected"] == 0
+    assert drifted["paid_amount"] == 30.0
+    assert db.changes == []
+
+
+def test_record_payment_on_deleted_invoice(db):
+    async def delete(invoice_id):
+        await db.invoices.delete_one({"id": invoice_id})
+
+    async def scenario():
+        await db.invoices.insert_one(invoice("gone", 100.0, 0.0))
+        use(db, delete)
+        result = await payments.record_payment("gone", 25.0)
+        return result, await db.payments.count_documents({})
+
+    result, ledger_rows = asyncio.run(scenario())
+    assert result is None
+    assert ledger_rows == 0
+    assert db.changes == []
+
+
+def test_record_payment_applies_amount(db):
+    async def scenario():
+        await db.invoices.insert_one(invoice("inv", 100.0, 0.0))
+        use(db)
+        return await payments.record_payment("inv", 100.0, reference="chk-1")
+
+    result = asyncio.run(scenario())
+    assert result["invoice"]["status"] == "paid"
+    assert result["invoice"]["balance_due"] == 0.0
+    assert db.changes[0][0]["status"] == "sent"
+
+
+def test_overlapping_reconciles_record_one_opening_entry(db):
+    overlapping = []
+
+    async def second_run():
+        # Started while the first run is about to write its opening entry
+        if not overlapping:
+            overlapping.append(None)
+            try:
+                overlapping[0] = await payments.reconcile_invoices()
+            except LockHeld as error:
+                overlapping[0] = error
+
+    async def scenario():
+        await db.invoices.insert_one(invoice("legacy", 100.0, 40.0))
+        use(db, before_insert=second_run)
+        await payments.reconcile_invoices()
+        again = await payments.reconcile_invoices()
+        return again, await db.payments.count_documents({}), await db.invoices.find_one({"id": "legacy"})
+
+    again, ledger_rows, legacy = asyncio.run(scenario())
+    assert isinstance(overlapping[0], LockHeld)
+    assert again["corrected"] == 0
+    assert ledger_rows == 1
+    assert (legacy["paid_amount"], legacy["balance_due"]) == (40.0, 60.0)
+
+
+def test_opening_entry_written_by_another_run_is_not_duplicated(db):
+    async def other_run():
+        # A run whose lease lapsed records the same opening entry first
+        await db.payments.insert_one({**entry("legacy", 40.0), "reference": "opening-legacy"})
+
+    async def scenario():
+        await db.invoices.insert_one(invoice("legacy", 100.0, 40.0))
+        use(db, before_insert=other_run)
+        result = await payments.reconcile_invoices()
+        return result, await db.payments.count_documents({})
+
+    result, ledger_rows = asyncio.run(scenario())
+    assert result["opening_balances"] == 0
+    assert ledger_rows == 1
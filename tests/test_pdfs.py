@@ -0,0 +1,104 @@
+import asyncio
+import io
+import threading
+import zipfile
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import pdfs
+
+INVOICE = {
+    "id": "inv-1", "customer_id": "c1", "invoice_number": "INV-2025-001", "status": "sent",
+    "issue_date": "2025-03-01", "due_date": "2025-03-31", "subtotal": 125.0, "tax": 10.0, "total": 135.0,
+    "balance_due": 135.0, "line_items": [{"description": "Weekly Pool Maintenance", "quantity": 1, "unit_price": 125.0, "total": 125.0}]
+}
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    database = AsyncMongoMockClient()["test"]
+    pdfs.init_db(database)
+    monkeypatch.setattr(pdfs, "PDF_CACHE_DIR", tmp_path)
+    renders = []
+    real = pdfs.render_invoice
+
+    def render_invoice(invoice, customer):
+        renders.append(invoice["id"])
+        return real(invoice, customer)
+
+    # Render on the loop's default thread pool instead of worker processes
+    monkeypatch.setattr(pdfs, "_get_executor", lambda: None)
+    monkeypatch.setattr(pdfs, "render_invoice", render_invoice)
+    database.renders = renders
+    asyncio.run(database.customers.insert_one({"id": "c1", "name": "Pat", "address": "1 Main St"}))
+    return database
+
+
+def test_cache_path_follows_customer_details():
+    invoice = {"id": "inv-1", "invoice_number": "INV-2025-00001", "total": 10.0}
+    before = pdfs.cache_path("invoices", invoice, {"name": "Pat", "address": "1 Main St"})
+    moved = pdfs.cache_path("invoices", invoice, {"name": "Pat", "address": "9 Elm St"})
+    assert before != moved
+    assert before == pdfs.cache_path("invoices", dict(invoice), {"address": "1 Main St", "name": "Pat"})
+
+
+def test_evict_removes_only_that_document(tmp_path, monkeypatch):
+    monkeypatch.setattr(pdfs, "PDF_CACHE_DIR", tmp_path)
+    for name in ("inv-1-aaa.pdf", "inv-1-bbb.pdf", "inv-2-aaa.pdf"):
+        (tmp_path / "invoices").mkdir(exist_ok=True)
+        (tmp_path / "invoices" / name).write_bytes(b"%PDF")
+    asyncio.run(pdfs.evict("invoices", "inv-1"))
+    assert [p.name for p in (tmp_path / "invoices").iterdir()] == ["inv-2-aaa.pdf"]
+
+
+def test_invoice_pdf_is_rendered_once_and_cached(db):
+    async def scenario():
+        first, second = await asyncio.gather(pdfs.invoice_pdf(INVOICE), pdfs.invoice_pdf(INVOICE))
+        return first, second, await pdfs.invoice_pdf(INVOICE)
+
+    first, second, cached = asyncio.run(scenario())
+    assert first.startswith(b"%PDF-1.4") and first.rstrip().endswith(b"%%EOF")
+    assert first == second == cached
+    assert db.renders == ["inv-1"]
+    assert len(list(pdfs.PDF_CACHE_DIR.glob("invoices/inv-1-*.pdf"))) == 1
+
+
+def test_cancelled_waiter_does_not_cancel_shared_render(db, monkeypatch):
+    release = threading.Event()
+    real = pdfs.render_invoice
+
+    def slow_render(invoice, customer):
+        release.wait(5)
+        return real(invoice, customer)
+
+    monkeypatch.setattr(pdfs, "render_invoice", slow_render)
+
+    async def scenario():
+        first = asyncio.ensure_future(pdfs.invoice_pdf(INVOICE))
+        second = asyncio.ensure_future(pdfs.invoice_pdf(INVOICE))
+        while not pdfs._rendering:
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        # The first client goes away while both wait on the render
+        first.cancel()
+        await asyncio.sleep(0.01)
+        release.set()
+        return await second
+
+    assert asyncio.run(scenario()).startswith(b"%PDF")
+
+
+def test_billing_run_zip_holds_every_invoice(db, monkeypatch):
+    monkeypatch.setattr(pdfs, "ZIP_BATCH_SIZE", 2)
+
+    async def scenario():
+        await db.invoices.insert_many([
+            {**INVOICE, "id": f"inv-{n}", "invoice_number": f"INV-2025-00{n}", "billing_run_id": "run-1"}
+            for n in (3, 1, 2)
+        ])
+        return b"".join([chunk async for chunk in pdfs.billing_run_zip("run-1")])
+
+    archive = zipfile.ZipFile(io.BytesIO(asyncio.run(scenario())))
+    assert archive.namelist() == ["INV-2025-001.pdf", "INV-2025-002.pdf", "INV-2025-003.pdf"]
+    assert all(archive.read(name).startswith(b"%PDF") for name in archive.namelist())
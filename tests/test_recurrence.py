@@ -0,0 +1,119 @@
+import asyncio
+from datetime import date
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import recurrence, scheduling
+from services.recurrence import recurrence_key
+
+MONDAY = date(2026, 3, 2)
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = AsyncMongoMockClient()["test"]
+    recurrence.init_db(database)
+    scheduling.init_db(database)
+    memberships = []
+
+    async def update_membership(route_id, add, remove, updated_at):
+        memberships.append((route_id, add, remove))
+        route = await database.routes.find_one({"id": route_id})
+        jobs = [j for j in route["jobs"] if j not in remove] + add
+        await database.routes.update_one({"id": route_id}, {"$set": {"jobs": jobs}})
+
+    async def record_changes(kind, changes):
+        pass
+
+    monkeypatch.setattr(recurrence, "update_membership", update_membership)
+    monkeypatch.setattr(recurrence, "record_changes", record_changes)
+    database.memberships = memberships
+    return database
+
+
+def routine_job(job_id, customer_id, scheduled):
+    return {
+        "id": job_id, "customer_id": customer_id, "scheduled_date": scheduled,
+        "recurrence_key": recurrence_key(customer_id, scheduled)
+    }
+
+
+async def seed(db, route_jobs):
+    await db.customers.insert_many([
+        {"id": "c1", "name": "One", "status": "active", "service_day": "Monday", "route_position": 1},
+        {"id": "c2", "name": "Two", "status": "active", "service_day": "Monday", "route_position": 2},
+    ])
+    await db.routes.insert_one({
+        "id": "r1", "day": "Monday", "status": "active", "technician_name": "Tech", "jobs": route_jobs
+    })
+
+
+def test_route_gets_only_the_next_date(db):
+    async def scenario():
+        await seed(db, [])
+        result = await recurrence.generate_routine_jobs(weeks=3, start=MONDAY)
+        route = await db.routes.find_one({"id": "r1"})
+        jobs = await db.jobs.find({"id": {"$in": route["jobs"]}}).to_list(None)
+        return result, jobs
+
+    result, jobs = asyncio.run(scenario())
+    assert result["created"] == 6
+    assert result["routes_updated"] == 1
+    assert sorted(job["customer_id"] for job in jobs) == ["c1", "c2"]
+    assert {job["scheduled_date"] for job in jobs} == {"2026-03-02"}
+
+
+def test_later_run_rolls_the_route_forward(db):
+    async def scenario():
+        await seed(db, [])
+        await recurrence.generate_routine_jobs(weeks=3, start=MONDAY)
+        await recurrence.generate_routine_jobs(weeks=3, start=date(2026, 3, 3))
+        route = await db.routes.find_one({"id": "r1"})
+        return await db.jobs.find({"id": {"$in": route["jobs"]}}).to_list(None)
+
+    jobs = asyncio.run(scenario())
+    assert sorted(job["customer_id"] for job in jobs) == ["c1", "c2"]
+    assert {job["scheduled_date"] for job in jobs} == {"2026-03-09"}
+
+
+def test_other_dates_are_detached_and_one_off_jobs_kept(db):
+    async def scenario():
+        await db.jobs.insert_many([
+            routine_job("old", "c1", "2026-02-23"),
+            routine_job("later", "c1", "2026-03-09"),
+            {"id": "repair", "customer_id": "c1", "scheduled_date": "2026-02-23"},
+        ])
+        await seed(db, ["old", "later", "repair"])
+        await recurrence.generate_routine_jobs(weeks=2, start=MONDAY)
+        route = await db.routes.find_one({"id": "r1"})
+        return route, await db.jobs.find({"id": {"$in": route["jobs"]}}).to_list(None)
+
+    route, jobs = asyncio.run(scenario())
+    assert "repair" in route["jobs"]
+    assert "old" not in route["jobs"] and "later" not in route["jobs"]
+    routine = [job for job in jobs if job.get("recurrence_key")]
+    assert sorted(job["customer_id"] for job in routine) == ["c1", "c2"]
+    assert {job["scheduled_date"] for job in routine} == {"2026-03-02"}
+    assert len(db.memberships) == 1
+
+
+def test_second_run_books_new_customer_after_existing_stops(db):
+    async def scenario():
+        await seed(db, [])
+        await recurrence.generate_routine_jobs(weeks=2, start=MONDAY)
+        await db.customers.insert_one(
+            {"id": "c3", "name": "Three", "status": "active", "service_day": "Monday", "route_position": 1}
+        )
+        result = await recurrence.generate_routine_jobs(weeks=2, start=MONDAY)
+        times = {
+            (job["customer_id"], job["scheduled_date"]): job["scheduled_time"]
+            async for job in db.jobs.find({"scheduled_date": "2026-03-02"})
+        }
+        return result, times, await scheduling.list_conflicts()
+
+    result, times, conflicts = asyncio.run(scenario())
+    assert result["created"] == 2
+    assert conflicts == []
+    assert times[("c1", "2026-03-02")] == "08:00 AM"
+    assert times[("c3", "2026-03-02")] not in ("08:00 AM", times[("c2", "2026-03-02")])
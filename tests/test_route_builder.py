@@ -0,0 +1,71 @@
+import math
+import random
+
+from services.route_builder import build_routes, route_duration, split_by_workload, sweep_order
+
+
+def travel_for(points):
+    return [[math.dist(a, b) * 100 for b in points] for a in points]
+
+
+def test_sweep_order_starts_after_widest_gap():
+    # Two clusters east and west of the centroid: the sweep must not split either
+    points = [[1.0, 0.1], [1.0, -0.1], [1.1, 0.0], [-1.0, 0.1], [-1.0, -0.1], [-1.1, 0.0]]
+    order = sweep_order(points)
+    assert sorted(order) == list(range(6))
+    assert {frozenset(order[:3]), frozenset(order[3:])} == {frozenset({0, 1, 2}), frozenset({3, 4, 5})}
+
+
+def test_sweep_order_trivial_inputs():
+    assert sweep_order([]) == []
+    assert sweep_order([[1.0, 2.0]]) == [0]
+
+
+def test_split_by_workload_balances_service_time():
+    order = list(range(8))
+    service = [10.0, 10.0, 10.0, 10.0, 10.0, 10.0, 10.0, 10.0]
+    travel = [[0.0] * 8 for _ in range(8)]
+    chunks = split_by_workload(order, service, travel, 4)
+    assert chunks == [[0, 1], [2, 3], [4, 5], [6, 7]]
+
+
+def test_split_by_workload_counts_travel_and_keeps_order():
+    order = [3, 0, 2, 1]
+    service = [5.0, 5.0, 5.0, 5.0]
+    travel = [[0.0] * 4 for _ in range(4)]
+    # The hop into the last stop is long, so it gets a part of its own
+    travel[2][1] = 30.0
+    chunks = split_by_workload(order, service, travel, 2)
+    assert chunks == [[3, 0, 2], [1]]
+    assert [stop for chunk in chunks for stop in chunk] == order
+
+
+def test_split_by_workload_edge_cases():
+    assert split_by_workload([2, 0, 1], [1.0] * 3, [[0.0] * 3] * 3, 1) == [[2, 0, 1]]
+    assert split_by_workload([], [], [], 3) == [[], [], []]
+    # No workload at all puts everything in the first part
+    assert split_by_workload([0, 1], [0.0, 0.0], [[0.0] * 2] * 2, 2) == [[0, 1], []]
+
+
+def test_build_routes_assigns_every_stop_once_within_shift():
+    rng = random.Random(7)
+    points = [[rng.uniform(-1, 1), rng.uniform(-1, 1)] for _ in range(60)]
+    service = [rng.uniform(10, 30) for _ in points]
+    travel = travel_for(points)
+    routes, unassigned = build_routes(points, service, travel, 4, shift_minutes=480, time_budget=0.5)
+    assert len(routes) == 4
+    assigned = [stop for route in routes for stop in route]
+    assert sorted(assigned + unassigned) == list(range(60))
+    assert all(route_duration(route, service, travel) <= 480 for route in routes)
+
+
+def test_build_routes_leaves_stops_that_do_not_fit():
+    points = [[0.0, 0.0], [0.0, 0.01], [0.01, 0.0]]
+    service = [100.0, 100.0, 100.0]
+    routes, unassigned = build_routes(points, service, travel_for(points), 1, shift_minutes=250, time_budget=0.1)
+    assert len(routes[0]) == 2
+    assert len(unassigned) == 1
+
+
+def test_build_routes_without_technicians():
+    assert build_routes([[0.0, 0.0]], [10.0], [[0.0]], 0, 480) == ([], [0])
@@ -0,0 +1,67 @@
+import asyncio
+import math
+
+import pytest
+
+from services import route_membership
+from services.route_membership import apply_membership, estimate_delta
+from services.service_time import travel_minutes_between
+
+STOPS = {
+    "a": {"service_minutes": 30.0, "location": [-97.74, 30.27]},
+    "u": {"service_minutes": 20.0, "location": None},
+    "v": {"service_minutes": 25.0, "location": None},
+    "b": {"service_minutes": 40.0, "location": [-97.70, 30.40]},
+    "c": {"service_minutes": 35.0, "location": [-97.60, 30.20]},
+    "d": {"service_minutes": 15.0, "location": [-97.80, 30.10]},
+}
+
+
+@pytest.fixture
+def loads(monkeypatch):
+    calls = []
+
+    async def load_stops(job_ids):
+        calls.append(sorted(job_ids))
+        return {j: STOPS[j] for j in job_ids if j in STOPS}
+
+    monkeypatch.setattr(route_membership, "load_stops", load_stops)
+    return calls
+
+
+def full_delta(before, after):
+    service = sum(STOPS[j]["service_minutes"] for j in after) - sum(STOPS[j]["service_minutes"] for j in before)
+    return service, travel_minutes_between(STOPS, after) - travel_minutes_between(STOPS, before)
+
+
+@pytest.mark.parametrize("before, add, remove", [
+    (["a", "u", "b", "c", "d"], [], ["b"]),
+    (["a", "u", "v", "c", "d"], ["b"], []),
+    (["a", "b", "u", "v", "c"], [], ["b", "c"]),
+    (["u", "a", "v", "b", "c", "d"], ["u"], ["a", "d"]),
+    (["a", "c"], ["u", "b"], []),
+])
+def test_estimate_delta_matches_full_estimate(loads, before, add, remove):
+    after = apply_membership(before, add, remove)
+    delta = asyncio.run(estimate_delta(before, after))
+    service, travel = full_delta(before, after)
+    assert math.isclose(delta["service_minutes"], service)
+    assert math.isclose(delta["travel_minutes"], travel, abs_tol=1e-9)
+
+
+def test_estimate_delta_reaches_past_unlocated_neighbours(loads):
+    # b's neighbour on the left is unlocated, so the leg into b starts at a
+    before = ["a", "u", "v", "b", "c", "d"]
+    asyncio.run(estimate_delta(before, apply_membership(before, [], ["b"])))
+    loaded = {j for call in loads for j in call}
+    assert loaded == {"a", "u", "v", "b", "c"}
+
+
+def test_estimate_delta_without_changes_loads_nothing(loads):
+    delta = asyncio.run(estimate_delta(["a", "b"], ["a", "b"]))
+    assert delta == {"service_minutes": 0.0, "travel_minutes": 0.0}
+    assert loads == []
+
+
+def test_apply_membership_keeps_order_and_skips_duplicates():
+    assert apply_membership(["a", "b", "c"], ["d", "a", "d"], ["b"]) == ["a", "c", "d"]
@@ -0,0 +1,47 @@
+import itertools
+import math
+import random
+
+from services.route_optimizer import optimize_order, path_length
+
+
+def distances(points):
+    return [[math.dist(a, b) for b in points] for a in points]
+
+
+def brute_force(dist):
+    return min(path_length(dist, list(order)) for order in itertools.permutations(range(len(dist))))
+
+
+def test_small_instances_match_brute_force():
+    rng = random.Random(7)
+    for _ in range(30):
+        points = [(rng.random(), rng.random()) for _ in range(7)]
+        dist = distances(points)
+        order = optimize_order(dist, time_budget=1.0)
+        assert sorted(order) == list(range(7))
+        assert path_length(dist, order) <= brute_force(dist) * 1.05 + 1e-9
+
+
+def test_points_on_a_line_are_visited_in_sequence():
+    points = [(x, 0.0) for x in (5, 1, 9, 3, 7, 0, 8, 2, 6, 4)]
+    dist = distances(points)
+    order = optimize_order(dist, time_budget=1.0)
+    assert path_length(dist, order) == 9.0
+
+
+def test_never_longer_than_the_initial_order():
+    rng = random.Random(3)
+    points = [(rng.random(), rng.random()) for _ in range(60)]
+    dist = distances(points)
+    initial = list(range(60))
+    rng.shuffle(initial)
+    order = optimize_order(dist, time_budget=0.05, initial=initial)
+    assert sorted(order) == list(range(60))
+    assert path_length(dist, order) <= path_length(dist, initial)
+
+
+def test_trivial_sizes_return_initial_order():
+    assert optimize_order([]) == []
+    assert optimize_order([[0.0]]) == [0]
+    assert optimize_order([[0.0, 1.0], [1.0, 0.0]], initial=[1, 0]) == [1, 0]
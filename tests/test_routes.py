@@ -0,0 +1,134 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from mongomock_motor import AsyncMongoMockClient
+
+from models import Customer, Job, Pool
+from routers import routes
+
+LOCATIONS = {"c1": (0.0, 0.0), "c2": (0.0, 0.2), "c3": (0.0, 0.1)}
+
+
+@pytest.fixture
+def db(monkeypatch):
+    database = AsyncMongoMockClient()["test"]
+    routes.init_db(database)
+
+    async def noop(*args, **kwargs):
+        return 0.0
+
+    monkeypatch.setattr(routes, "invalidate_plans", noop)
+    monkeypatch.setattr(routes, "estimate_travel", noop)
+
+    async def setup():
+        await database.routes.insert_one({"id": "r1", "jobs": ["j1", "j2", "j3"], "service_minutes": 90.0})
+        await database.jobs.insert_many([{"id": f"j{n}", "customer_id": f"c{n}"} for n in (1, 2, 3)])
+
+    asyncio.run(setup())
+    return database
+
+
+def locations(monkeypatch, before=None):
+    async def customer_locations(customer_ids):
+        if before:
+            await before()
+        return {c: LOCATIONS[c] for c in customer_ids if c in LOCATIONS}
+
+    monkeypatch.setattr(routes, "customer_locations", customer_locations)
+
+
+def test_optimize_persists_new_order(db, monkeypatch):
+    locations(monkeypatch)
+
+    async def scenario():
+        result = await routes.optimize_route("r1", persist=True, time_budget_ms=10)
+        return result, await db.routes.find_one({"id": "r1"})
+
+    result, route = asyncio.run(scenario())
+    assert result["optimized_order"] in (["j1", "j3", "j2"], ["j2", "j3", "j1"])
+    assert route["jobs"] == result["optimized_order"]
+
+
+def test_optimize_conflicts_with_concurrent_membership_change(db, monkeypatch):
+    async def add_job():
+        await db.routes.update_one({"id": "r1"}, {"$push": {"jobs": "j4"}})
+
+    locations(monkeypatch, add_job)
+
+    async def scenario():
+        with pytest.raises(HTTPException) as error:
+            await routes.optimize_route("r1", persist=True, time_budget_ms=10)
+        return error.value, await db.routes.find_one({"id": "r1"})
+
+    error, route = asyncio.run(scenario())
+    assert error.status_code == 409
+    assert route["jobs"] == ["j1", "j2", "j3", "j4"]
+
+
+def pool(pool_id):
+    return Pool(
+        id=pool_id, name=pool_id, type="In-Ground", color="#0000ff", gallons=15000, equipment=[], last_service="2025-03-01"
+    ).model_dump()
+
+
+def job(job_id, customer_id, pools=()):
+    return Job(
+        id=job_id, customer_id=customer_id, customer_name=customer_id, customer_address="1 Main St", service_type="Routine Service",
+        scheduled_date="2025-03-03", scheduled_time="09:00 AM", technician="Tech", pools=list(pools)
+    ).model_dump()
+
+
+async def seed_expand(db):
+    await db.customers.insert_many([
+        Customer(
+            id=customer_id, name=customer_id, email="a@example.com", phone="555", address="1 Main St", service_day="Monday",
+            pools=[pool(f"{customer_id}-main"), pool(f"{customer_id}-spa")]
+        ).model_dump()
+        for customer_id in ("e1", "e2")
+    ])
+    await db.jobs.insert_many([job("k1", "e1"), job("k2", "e2", ["e2-spa"])])
+    # k3 was deleted but is still listed on the route
+    await db.routes.insert_one({
+        "id": "r2", "name": "Monday", "technician_id": "t1", "technician_name": "Tech", "day": "Monday",
+        "jobs": ["k2", "k3", "k1"]
+    })
+
+
+def test_expand_stops_in_route_order(db):
+    async def scenario():
+        await seed_expand(db)
+        full = await routes.expand_stops(["k2", "k3", "k1"], {"jobs", "customers", "pools"})
+        customers_only = await routes.expand_stops(["k2"], {"customers"})
+        return full, customers_only
+
+    full, customers_only = asyncio.run(scenario())
+    assert [stop["job_id"] for stop in full] == ["k2", "k3", "k1"]
+    assert [stop["job"]["id"] if stop["job"] else None for stop in full] == ["k2", None, "k1"]
+    # A job's pool ids narrow the pools; without them every pool is serviced
+    assert [[p["id"] for p in stop["pools"]] for stop in full] == [["e2-spa"], [], ["e1-main", "e1-spa"]]
+    assert [stop.get("customer", {}).get("id") for stop in full] == ["e2", None, "e1"]
+    assert "pools" not in full[0]["customer"]
+
+    assert customers_only == [{"job_id": "k2", "customer": customers_only[0]["customer"]}]
+    assert customers_only[0]["customer"]["id"] == "e2"
+    assert "pools" not in customers_only[0]["customer"]
+
+
+def test_get_route_expand(db):
+    async def scenario():
+        await seed_expand(db)
+        plain = await routes.get_route("r2", expand=None)
+        expanded = await routes.get_route("r2", expand="jobs, pools")
+        with pytest.raises(HTTPException) as error:
+            await routes.get_route("r2", expand="jobs,invoices")
+        return plain, expanded, error.value
+
+    plain, expanded, error = asyncio.run(scenario())
+    assert plain.stops is None
+    assert [stop.job_id for stop in expanded.stops] == ["k2", "k3", "k1"]
+    assert expanded.stops[0].job.customer_id == "e2"
+    assert expanded.stops[0].customer is None
+    assert [p.id for p in expanded.stops[2].pools] == ["e1-main", "e1-spa"]
+    assert error.status_code == 400
+    assert "invoices" in error.detail
@@ -0,0 +1,83 @@
+import asyncio
+import random
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import locks, scheduling
+from services.scheduling import DaySchedule, booking, find_conflicts, parse_time
+
+
+@pytest.fixture
+def db():
+    database = AsyncMongoMockClient()["test"]
+    scheduling.init_db(database)
+    locks.init_db(database)
+    asyncio.run(locks.ensure_indexes())
+    return database
+
+
+def job(job_id, time, technician="Ana", date="2026-03-02", status="scheduled"):
+    # Repair with no pools: 45 minutes on site
+    return {
+        "id": job_id, "customer_id": "c1", "technician": technician, "status": status,
+        "scheduled_date": date, "scheduled_time": time, "service_type": "Repair"
+    }
+
+
+def test_parse_time_formats():
+    assert parse_time("09:30 AM") == 570
+    assert parse_time("2:05 pm") == 845
+    assert parse_time("14:30") == 870
+    assert parse_time("soon") is None
+    assert parse_time(None) is None
+
+
+def test_day_schedule_matches_brute_force():
+    rng = random.Random(3)
+    bookings = []
+    for k in range(200):
+        start = rng.randrange(0, 600)
+        bookings.append((start, start + rng.randrange(5, 120), f"j{k}"))
+    schedule = DaySchedule()
+    for entry in bookings:
+        schedule.add(*entry)
+    for _ in range(200):
+        start = rng.randrange(0, 700)
+        end = start + rng.randrange(1, 90)
+        expected = sorted(b for b in bookings if b[0] < end and b[1] > start)
+        assert schedule.overlapping(start, end) == expected
+
+
+def test_find_conflicts_same_technician_and_day_only(db):
+    async def scenario():
+        await db.customers.insert_one({"id": "c1", "pools": []})
+        await db.jobs.insert_many([
+            job("early", "08:00 AM"),
+            job("overlap", "09:00 AM"),
+            job("other-tech", "09:00 AM", technician="Ben"),
+            job("other-day", "09:00 AM", date="2026-03-03"),
+            job("done", "09:00 AM", status="completed"),
+        ])
+        return await find_conflicts(job("new", "09:30 AM"))
+
+    conflicts = asyncio.run(scenario())
+    assert [c["id"] for c in conflicts] == ["overlap"]
+    assert (conflicts[0]["start_minute"], conflicts[0]["end_minute"]) == (540, 585)
+
+
+def test_concurrent_bookings_of_one_day_take_turns(db):
+    async def book(job_id):
+        doc = job(job_id, "09:00 AM")
+        async with booking(doc):
+            if await find_conflicts(doc):
+                return False
+            await asyncio.sleep(0.01)
+            await db.jobs.insert_one(doc)
+            return True
+
+    async def scenario():
+        await db.customers.insert_one({"id": "c1", "pools": []})
+        return await asyncio.gather(book("a"), book("b"))
+
+    assert sorted(asyncio.run(scenario())) == [False, True]
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from services import service_time
+from services.service_time import estimate_fields, service_minutes
+
+
+@pytest.fixture
+def db():
+    database = AsyncMongoMockClient()["test"]
+    service_time.init_db(database)
+    return database
+
+
+def test_service_minutes_counts_serviced_pools():
+    customer = {"pools": [
+        {"id": "p1", "type": "In-Ground", "gallons": 20000, "equipment": ["pump", "filter"]},
+        {"id": "p2", "type": "Spa/Hot Tub", "gallons": 500},
+    ]}
+    assert service_minutes({"service_type": "Repair"}, customer) == 45 + 20 + 4 + 6 + 10 + 0.1
+    assert service_minutes({"service_type": "Repair", "pools": ["p2"]}, customer) == 45 + 10 + 0.1
+    assert service_minutes({"service_type": "Other"}, None) == 20
+
+
+def test_backfill_estimates_fills_only_routes_without_them(db):
+    async def scenario():
+        await db.customers.insert_many([
+            {"id": "c1", "location": {"type": "Point", "coordinates": [-97.74, 30.27]}, "pools": []},
+            {"id": "c2", "location": {"type": "Point", "coordinates": [-97.70, 30.40]}, "pools": []},
+        ])
+        await db.jobs.insert_many([
+            {"id": "j1", "customer_id": "c1", "service_type": "Routine Service"},
+            {"id": "j2", "customer_id": "c2", "service_type": "Repair"},
+        ])
+        await db.routes.insert_many([
+            {"id": "old", "jobs": ["j1", "j2"], "estimated_duration": 120},
+            {"id": "new", "jobs": ["j1"], **estimate_fields(99.0, 0.0)},
+        ])
+        filled = await service_time.backfill_estimates()
+        return filled, await db.routes.find_one({"id": "old"}), await db.routes.find_one({"id": "new"})
+
+    filled, old, new = asyncio.run(scenario())
+    assert filled == 1
+    assert old["service_minutes"] == 10 + 45
+    assert old["travel_minutes"] > 0
+    assert old["estimated_duration"] == round(old["service_minutes"] + old["travel_minutes"])
+    assert new["service_minutes"] == 99.0
+
+
+def test_backfill_estimates_route_edited_while_estimating(db, monkeypatch):
+    real = service_time.estimate_route
+    edited = []
+
+    async def estimate_route(job_ids):
+        if not edited:
+            # A stop added meanwhile: the incremental update creates the estimate fields
+            edited.append(True)
+            await db.routes.update_one(
+                {"id": "old"}, {"$push": {"jobs": "j2"}, "$inc": {"service_minutes": 45, "travel_minutes": 5}}
+            )
+        return await real(job_ids)
+
+    monkeypatch.setattr(service_time, "estimate_route", estimate_route)
+
+    async def scenario():
+        await db.customers.insert_many([
+            {"id": "c1", "location": {"type": "Point", "coordinates": [-97.74, 30.27]}, "pools": []},
+            {"id": "c2", "location": {"type": "Point", "coordinates": [-97.70, 30.40]}, "pools": []},
+        ])
+        await db.jobs.insert_many([
+            {"id": "j1", "customer_id": "c1", "service_type": "Routine Service"},
+            {"id": "j2", "customer_id": "c2", "service_type": "Repair"},
+        ])
+        await db.routes.insert_one({"id": "old", "jobs": ["j1"]})
+        filled = await service_time.backfill_estimates()
+        return filled, await db.routes.find_one({"id": "old"}), await real(["j1", "j2"])
+
+    filled, route, expected = asyncio.run(scenario())
+    assert filled == 1
+    assert route["service_minutes"] == expected["service_minutes"] == 10 + 45
+    assert route["travel_minutes"] == expected["travel_minutes"]
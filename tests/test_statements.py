@@ -0,0 +1,86 @@
+import asyncio
+from datetime import date, datetime, timezone
+
+from mongomock_motor import AsyncMongoMockClient
+
+from services import statements
+from services.statements import _merged, build_statement
+
+
+async def groups(*items):
+    for item in items:
+        yield item
+
+
+def invoice(invoice_id, issue_date, total, **fields):
+    return {"id": invoice_id, "customer_id": "c1", "customer_name": "Pat", "invoice_number": invoice_id,
+            "issue_date": issue_date, "due_date": issue_date, "total": total, **fields}
+
+
+def payment(payment_id, invoice_id, amount, day):
+    return {"id": payment_id, "customer_id": "c1", "invoice_id": invoice_id, "amount": amount,
+            "method": "card", "created_at": datetime(2025, 3, day, tzinfo=timezone.utc)}
+
+
+def test_merged_pairs_groups_by_customer():
+    async def collect():
+        merged = _merged(groups(("a", ["ia"]), ("c", ["ic"])), groups(("b", ["pb"]), ("c", ["pc"])))
+        return [item async for item in merged]
+
+    assert asyncio.run(collect()) == [("a", ["ia"], []), ("b", [], ["pb"]), ("c", ["ic"], ["pc"])]
+
+
+def test_build_statement_balances():
+    invoices = [invoice("i1", "2025-02-10", 100.0), invoice("i2", "2025-03-05", 50.0)]
+    payments = [payment("p1", "i1", 40.0, 1), payment("p2", "i1", 60.0, 20)]
+    statement = build_statement("c1", "2025-03", date(2025, 3, 1), date(2025, 4, 1), invoices, payments)
+    assert statement["opening_balance"] == 100.0
+    assert [i["id"] for i in statement["invoices"]] == ["i2"]
+    assert [p["id"] for p in statement["payments"]] == ["p1", "p2"]
+    assert statement["closing_balance"] == 50.0
+
+
+def test_build_statement_ignores_payments_on_excluded_invoices():
+    # i9 was cancelled or deleted, so it is not among the invoices
+    payments = [payment("p1", "i1", 40.0, 3), payment("p9", "i9", 25.0, 4)]
+    statement = build_statement(
+        "c1", "2025-03", date(2025, 3, 1), date(2025, 4, 1), [invoice("i1", "2025-03-01", 40.0)], payments
+    )
+    assert statement["total_paid"] == 40.0
+    assert statement["closing_balance"] == 0.0
+
+
+def test_build_statement_uses_paid_amount_without_ledger():
+    invoices = [
+        invoice("i1", "2025-01-10", 80.0, paid_amount=80.0, paid_date="2025-02-01"),
+        invoice("i2", "2025-03-02", 30.0, paid_amount=30.0, paid_date="2025-03-15"),
+        # Paid after the month: still owed at its end
+        invoice("i3", "2025-03-03", 20.0, paid_amount=20.0, paid_date="2025-04-02"),
+        # Has a ledger, so paid_amount is not counted again
+        invoice("i4", "2025-03-04", 10.0, paid_amount=10.0, paid_date="2025-03-04"),
+    ]
+    payments = [payment("p4", "i4", 10.0, 4)]
+    statement = build_statement("c1", "2025-03", date(2025, 3, 1), date(2025, 4, 1), invoices, payments)
+    assert statement["opening_balance"] == 0.0
+    assert [(p["invoice_id"], p["date"]) for p in statement["payments"]] == [("i4", "2025-03-04"), ("i2", "2025-03-15")]
+    assert statement["closing_balance"] == 20.0
+
+
+def test_generate_statements_knows_ledger_after_month_end():
+    database = AsyncMongoMockClient()["test"]
+    statements.init_db(database)
+
+    async def scenario():
+        await database.invoices.insert_many([
+            invoice("i1", "2025-03-02", 30.0, status="paid", paid_amount=30.0, paid_date="2025-04-03"),
+            invoice("i2", "2025-03-05", 15.0, status="cancelled", paid_amount=0.0),
+        ])
+        await database.payments.insert_many([
+            {**payment("p1", "i1", 30.0, 1), "created_at": datetime(2025, 4, 3, tzinfo=timezone.utc)},
+            payment("p2", "i2", 15.0, 6),
+        ])
+        return [s async for s in statements.generate_statements("2025-03")]
+
+    [statement] = asyncio.run(scenario())
+    assert statement["payments"] == []
+    assert statement["closing_balance"] == 30.0
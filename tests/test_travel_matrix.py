@@ -0,0 +1,46 @@
+import math
+
+import numpy as np
+
+from services.travel_matrix import MatrixCache, haversine_matrix, matrix_for_points, minutes
+
+
+def haversine(a, b):
+    lon1, lat1, lon2, lat2 = map(math.radians, (*a, *b))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(h))
+
+
+def test_haversine_matrix_matches_scalar_formula():
+    points = [[-97.7431, 30.2672], [-95.3698, 29.7604], [-96.7970, 32.7767], [-97.7431, 30.2672]]
+    matrix = haversine_matrix(np.array(points))
+    for i, a in enumerate(points):
+        for j, b in enumerate(points):
+            assert math.isclose(matrix[i, j], haversine(a, b), abs_tol=1e-6)
+    assert np.allclose(matrix, matrix.T)
+    assert np.allclose(np.diag(matrix), 0.0)
+    # Austin to Houston is about 236 km as the crow flies
+    assert 230 < matrix[0, 1] < 240
+
+
+def test_matrix_for_points_reindexes_cached_matrix():
+    points = [[-97.74, 30.27], [-95.37, 29.76], [-96.80, 32.78]]
+    forward = matrix_for_points(points, mode="haversine")
+    backward = matrix_for_points(points[::-1], mode="haversine")
+    assert np.allclose(backward, forward[::-1, ::-1])
+
+
+def test_minutes_uses_average_speed():
+    assert np.allclose(minutes(np.array([[40.0]])), [[60.0]])
+
+
+def test_cache_is_bounded_by_cells():
+    cache = MatrixCache(max_cells=8)
+    cache.put("a", np.zeros((2, 2)))
+    cache.put("b", np.zeros((2, 2)))
+    cache.put("c", np.zeros((2, 2)))
+    assert cache.get("a") is None
+    assert cache.get("c") is not None
+    assert cache.stats()["cells"] == 8
+    cache.put("big", np.zeros((3, 3)))
+    assert cache.get("big") is None